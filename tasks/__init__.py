@@ -1,53 +1,83 @@
+from importlib import import_module
 from invoke import Collection
+import sys
+
+# Import replay and tracing first, so that they can hook into `subprocess.run`
+# before the task modules import it (see tasks/util/replay.py and
+# tasks/util/tracing.py). Replay must go first, so that we trace the replayed
+# commands
+import tasks.util.replay  # noqa: F401
+from tasks.util.tracing import trace_collection
+
+TASK_MODULES = [
+    "benchmark",
+    "coco",
+    "config",
+    "containerd",
+    "cosign",
+    "demo_apps",
+    "docker",
+    "format_code",
+    "gc",
+    "k8s",
+    "k9s",
+    "kata",
+    "kbs",
+    "kernel",
+    "knative",
+    "kubeadm",
+    "nydus",
+    "nydus_snapshotter",
+    "operator",
+    "ovmf",
+    "qemu",
+    "registry",
+    "sc2",
+    "sev",
+    "skopeo",
+    "svsm",
+]
+
+# Invoke options that need the whole task tree, even if the command line also
+# mentions some tasks
+ALL_TASKS_FLAGS = ["--complete", "--print-completion-script"]
+
+
+def get_requested_task_modules(argv):
+    """
+    Work out which task modules we need to load to run a command line
+
+    Importing all the task modules (and their dependencies) takes a significant
+    fraction of the time it takes to run a simple task. Thus, if the command
+    line refers to tasks in a subset of modules, we only load those. If we
+    can not tell what tasks the command line refers to (e.g. `inv --list`) we
+    load all of them. For the same reason, modules in tasks.util import slow
+    third-party packages (e.g. jinja2, psutil, pymysql, or PyYAML) inside the
+    functions that use them
+    """
+    if any([arg in ALL_TASKS_FLAGS for arg in argv]):
+        return TASK_MODULES
+
+    requested_modules = []
+    for arg in argv[1:]:
+        if arg.startswith("-"):
+            continue
+
+        module_name = arg.split(".")[0].replace("-", "_")
+        if module_name in TASK_MODULES and module_name not in requested_modules:
+            requested_modules.append(module_name)
+
+    if len(requested_modules) == 0:
+        return TASK_MODULES
+
+    return requested_modules
 
-from . import coco
-from . import containerd
-from . import cosign
-from . import demo_apps
-from . import docker
-from . import format_code
-from . import gc
-from . import kernel
-from . import k8s
-from . import k9s
-from . import kata
-from . import kbs
-from . import knative
-from . import kubeadm
-from . import nydus
-from . import nydus_snapshotter
-from . import operator
-from . import ovmf
-from . import qemu
-from . import registry
-from . import sc2
-from . import sev
-from . import skopeo
-from . import svsm
 
 ns = Collection(
-    coco,
-    containerd,
-    cosign,
-    demo_apps,
-    docker,
-    format_code,
-    gc,
-    k8s,
-    k9s,
-    kata,
-    kbs,
-    kernel,
-    knative,
-    kubeadm,
-    nydus,
-    nydus_snapshotter,
-    operator,
-    ovmf,
-    qemu,
-    registry,
-    sc2,
-    sev,
-    skopeo,
-    svsm,
+    *[
+        import_module(f"tasks.{module_name}")
+        for module_name in get_requested_task_modules(sys.argv)
+    ]
 )
+
+trace_collection(ns)
@@ -0,0 +1,309 @@
+from difflib import unified_diff
+from invoke import task
+from json import loads as json_loads
+from os import environ
+from os.path import abspath, join
+from statistics import mean, median
+from subprocess import run
+from tasks.util.cmd import run_cmd
+from tasks.util.containerd_events import (
+    ContainerdEventSubscriber,
+    group_events_by_sandbox,
+    write_containerd_event_records,
+)
+from tasks.util.env import KATA_RUNTIMES, PROJ_ROOT, SC2_RUNTIMES
+from tasks.util.k8s_api import k8s_api_get
+from tasks.util.kubeadm import get_kubectl_command
+from tasks.util.pod_tracker import (
+    POD_LIFECYCLE_EVENTS,
+    SC2_DEMO_NAMESPACE,
+    track_pods as do_track_pods,
+    write_pod_records,
+)
+from tasks.util.replay import REPLAY_FILE_ENV_VAR, REPLAY_TIME_SCALE_ENV_VAR
+from tasks.util.toml import TomlTransaction, toml_dump_to_string
+from tempfile import TemporaryDirectory
+from time import sleep, time
+
+# Command lines we use to measure `inv`'s startup latency. Listing all tasks
+# needs to import all the task modules, whereas running a single task only
+# imports the module it belongs to
+STARTUP_BENCHMARK_CMDS = {
+    "all-modules": "inv --list",
+    "one-module": "inv --help nydus-snapshotter.purge",
+}
+
+
+# File where we append one record per pod with the latency of each transition
+# in its lifecycle (see `tasks.util.pod_tracker.track_pods`)
+POD_LIFECYCLE_RECORDS_FILE = "/tmp/sc2_pod_lifecycle.jsonl"
+# File where we write all containerd lifecycle events that we record (see
+# `tasks.util.containerd_events`)
+CONTAINERD_EVENTS_RECORDS_FILE = "/tmp/sc2_containerd_events.jsonl"
+
+# Updates to containerd's config file that we make when installing Kata and
+# SC2 (see `tasks.util.kata.replace_shim`, and `tasks.sc2.install_sc2_runtime`)
+TOML_BENCHMARK_UPDATE = """
+[plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime}]
+runtime_type = "io.containerd.kata-{runtime}.v2"
+privileged_without_host_devices = true
+pod_annotations = [ "io.katacontainers.*",]
+snapshotter = "nydus"
+runtime_path = "/opt/kata/bin/containerd-shim-kata-{runtime}-v2"
+
+[plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime}.options]
+ConfigPath = "/opt/kata/share/defaults/kata-containers/configuration-{runtime}.toml"
+"""
+
+
+def print_benchmark_results(results, unit="ms"):
+    """
+    Print a table with the mean, median, min, and max of a set of samples
+    """
+    header = "{:<30} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+        "Benchmark",
+        "Runs",
+        f"Mean ({unit})",
+        f"Med. ({unit})",
+        f"Min ({unit})",
+        f"Max ({unit})",
+    )
+    print(header)
+    print("-" * len(header))
+    for name, samples in results.items():
+        print(
+            "{:<30} {:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                name,
+                len(samples),
+                mean(samples),
+                median(samples),
+                min(samples),
+                max(samples),
+            )
+        )
+
+
+@task
+def startup(ctx, repeats=10):
+    """
+    Measure the startup latency of `inv` when loading all/one task module(s)
+    """
+    results = {}
+    for name, cmd in STARTUP_BENCHMARK_CMDS.items():
+        results[name] = []
+        for _ in range(repeats):
+            start_ts = time()
+            result = run(cmd, shell=True, capture_output=True, cwd=PROJ_ROOT)
+            assert result.returncode == 0, print(result.stderr.decode("utf-8"))
+            results[name].append((time() - start_ts) * 1000)
+
+    print_benchmark_results(results)
+
+
+@task
+def replay(ctx, recording, cmd, repeats=5, time_scale=0.0):
+    """
+    Measure an `inv` command line replaying the commands in a recording
+
+    To record the commands run by, e.g., `inv sc2.deploy` on a real host, run:
+    SC2_RECORD_FILE=/tmp/deploy.json inv sc2.deploy
+
+    and then benchmark the orchestration logic (without running any of the
+    commands) with:
+    inv benchmark.replay --recording /tmp/deploy.json --cmd "sc2.deploy"
+    """
+    env = dict(environ)
+    env[REPLAY_FILE_ENV_VAR] = abspath(recording)
+    env[REPLAY_TIME_SCALE_ENV_VAR] = str(time_scale)
+
+    results = {cmd: []}
+    for _ in range(repeats):
+        start_ts = time()
+        result = run(
+            f"inv {cmd}", shell=True, capture_output=True, cwd=PROJ_ROOT, env=env
+        )
+        if result.returncode != 0:
+            print(result.stdout.decode("utf-8"))
+            print(f"ERROR: replaying 'inv {cmd}' failed:")
+            print(result.stderr.decode("utf-8"))
+            raise RuntimeError("Error replaying command!")
+        results[cmd].append((time() - start_ts) * 1000)
+
+    print_benchmark_results(results)
+
+
+@task
+def toml_patch(ctx, repeats=20, config_file=None):
+    """
+    Compare patching a TOML file in place vs re-writing it (containerd's
+    default config file, unless given a different one). To run it without
+    containerd, use the copy of its default config file in the unit tests (see
+    `inv containerd.dump-default-config`):
+    --config-file ./tests/unit/data/containerd_config_default.toml
+    """
+    if config_file is None:
+        toml_str = run_cmd("containerd config default").stdout
+    else:
+        with open(config_file, "r") as fh:
+            toml_str = fh.read()
+
+    with TemporaryDirectory() as tmp_dir:
+        toml_path = join(tmp_dir, "config.toml")
+        with open(toml_path, "w") as fh:
+            fh.write(toml_str)
+
+        results = {"full-rewrite": [], "in-place-patch": []}
+        outputs = {}
+        for name in results:
+            for _ in range(repeats):
+                start_ts = time()
+                transaction = TomlTransaction(toml_path, requires_root=False)
+                for runtime in KATA_RUNTIMES + SC2_RUNTIMES:
+                    transaction.update(TOML_BENCHMARK_UPDATE.format(runtime=runtime))
+
+                if name == "full-rewrite":
+                    outputs[name] = toml_dump_to_string(transaction.conf)
+                else:
+                    outputs[name] = transaction.get_updated_str()
+                results[name].append((time() - start_ts) * 1000)
+
+    print_benchmark_results(results)
+
+    # Also report how big the change to the file is with each approach
+    print()
+    for name, output in outputs.items():
+        diff = unified_diff(toml_str.splitlines(), output.splitlines(), lineterm="")
+        num_changed = len(
+            [
+                line
+                for line in diff
+                if line[:1] in ["+", "-"] and line[:3] not in ["+++", "---"]
+            ]
+        )
+        print(f"{name}: {num_changed} lines changed")
+
+
+@task
+def k8s_api(ctx, repeats=50, path="/api/v1/nodes"):
+    """
+    Compare the per-call latency of querying the API server with `kubectl` vs
+    with our (keep-alive) API client
+    """
+    # The first call to the API client also parses the kubeconfig and opens
+    # the connection, so we report it separately
+    start_ts = time()
+    if k8s_api_get(path) is None:
+        print(f"ERROR: can not query {path} with the k8s API client")
+        raise RuntimeError("Error querying k8s API server!")
+    first_call_ms = (time() - start_ts) * 1000
+
+    results = {"kubectl": [], "api-client": []}
+    kubectl_cmd = get_kubectl_command(f"get --raw {path}")
+    for _ in range(repeats):
+        start_ts = time()
+        run_cmd(kubectl_cmd)
+        results["kubectl"].append((time() - start_ts) * 1000)
+
+        start_ts = time()
+        k8s_api_get(path)
+        results["api-client"].append((time() - start_ts) * 1000)
+
+    print_benchmark_results(results)
+    print(f"\nAPI client first call (incl. connection set-up): {first_call_ms:.1f} ms")
+
+
+@task
+def track_pods(
+    ctx,
+    num_pods=1,
+    ns=SC2_DEMO_NAMESPACE,
+    label=None,
+    records_file=POD_LIFECYCLE_RECORDS_FILE,
+    timeout=None,
+    debug=False,
+):
+    """
+    Timestamp the lifecycle of the next pod(s) to become ready in a namespace
+
+    Start it before deploying an app (e.g. in the background, while running
+    one of the cold-start tests), and aggregate the results with the command
+    below. If we time-out, we still write the partial records:
+    inv benchmark.pod-lifecycle
+    """
+    records = do_track_pods(
+        ns=ns,
+        num_pods=int(num_pods),
+        label=label,
+        timeout=None if timeout is None else int(timeout),
+        debug=debug,
+    )
+    write_pod_records(records, records_file)
+
+    for record in records:
+        latencies = ", ".join(
+            [f"{event}={ms:.1f}" for event, ms in record["latencies_ms"].items()]
+        )
+        print(f"{record['pod']} ({record['runtime_class']}): {latencies} (ms)")
+
+    num_ready = len([record for record in records if not record["timed_out"]])
+    if num_ready < int(num_pods):
+        print(f"ERROR: only {num_ready}/{num_pods} pod(s) became ready")
+        raise RuntimeError("Timed-out tracking pods!")
+
+
+@task
+def pod_lifecycle(ctx, records_file=POD_LIFECYCLE_RECORDS_FILE):
+    """
+    Aggregate the pod lifecycle latencies per runtime class and snapshotter
+    """
+    results = {}
+    with open(records_file, "r") as fh:
+        for line in fh:
+            record = json_loads(line)
+            key = (record["runtime_class"], record["snapshotter"])
+            results.setdefault(key, {event: [] for event in POD_LIFECYCLE_EVENTS})
+            for event, latency_ms in record["latencies_ms"].items():
+                results[key][event].append(latency_ms)
+
+    for (runtime_class, snapshotter), latencies in sorted(results.items()):
+        print(f"\nruntime={runtime_class} snapshotter={snapshotter}")
+        print_benchmark_results(
+            {event: samples for event, samples in latencies.items() if samples}
+        )
+
+
+@task
+def containerd_events(
+    ctx, records_file=CONTAINERD_EVENTS_RECORDS_FILE, duration=None, debug=False
+):
+    """
+    Record containerd's sandbox, container, and snapshot events
+
+    Run it alongside a benchmark (e.g. one of the cold-start tests), and stop
+    it with Ctrl-C (or after --duration seconds). We then write all events to
+    a file, and print a per-sandbox breakdown
+    """
+    with ContainerdEventSubscriber(debug=debug) as subscriber:
+        print("Recording containerd events (Ctrl-C to stop)...")
+        start_ts = time()
+        try:
+            while duration is None or time() - start_ts < float(duration):
+                sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+
+    records = subscriber.get_records()
+    write_containerd_event_records(records, records_file)
+    print(f"Wrote {len(records)} events to: {records_file}")
+
+    for sandbox_id, sandbox in group_events_by_sandbox(records).items():
+        print(f"\nSandbox {sandbox_id[:12]} (pod: {sandbox['pod']})")
+        first_ts = sandbox["events"][0]["ts"]
+        for record in sandbox["events"]:
+            print(
+                "{:>10.1f} ms  {:<20} {}".format(
+                    (record["ts"] - first_ts) * 1000,
+                    record["topic"],
+                    record["kind"] or "-",
+                )
+            )
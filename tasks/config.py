@@ -0,0 +1,113 @@
+from datetime import datetime
+from invoke import task
+from os.path import join
+from tasks.nydus_snapshotter import (
+    NYDUS_SNAPSHOTTER_CONFIG_FILES,
+    restart_nydus_snapshotter,
+)
+from tasks.util.cmd import run_cmd
+from tasks.util.config import (
+    expand_config_paths,
+    get_config_snapshot,
+    list_config_snapshots,
+    restore_config_snapshot,
+    take_config_snapshot,
+)
+from tasks.util.containerd import restart_containerd
+from tasks.util.env import (
+    CONTAINERD_CONFIG_FILE,
+    KATA_CONFIG_DIR,
+    print_dotted_line,
+    print_success,
+)
+
+NYDUS_SNAPSHOTTER_SERVICE_FILE = "/etc/systemd/system/nydus-snapshotter.service"
+
+# All the config files that SC2 manages, grouped by the daemon that reads them
+# (and thus needs a restart when they change). The Kata shim reads its config
+# file every time it starts a sandbox, so it needs no restart. We restart the
+# daemons in this order, as the nydus-snapshotter must start before containerd
+MANAGED_CONFIG_FILES = [
+    ("nydus-snapshotter", NYDUS_SNAPSHOTTER_CONFIG_FILES),
+    ("nydus-snapshotter", [NYDUS_SNAPSHOTTER_SERVICE_FILE]),
+    ("containerd", [CONTAINERD_CONFIG_FILE]),
+    (None, [join(KATA_CONFIG_DIR, "configuration-*.toml")]),
+]
+
+
+def is_service_active(service):
+    result = run_cmd(f"sudo systemctl is-active {service}", check=False)
+    return result.stdout.strip() == "active"
+
+
+def restart_daemons(changed_paths, debug=False):
+    """
+    Restart the (running) daemons that own any of the changed config files
+    """
+    daemons = []
+    for daemon, file_paths in MANAGED_CONFIG_FILES:
+        if daemon is None or daemon in daemons:
+            continue
+
+        if any([p in changed_paths for p in expand_config_paths(file_paths)]):
+            daemons.append(daemon)
+
+    if NYDUS_SNAPSHOTTER_SERVICE_FILE in changed_paths:
+        run_cmd("sudo systemctl daemon-reload", debug=debug)
+
+    for daemon in daemons:
+        if not is_service_active(daemon):
+            if debug:
+                print(f"Not restarting {daemon} as it is not running")
+            continue
+
+        print_dotted_line(f"Restarting {daemon}")
+        if daemon == "containerd":
+            restart_containerd(debug=debug)
+        else:
+            restart_nydus_snapshotter()
+        print_success()
+
+
+@task
+def snapshot(ctx, name=None):
+    """
+    Snapshot all SC2-managed config files, optionally giving it a name
+    """
+    file_paths = expand_config_paths(
+        [p for _, file_paths in MANAGED_CONFIG_FILES for p in file_paths]
+    )
+    manifest = take_config_snapshot(file_paths, name=name)
+    print(f"Config snapshot: {manifest['id']} ({len(file_paths)} files)")
+
+
+@task
+def restore(ctx, snapshot, debug=False):
+    """
+    Restore the config files in a snapshot (by ID or name), and restart the
+    daemons whose config changed
+    """
+    manifest = get_config_snapshot(snapshot)
+    changed_paths = restore_config_snapshot(manifest)
+    if len(changed_paths) == 0:
+        print(f"Config already matches snapshot {manifest['id']}")
+        return
+
+    for changed_path in changed_paths:
+        print(f"Restored: {changed_path}")
+
+    restart_daemons(changed_paths, debug=debug)
+
+
+@task
+def list_snapshots(ctx):
+    """
+    List all config snapshots
+    """
+    for manifest in list_config_snapshots():
+        created = datetime.fromtimestamp(manifest["created"]).isoformat(
+            timespec="seconds"
+        )
+        names = ", ".join(manifest["names"])
+        num_files = len(manifest["files"])
+        print(f"{manifest['id']}\t{created}\t{num_files} files\t{names}")
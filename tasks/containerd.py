@@ -1,5 +1,4 @@
 from invoke import task
-from os import stat
 from os.path import join
 from subprocess import run
 from tasks.util.containerd import (
@@ -17,11 +16,12 @@ from tasks.util.env import (
     CONTAINERD_CONFIG_ROOT,
     PROJ_ROOT,
     print_dotted_line,
+    print_success,
 )
+from tasks.util.host import stat
 from tasks.util.proxy import is_proxy_set, configure_containerd_proxy
 from tasks.util.toml import update_toml
 from tasks.util.versions import CONTAINERD_VERSION, GO_VERSION
-from time import sleep
 
 CONTAINERD_CTR_NAME = "containerd-workon"
 
@@ -34,6 +34,11 @@ CONTAINERD_BINARY_NAMES = [
 CONTAINERD_CTR_BINPATH = "/go/src/github.com/sc2-sys/containerd/bin"
 CONTAINERD_HOST_BINPATH = "/usr/bin"
 
+# Copy of `containerd config default`, that we use in the unit tests
+CONTAINERD_DEFAULT_CONFIG_FIXTURE = join(
+    PROJ_ROOT, "tests", "unit", "data", "containerd_config_default.toml"
+)
+
 
 @task
 def build(ctx, nocache=False, push=False):
@@ -79,6 +84,27 @@ def stop(ctx):
     assert result.returncode == 0
 
 
+@task
+def dump_default_config(ctx, output_file=CONTAINERD_DEFAULT_CONFIG_FIXTURE):
+    """
+    Write the default config of the containerd binary in our image (by default,
+    to re-generate the copy that we use in the unit tests)
+    """
+    docker_cmd = (
+        f"docker run --rm --entrypoint {CONTAINERD_CTR_BINPATH}/containerd "
+        f"{CONTAINERD_IMAGE_TAG} config default"
+    )
+    result = run(docker_cmd, shell=True, capture_output=True)
+    if result.returncode != 0:
+        print(result.stderr.decode("utf-8").strip())
+        raise RuntimeError("Error getting containerd's default config")
+
+    with open(output_file, "w") as fh:
+        fh.write(result.stdout.decode("utf-8"))
+
+    print(f"Wrote containerd v{CONTAINERD_VERSION} default config to {output_file}")
+
+
 def set_log_level(log_level):
     """
     Set containerd's log level, must be one in: info, debug
@@ -172,17 +198,9 @@ def install(debug=False, clean=False):
         raise RuntimeError("containerd config file is empty!")
 
     # Wait for containerd to be ready
-    sleep(2)
-    while not is_containerd_active():
-        if debug:
-            print("Waiting for containerd to be active...")
-
-        sleep(2)
-
-    # Then make sure we can dial the socket
-    wait_for_containerd_socket()
+    wait_for_containerd_socket(debug=debug)
 
-    print("Success!")
+    print_success()
 
 
 def install_bbolt(debug=False, clean=False):
@@ -235,4 +253,4 @@ def install_bbolt(debug=False, clean=False):
 
     rm_container()
 
-    print("Success!")
+    print_success()
@@ -7,6 +7,7 @@ from tasks.util.env import (
     GITHUB_ORG,
     LOCAL_REGISTRY_URL,
     print_dotted_line,
+    print_success,
 )
 from tasks.util.nydus import NYDUSIFY_PATH, nydusify
 
@@ -118,7 +119,7 @@ def do_push_to_local_registry(debug=False):
         )
         assert result.returncode == 0, result.stderr.decode("utf-8").strip()
 
-    print("Success!")
+    print_success()
 
 
 @task
@@ -3,7 +3,7 @@ from os.path import join
 from tasks.svsm import build_svsm_image, build_svsm_kernel_image, build_svsm_qemu_image
 from tasks.util.containerd import build_containerd_image
 from tasks.util.docker import BASE_IMAGE_TAG, build_image
-from tasks.util.env import PROJ_ROOT, print_dotted_line
+from tasks.util.env import PROJ_ROOT, print_dotted_line, print_success
 from tasks.util.kata import build_kata_image
 from tasks.util.nydus import build_nydus_image
 from tasks.util.nydus_snapshotter import build_nydus_snapshotter_image
@@ -44,39 +44,39 @@ def build_all(ctx, nocache=False, push=False):
     """
     print_dotted_line("Building base image")
     build_base_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
 
     print_dotted_line(f"Building containerd image (v{CONTAINERD_VERSION})")
     build_containerd_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
 
     print_dotted_line(f"Building kata image (v{KATA_VERSION})")
     build_kata_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
 
     print_dotted_line(f"Building nydus image (v{NYDUS_VERSION})")
     build_nydus_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
 
     print_dotted_line(
         f"Building nydus-snapshotter image (v{NYDUS_SNAPSHOTTER_VERSION})"
     )
     build_nydus_snapshotter_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
 
     print_dotted_line(f"Building OVMF image ({OVMF_VERSION})")
     build_ovmf_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
 
     print_dotted_line("Building SVSM guest kernel image")
     build_svsm_kernel_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
 
     print_dotted_line("Building SVSM QEMU image")
     build_svsm_qemu_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
 
     # This must be after SVSM's qemu and kernel
     print_dotted_line("Building SVSM IGVM image")
     build_svsm_image(nocache, push, debug=False)
-    print("Success!")
+    print_success()
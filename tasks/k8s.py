@@ -2,7 +2,14 @@ from os import makedirs
 from os.path import exists, join
 from shutil import rmtree
 from subprocess import run
-from tasks.util.env import BIN_DIR, CONF_FILES_DIR, print_dotted_line
+from tasks.util.env import (
+    APT_LOCK_TIMEOUT_SECS,
+    BIN_DIR,
+    CONF_FILES_DIR,
+    print_dotted_line,
+    print_success,
+)
+from tasks.util.host import exists as host_exists
 from tasks.util.network import download_binary, symlink_global_bin
 from tasks.util.proxy import is_proxy_set, configure_kubelet_proxy
 from tasks.util.versions import K8S_VERSION, CNI_VERSION, CRICTL_VERSION
@@ -19,7 +26,7 @@ def install_cni(debug=False, clean=False):
     if clean:
         run("sudo rm -rf {}".format(cni_dir), shell=True, check=True)
 
-    if not exists(cni_dir):
+    if not host_exists(cni_dir):
         run("sudo mkdir -p {}".format(cni_dir), shell=True, check=True)
 
     cni_tar = "cni-plugins-linux-amd64-v{}.tgz".format(CNI_VERSION)
@@ -104,7 +111,8 @@ def install_k8s(debug=False, clean=False):
 
     # Also install some APT dependencies
     result = run(
-        "sudo DEBIAN_FRONTEND=noninteractive apt install -y conntrack socat",
+        "sudo DEBIAN_FRONTEND=noninteractive apt install -y "
+        f"-o DPkg::Lock::Timeout={APT_LOCK_TIMEOUT_SECS} conntrack socat",
         shell=True,
         capture_output=True,
     )
@@ -155,15 +163,15 @@ def install(debug=False, clean=False):
     """
     print_dotted_line(f"Installing CNI (v{CNI_VERSION})")
     install_cni(debug=debug, clean=clean)
-    print("Success!")
+    print_success()
 
     print_dotted_line(f"Installing crictl (v{CRICTL_VERSION})")
     install_crictl(debug=debug)
-    print("Success!")
+    print_success()
 
     print_dotted_line(f"Installing kubectl & friends (v{K8S_VERSION})")
     install_k8s(debug=debug, clean=clean)
-    print("Success!")
+    print_success()
 
     # If proxy environment variables present configure kubelet proxies
     if is_proxy_set():
@@ -1,8 +1,8 @@
 from os.path import join
 from os import makedirs
-from shutil import copy, rmtree
+from shutil import rmtree
 from subprocess import run
-from tasks.util.env import BIN_DIR, print_dotted_line
+from tasks.util.env import BIN_DIR, print_dotted_line, print_success
 from tasks.util.network import symlink_global_bin
 from tasks.util.versions import K9S_VERSION
 
@@ -38,7 +38,12 @@ def install(debug=False):
 
     # Copy k9s into place
     binary_path = join(BIN_DIR, "k9s")
-    copy(join(workdir, "k9s"), binary_path)
+    result = run(
+        "cp {} {}".format(join(workdir, "k9s"), binary_path),
+        shell=True,
+        capture_output=True,
+    )
+    assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
 
     # Remove tar
     rmtree(workdir)
@@ -46,4 +51,4 @@ def install(debug=False):
     # Symlink for k9s command globally
     symlink_global_bin(binary_path, "k9s", debug=debug)
 
-    print("Success!")
+    print_success()
@@ -18,7 +18,7 @@ from tasks.util.kata import (
     run_kata_workon_ctr,
     stop_kata_workon_ctr,
 )
-from tasks.util.toml import read_value_from_toml, update_toml
+from tasks.util.toml import read_value_from_toml, update_toml, update_tomls
 
 
 def set_log_level(log_level):
@@ -26,23 +26,25 @@ def set_log_level(log_level):
     Set kata's log level, must be one in: info, debug
     """
     enable_debug = str(log_level == "debug").lower()
+    updated_toml_str = """
+    [hypervisor.qemu]
+    enable_debug = {enable_debug}
+
+    [agent.kata]
+    enable_debug = {enable_debug}
+    debug_console_enabled = {enable_debug}
 
-    for runtime in KATA_RUNTIMES + SC2_RUNTIMES:
-        conf_file_path = join(KATA_CONFIG_DIR, "configuration-{}.toml".format(runtime))
-        updated_toml_str = """
-        [hypervisor.qemu]
-        enable_debug = {enable_debug}
-
-        [agent.kata]
-        enable_debug = {enable_debug}
-        debug_console_enabled = {enable_debug}
-
-        [runtime]
-        enable_debug = {enable_debug}
-        """.format(
-            enable_debug=enable_debug
-        )
-        update_toml(conf_file_path, updated_toml_str)
+    [runtime]
+    enable_debug = {enable_debug}
+    """.format(
+        enable_debug=enable_debug
+    )
+    update_tomls(
+        {
+            join(KATA_CONFIG_DIR, f"configuration-{runtime}.toml"): updated_toml_str
+            for runtime in KATA_RUNTIMES + SC2_RUNTIMES
+        }
+    )
 
 
 @task
@@ -2,6 +2,7 @@ from invoke import task
 from os.path import exists, join
 from subprocess import run
 from tasks.util.env import GHCR_URL, GITHUB_ORG
+from tasks.util.host import exists as host_exists
 from tasks.util.kbs import (
     SIMPLE_KBS_DIR,
     SIGNATURE_POLICY_NONE,
@@ -24,7 +25,7 @@ def check_kbs_dir():
         raise RuntimeError("Simple KBS local checkout not found!")
 
     target_dir = join(SIMPLE_KBS_DIR, "target")
-    if not exists(target_dir):
+    if not host_exists(target_dir):
         print("Populating {} with the pre-compiled binaries...".format(target_dir))
         tmp_ctr_name = "simple-kbs-workon"
         docker_cmd = "docker run -d --entrypoint bash --name {} {}".format(
@@ -2,17 +2,32 @@ from invoke import task
 from os import makedirs
 from os.path import exists, join
 from shutil import rmtree
-from tasks.util.env import KATA_CONFIG_DIR, KATA_IMG_DIR, KATA_RUNTIMES, SC2_RUNTIMES
+from tasks.util.env import (
+    APT_LOCK_TIMEOUT_SECS,
+    KATA_CONFIG_DIR,
+    KATA_IMG_DIR,
+    KATA_RUNTIMES,
+    SC2_RUNTIMES,
+)
+from tasks.util.host import read_file
 from tasks.util.kata import KATA_SOURCE_DIR, copy_from_kata_workon_ctr
 from tasks.util.kernel import grub_update_default_kernel
-from tasks.util.toml import update_toml
+from tasks.util.toml import update_tomls
 from tasks.util.versions import GUEST_KERNEL_VERSION
 from subprocess import run
 
 
 def build_guest(debug=False, hot_replace=False):
     """
-    Build the guest kernel.
+    Build the guest kernel, and update all Kata config files to use it
+    """
+    bzimage_path = do_build_guest(debug=debug, hot_replace=hot_replace)
+    update_guest_kernel_config(bzimage_path)
+
+
+def do_build_guest(debug=False, hot_replace=False):
+    """
+    Build the guest kernel, and copy it to Kata's image directory.
 
     We use Kata's build-kernel.sh to build the guest kernel. Note that, for
     the time being, there is no difference between SC2 and non-SC2 guest
@@ -21,12 +36,11 @@ def build_guest(debug=False, hot_replace=False):
     """
     kernel_build_dir = "/tmp/sc2-guest-kernel-build-dir"
 
-    if exists(kernel_build_dir):
-        run(f"sudo rm -rf {kernel_build_dir}", shell=True, check=True)
-
-    makedirs(kernel_build_dir)
-    makedirs(join(kernel_build_dir, "kernel"))
-    makedirs(join(kernel_build_dir, "scripts"))
+    # When replaying a recording we do not actually remove the directory, so
+    # it may already exist
+    run(f"sudo rm -rf {kernel_build_dir}", shell=True, check=True)
+    makedirs(join(kernel_build_dir, "kernel"), exist_ok=True)
+    makedirs(join(kernel_build_dir, "scripts"), exist_ok=True)
 
     script_files = [
         "kernel/build-kernel.sh",
@@ -68,7 +82,8 @@ def build_guest(debug=False, hot_replace=False):
 
     # Install APT deps needed to build guest kernel
     sudo_cmd = (
-        "sudo DEBIAN_FRONTEND=noninteractive apt install -y bison flex "
+        "sudo DEBIAN_FRONTEND=noninteractive apt install -y "
+        f"-o DPkg::Lock::Timeout={APT_LOCK_TIMEOUT_SECS} bison flex "
         "libelf-dev libssl-dev make"
     )
     out = run(sudo_cmd, shell=True, capture_output=True)
@@ -90,9 +105,9 @@ def build_guest(debug=False, hot_replace=False):
             print(out.stdout.decode("utf-8"))
 
     # Copy the built kernel into the desired path
-    with open(join(kernel_build_dir, "kernel", "kata_config_version"), "r") as fh:
-        kata_config_version = fh.read()
-        kata_config_version = kata_config_version.strip()
+    kata_config_version = read_file(
+        join(kernel_build_dir, "kernel", "kata_config_version")
+    ).strip()
 
     sc2_kernel_name = "vmlinuz-confidential-sc2.container"
     bzimage_src_path = join(
@@ -107,16 +122,27 @@ def build_guest(debug=False, hot_replace=False):
     bzimage_dst_path = join(KATA_IMG_DIR, sc2_kernel_name)
     run(f"sudo cp {bzimage_src_path} {bzimage_dst_path}", shell=True, check=True)
 
-    # Update the paths in the config files
-    for runtime in KATA_RUNTIMES + SC2_RUNTIMES:
-        conf_file_path = join(KATA_CONFIG_DIR, "configuration-{}.toml".format(runtime))
-        updated_toml_str = """
-        [hypervisor.qemu]
-        kernel = "{new_kernel_path}"
-        """.format(
-            new_kernel_path=bzimage_dst_path
-        )
-        update_toml(conf_file_path, updated_toml_str)
+    return bzimage_dst_path
+
+
+def update_guest_kernel_config(
+    bzimage_path=join(KATA_IMG_DIR, "vmlinuz-confidential-sc2.container")
+):
+    """
+    Point all the Kata config files to the guest kernel that we build
+    """
+    updated_toml_str = """
+    [hypervisor.qemu]
+    kernel = "{new_kernel_path}"
+    """.format(
+        new_kernel_path=bzimage_path
+    )
+    update_tomls(
+        {
+            join(KATA_CONFIG_DIR, f"configuration-{runtime}.toml"): updated_toml_str
+            for runtime in KATA_RUNTIMES + SC2_RUNTIMES
+        }
+    )
 
 
 @task
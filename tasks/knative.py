@@ -1,20 +1,32 @@
 from invoke import task
 from os.path import join
 from json import dumps as json_dumps
-from tasks.util.env import CONF_FILES_DIR, LOCAL_REGISTRY_URL, print_dotted_line
+from tasks.util.aio import run_all
+from tasks.util.env import (
+    CONF_FILES_DIR,
+    LOCAL_REGISTRY_URL,
+    print_dotted_line,
+    print_success,
+)
+from tasks.util.k8s import apply_manifests
 from tasks.util.knative import (
     configure_self_signed_certs as do_configure_self_signed_certs,
-    patch_autoscaler as do_patch_autoscaler,
+    patch_autoscaler_async,
     replace_sidecar as do_replace_sidecar,
 )
-from tasks.util.kubeadm import run_kubectl_command, wait_for_pods_in_ns
+from tasks.util.kubeadm import (
+    run_kubectl_command,
+    run_kubectl_command_async,
+    wait_for_all,
+    wait_for_pods_in_ns,
+    wait_for_service_ingress_ip,
+)
 from tasks.util.registry import (
     HOST_CERT_DIR,
     HOST_CERT_PATH,
     K8S_SECRET_NAME,
 )
 from tasks.util.versions import KNATIVE_VERSION
-from time import sleep
 
 # Namespaces
 KNATIVE_EVENTING_NAMESPACE = "knative-eventing"
@@ -32,20 +44,14 @@ KOURIER_BASE_URL += "/knative-v{}".format(KNATIVE_VERSION)
 
 
 def install_kourier(debug=False):
-    kube_cmd = "apply -f {}".format(join(KOURIER_BASE_URL, "kourier.yaml"))
-    run_kubectl_command(kube_cmd, capture_output=not debug)
+    apply_manifests([join(KOURIER_BASE_URL, "kourier.yaml")], debug=debug)
 
     # Wait for all components to be ready
-    wait_for_pods_in_ns(
-        KNATIVE_SERVING_NAMESPACE,
-        label="app=net-kourier-controller",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KOURIER_NAMESPACE,
-        label="app=3scale-kourier-gateway",
-        expected_num_of_pods=1,
+    wait_for_all(
+        [
+            (KNATIVE_SERVING_NAMESPACE, "app=net-kourier-controller", 1),
+            (KOURIER_NAMESPACE, "app=3scale-kourier-gateway", 1),
+        ],
         debug=debug,
     )
 
@@ -76,8 +82,13 @@ def install_istio(debug=False):
         "apply -f {}".format(join(istio_base_url, "net-istio.yaml")),
         capture_output=not debug,
     )
-    wait_for_pods_in_ns(KNATIVE_SERVING_NAMESPACE, 6)
-    wait_for_pods_in_ns(ISTIO_NAMESPACE, 6)
+    wait_for_all(
+        [
+            (KNATIVE_SERVING_NAMESPACE, None, 6),
+            (ISTIO_NAMESPACE, None, 6),
+        ],
+        debug=debug,
+    )
 
 
 def install_metallb(debug=False):
@@ -88,23 +99,17 @@ def install_metallb(debug=False):
     metalb_version = "0.13.11"
     metalb_url = "https://raw.githubusercontent.com/metallb/metallb/"
     metalb_url += "v{}/config/manifests/metallb-native.yaml".format(metalb_version)
-    kube_cmd = "apply -f {}".format(metalb_url)
-    run_kubectl_command(kube_cmd, capture_output=not debug)
-    wait_for_pods_in_ns(
-        "metallb-system",
-        label="component=controller",
-        expected_num_of_pods=1,
+    apply_manifests([metalb_url], debug=debug)
+    wait_for_all(
+        [
+            ("metallb-system", "component=controller", 1),
+            ("metallb-system", "component=speaker", 1),
+        ],
         debug=debug,
     )
-    wait_for_pods_in_ns(
-        "metallb-system", label="component=speaker", expected_num_of_pods=1, debug=debug
-    )
 
     # Second, configure the IP address pool and L2 advertisement
-    metallb_conf_file = join(CONF_FILES_DIR, "metallb_config.yaml")
-    run_kubectl_command(
-        "apply -f {}".format(metallb_conf_file), capture_output=not debug
-    )
+    apply_manifests([join(CONF_FILES_DIR, "metallb_config.yaml")], debug=debug)
 
 
 def install(skip_push=False, debug=False):
@@ -127,13 +132,14 @@ def install(skip_push=False, debug=False):
     # Install Knative Serving
     # -----
 
-    # Create the knative CRDs
-    kube_cmd = "apply -f {}".format(join(KNATIVE_SERVING_BASE_URL, "serving-crds.yaml"))
-    run_kubectl_command(kube_cmd, capture_output=not debug)
-
-    # Install the core serving components
-    kube_cmd = "apply -f {}".format(join(KNATIVE_SERVING_BASE_URL, "serving-core.yaml"))
-    run_kubectl_command(kube_cmd, capture_output=not debug)
+    # Create the knative CRDs, and install the core serving components
+    apply_manifests(
+        [
+            join(KNATIVE_SERVING_BASE_URL, "serving-crds.yaml"),
+            join(KNATIVE_SERVING_BASE_URL, "serving-core.yaml"),
+        ],
+        debug=debug,
+    )
 
     # Patch activator pod with minimal resolv.conf
     dns_ip = run_kubectl_command(
@@ -167,28 +173,13 @@ def install(skip_push=False, debug=False):
     )
 
     # Wait for the core components to be ready
-    wait_for_pods_in_ns(
-        KNATIVE_SERVING_NAMESPACE,
-        label="app=activator",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_SERVING_NAMESPACE,
-        label="app=autoscaler",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_SERVING_NAMESPACE,
-        label="app=controller",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_SERVING_NAMESPACE,
-        label="app=webhook",
-        expected_num_of_pods=1,
+    wait_for_all(
+        [
+            (KNATIVE_SERVING_NAMESPACE, "app=activator", 1),
+            (KNATIVE_SERVING_NAMESPACE, "app=autoscaler", 1),
+            (KNATIVE_SERVING_NAMESPACE, "app=controller", 1),
+            (KNATIVE_SERVING_NAMESPACE, "app=webhook", 1),
+        ],
         debug=debug,
     )
 
@@ -196,78 +187,46 @@ def install(skip_push=False, debug=False):
     # Install Knative Eventing
     # -----
 
-    # Create the knative CRDs
-    kube_cmd = "apply -f {}".format(
-        join(KNATIVE_EVENTING_BASE_URL, "eventing-crds.yaml")
-    )
-    run_kubectl_command(kube_cmd, capture_output=not debug)
-
-    # Install the core serving components
-    kube_cmd = "apply -f {}".format(
-        join(KNATIVE_EVENTING_BASE_URL, "eventing-core.yaml")
+    # Create the knative CRDs, and install the core eventing components
+    apply_manifests(
+        [
+            join(KNATIVE_EVENTING_BASE_URL, "eventing-crds.yaml"),
+            join(KNATIVE_EVENTING_BASE_URL, "eventing-core.yaml"),
+        ],
+        debug=debug,
     )
-    run_kubectl_command(kube_cmd, capture_output=not debug)
 
     # Wait for the core components to be ready
-    wait_for_pods_in_ns(
-        KNATIVE_EVENTING_NAMESPACE,
-        label="app=eventing-controller",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_EVENTING_NAMESPACE,
-        label="app=eventing-webhook",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_EVENTING_NAMESPACE,
-        label="sinks.knative.dev/sink=job-sink",
-        expected_num_of_pods=1,
+    wait_for_all(
+        [
+            (KNATIVE_EVENTING_NAMESPACE, "app=eventing-controller", 1),
+            (KNATIVE_EVENTING_NAMESPACE, "app=eventing-webhook", 1),
+            (KNATIVE_EVENTING_NAMESPACE, "sinks.knative.dev/sink=job-sink", 1),
+        ],
         debug=debug,
     )
 
     # Install non-core eventing components
-    kube_cmd = "apply -f {}".format(
-        join(KNATIVE_EVENTING_BASE_URL, "in-memory-channel.yaml")
-    )
-    run_kubectl_command(kube_cmd, capture_output=not debug)
-
-    kube_cmd = "apply -f {}".format(
-        join(KNATIVE_EVENTING_BASE_URL, "mt-channel-broker.yaml")
+    apply_manifests(
+        [
+            join(KNATIVE_EVENTING_BASE_URL, "in-memory-channel.yaml"),
+            join(KNATIVE_EVENTING_BASE_URL, "mt-channel-broker.yaml"),
+        ],
+        debug=debug,
     )
-    run_kubectl_command(kube_cmd, capture_output=not debug)
 
     # Wait for non-core components to be ready
-    wait_for_pods_in_ns(
-        KNATIVE_EVENTING_NAMESPACE,
-        label="app.kubernetes.io/component=imc-controller",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_EVENTING_NAMESPACE,
-        label="app.kubernetes.io/component=imc-dispatcher",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_EVENTING_NAMESPACE,
-        label="app.kubernetes.io/component=broker-controller",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_EVENTING_NAMESPACE,
-        label="app.kubernetes.io/component=broker-filter",
-        expected_num_of_pods=1,
-        debug=debug,
-    )
-    wait_for_pods_in_ns(
-        KNATIVE_EVENTING_NAMESPACE,
-        label="app.kubernetes.io/component=broker-ingress",
-        expected_num_of_pods=1,
+    wait_for_all(
+        [
+            (KNATIVE_EVENTING_NAMESPACE, f"app.kubernetes.io/component={comp}", 1)
+            for comp in [
+                "imc-controller",
+                "imc-dispatcher",
+                "broker-controller",
+                "broker-filter",
+                "broker-ingress",
+            ]
+        ],
         debug=debug,
     )
 
@@ -286,34 +245,15 @@ def install(skip_push=False, debug=False):
         install_kourier(debug)
 
     # Update the Serving's ConfigMap to support running CoCo
-    knative_configmap = join(CONF_FILES_DIR, "knative_config.yaml")
-    run_kubectl_command(
-        "apply -f {}".format(knative_configmap), capture_output=not debug
-    )
+    apply_manifests([join(CONF_FILES_DIR, "knative_config.yaml")], debug=debug)
 
     # Get Knative's external IP
-    ip_cmd = [
-        "--namespace {}".format(net_layer_ns),
-        "get service {}".format(net_layer_service_name),
-        "-o jsonpath='{.status.loadBalancer.ingress[0].ip}'",
-    ]
-    ip_cmd = " ".join(ip_cmd)
-    expected_ip_len = 4
-    actual_ip = run_kubectl_command(ip_cmd, capture_output=True)
-    actual_ip_len = len(actual_ip.split("."))
-    while actual_ip_len != expected_ip_len:
-        if not debug:
-            print("Waiting for kourier external IP to be assigned by the LB...")
-
-        sleep(3)
-        actual_ip = run_kubectl_command(ip_cmd, capture_output=True)
-        actual_ip_len = len(actual_ip.split("."))
+    wait_for_service_ingress_ip(net_layer_ns, net_layer_service_name, debug=debug)
 
     # Deploy a DNS
-    kube_cmd = "apply -f {}".format(
-        join(KNATIVE_SERVING_BASE_URL, "serving-default-domain.yaml")
+    apply_manifests(
+        [join(KNATIVE_SERVING_BASE_URL, "serving-default-domain.yaml")], debug=debug
     )
-    run_kubectl_command(kube_cmd, capture_output=not debug)
     wait_for_pods_in_ns(
         KNATIVE_SERVING_NAMESPACE,
         label="app=default-domain",
@@ -328,23 +268,31 @@ def install(skip_push=False, debug=False):
     # Replace the sidecar to use an image we control
     do_replace_sidecar(skip_push=skip_push, quiet=not debug)
 
-    # Patch the auto-scaler
-    do_patch_autoscaler(debug=debug)
-
     # Create a k8s secret with the credentials to support pulling images from
-    # a local registry with a self-signed certificate
-    kube_cmd = (
-        "-n knative-serving create secret generic {} --from-file=ca.crt={}".format(
-            K8S_SECRET_NAME, HOST_CERT_PATH
+    # a local registry with a self-signed certificate (re-creating it if we
+    # are resuming a deployment)
+    async def create_cert_secret():
+        await run_kubectl_command_async(
+            "-n knative-serving delete secret {} --ignore-not-found".format(
+                K8S_SECRET_NAME
+            ),
+            capture_output=not debug,
         )
-    )
-    run_kubectl_command(kube_cmd, capture_output=not debug)
+        kube_cmd = (
+            "-n knative-serving create secret generic {} --from-file=ca.crt={}".format(
+                K8S_SECRET_NAME, HOST_CERT_PATH
+            )
+        )
+        await run_kubectl_command_async(kube_cmd, capture_output=not debug)
+
+    # Patch the auto-scaler, and create the secret, at the same time
+    run_all(patch_autoscaler_async(debug=debug), create_cert_secret())
 
     # Patch the controller deployment to mount the certificate to avoid
     # having to specify it in every service definition
     do_configure_self_signed_certs(HOST_CERT_DIR, K8S_SECRET_NAME, debug=debug)
 
-    print("Success!")
+    print_success()
 
 
 def uninstall():
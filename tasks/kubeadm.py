@@ -1,4 +1,4 @@
-from os import getegid, geteuid, makedirs
+from os import makedirs
 from os.path import exists
 from shutil import rmtree
 from subprocess import run
@@ -8,14 +8,16 @@ from tasks.util.env import (
     K8S_CONFIG_DIR,
     KUBEADM_KUBECONFIG_FILE,
     print_dotted_line,
+    print_success,
 )
+from tasks.util.host import getegid, geteuid
 from tasks.util.kubeadm import (
     get_node_name,
     run_kubectl_command,
-    wait_for_pods_in_ns,
+    wait_for_all,
+    wait_for_node_ready,
 )
 from tasks.util.versions import CALICO_VERSION, K8S_VERSION
-from time import sleep
 
 
 def create(debug=False):
@@ -46,22 +48,7 @@ def create(debug=False):
     run(chown_cmd, shell=True, check=True)
 
     # Wait for the node to be in ready state
-    def get_node_state():
-        # We could use a jsonpath format here, but couldn't quite work it out
-        out = run_kubectl_command("get nodes --no-headers", capture_output=True).split(
-            " "
-        )
-        out = [_ for _ in out if len(_) > 0]
-        return out[1]
-
-    expected_node_state = "Ready"
-    actual_node_state = get_node_state()
-    while expected_node_state != actual_node_state:
-        if debug:
-            print("Waiting for node to be ready...")
-
-        sleep(3)
-        actual_node_state = get_node_state()
+    wait_for_node_ready(debug=debug)
 
     # Untaint the node so that pods can be scheduled on it
     node_name = get_node_name()
@@ -85,38 +72,18 @@ def create(debug=False):
     run_kubectl_command(
         f"create -f {calico_url}/custom-resources.yaml", capture_output=not debug
     )
-    wait_for_pods_in_ns(
-        "calico-system",
-        label="app.kubernetes.io/name=csi-node-driver",
-        debug=debug,
-        expected_num_of_pods=1,
-    )
-    wait_for_pods_in_ns(
-        "calico-system",
-        label="app.kubernetes.io/name=calico-typha",
-        debug=debug,
-        expected_num_of_pods=1,
-    )
-    wait_for_pods_in_ns(
-        "calico-system",
-        label="app.kubernetes.io/name=calico-node",
-        debug=debug,
-        expected_num_of_pods=1,
-    )
-    wait_for_pods_in_ns(
-        "calico-system",
-        label="app.kubernetes.io/name=calico-kube-controllers",
-        expected_num_of_pods=1,
+    wait_for_all(
+        [
+            ("calico-system", "app.kubernetes.io/name=csi-node-driver", 1),
+            ("calico-system", "app.kubernetes.io/name=calico-typha", 1),
+            ("calico-system", "app.kubernetes.io/name=calico-node", 1),
+            ("calico-system", "app.kubernetes.io/name=calico-kube-controllers", 1),
+            ("calico-apiserver", "app.kubernetes.io/name=calico-apiserver", 2),
+        ],
         debug=debug,
     )
-    wait_for_pods_in_ns(
-        "calico-apiserver",
-        label="app.kubernetes.io/name=calico-apiserver",
-        debug=debug,
-        expected_num_of_pods=2,
-    )
 
-    print("Success!")
+    print_success()
 
 
 def destroy(debug=False):
@@ -153,3 +120,6 @@ def destroy(debug=False):
 
     # Remove networking stuff
     remove_cni()
+
+    # The node name is only valid for the cluster we have just destroyed
+    get_node_name.invalidate()
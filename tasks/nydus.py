@@ -2,7 +2,7 @@ from invoke import task
 from os.path import join
 from subprocess import run
 from tasks.util.docker import copy_from_ctr_image, is_ctr_running
-from tasks.util.env import PROJ_ROOT, print_dotted_line
+from tasks.util.env import PROJ_ROOT, print_dotted_line, print_success
 from tasks.util.nydus import (
     NYDUS_IMAGE_HOST_PATH,
     NYDUS_IMAGE_TAG,
@@ -30,7 +30,7 @@ def do_install():
     host_bin = [NYDUS_IMAGE_HOST_PATH]
     copy_from_ctr_image(NYDUS_IMAGE_TAG, ctr_bin, host_bin, requires_sudo=True)
 
-    print("Success!")
+    print_success()
 
 
 @task
@@ -1,9 +1,12 @@
 from invoke import task
-from json import JSONDecodeError, loads as json_loads
-from os import getgid, getuid
-from os.path import exists, join
+from os.path import join
 from subprocess import run
-from tasks.util.containerd import wait_for_containerd_socket
+from tasks.util.aio import run_all
+from tasks.util.containerd import (
+    get_crictl_images,
+    remove_crictl_image_async,
+    wait_for_containerd_socket,
+)
 from tasks.util.docker import copy_from_ctr_image, is_ctr_running
 from tasks.util.env import (
     BIN_DIR,
@@ -15,12 +18,21 @@ from tasks.util.env import (
     PROJ_ROOT,
     SC2_RUNTIMES,
     print_dotted_line,
+    print_success,
 )
+from tasks.util.host import exists, getgid, getuid
 from tasks.util.nydus_snapshotter import (
     NYDUS_SNAPSHOTTER_IMAGE_TAG,
     build_nydus_snapshotter_image,
 )
-from tasks.util.toml import read_value_from_toml, update_toml
+from tasks.util.sudo import sudo_copy_file, sudo_write_file
+from tasks.util.unix_socket import wait_for_unix_socket
+from tasks.util.toml import (
+    read_value_from_toml,
+    toml_transaction,
+    update_toml,
+    update_tomls,
+)
 from tasks.util.versions import NYDUS_SNAPSHOTTER_VERSION
 from time import sleep
 
@@ -47,6 +59,8 @@ NYDUS_SNAPSHOTTER_BINARY_NAMES = [
 ]
 NYDUS_SNAPSHOTTER_CTR_BINPATH = "/go/src/github.com/sc2-sys/nydus-snapshotter/bin"
 NYDUS_SNAPSHOTTER_HOST_BINPATH = "/opt/confidential-containers/bin"
+# Both nydus-snapshotter configs listen for containerd on the same socket
+NYDUS_SNAPSHOTTER_SOCKET = "/run/containerd-nydus/containerd-nydus-grpc.sock"
 
 # You can see all options to configure the  nydus-snapshotter here:
 # https://github.com/containerd/nydus-snapshotter/blob/main/misc/snapshotter/config.toml
@@ -69,58 +83,21 @@ def do_purge(debug=False):
         run(f"sudo rm -rf /var/lib/containerd-{snap}", shell=True, check=True)
 
     # Clear all possibly used images (only images in our registry, or the
-    # pause container images)
-    tmp_out = "/tmp/cmd_output"
-    cmd = (
-        "sudo crictl --runtime-endpoint unix:///run/containerd/containerd.sock"
-        f" images -o json > {tmp_out} 2> /dev/null"
-    )
-    rm_cmd = "sudo crictl --runtime-endpoint unix:///run/containerd/containerd.sock rmi"
-    try:
-        run(cmd, shell=True, check=True)
-        with open(tmp_out, "r") as fh:
-            stdout = fh.read().strip()
-        data = json_loads(stdout)
-    except JSONDecodeError as e:
-        stderr = run(cmd, shell=True, capture_output=True).stderr.decode("utf-8")
-        print(f"ERROR: run command: {cmd}, got stdout: {stdout}, stderr: {stderr}")
-        raise e
-    for image_data in data["images"]:
-        # Try matching both by repoTags and repoDigests (the former is sometimes
-        # empty)
-        if any(
-            [
-                tag.startswith(LOCAL_REGISTRY_URL)
-                for tag in image_data["repoTags"] + image_data["repoDigests"]
-            ]
-        ):
-            result = run(
-                "{} {} 2> /dev/null".format(rm_cmd, image_data["id"]),
-                shell=True,
-                capture_output=True,
-            )
-            assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-            if debug:
-                print(result.stdout.decode("utf-8").strip())
-
-            continue
-
+    # pause container images). Try matching both by repoTags and repoDigests
+    # (the former is sometimes empty)
+    image_prefixes = [LOCAL_REGISTRY_URL, "registry.k8s.io/pause"]
+    image_ids = [
+        image_data["id"]
+        for image_data in get_crictl_images()
         if any(
             [
-                tag.startswith("registry.k8s.io/pause")
+                tag.startswith(prefix)
                 for tag in image_data["repoTags"] + image_data["repoDigests"]
+                for prefix in image_prefixes
             ]
-        ):
-            result = run(
-                "{} {} 2> /dev/null".format(rm_cmd, image_data["id"]),
-                shell=True,
-                capture_output=True,
-            )
-            assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-            if debug:
-                print(result.stdout.decode("utf-8").strip())
-
-            continue
+        )
+    ]
+    run_all(*[remove_crictl_image_async(image_id, debug) for image_id in image_ids])
 
     restart_nydus_snapshotter()
 
@@ -165,16 +142,7 @@ def install(debug=False, clean=False):
             NYDUS_SNAPSHOTTER_HOST_SHARE_NAME
         )
 
-        cmd = """
-sudo sh -c 'cat <<EOF > {destination_file}
-{file_contents}
-EOF'
-""".format(
-            destination_file=host_share_import_path,
-            file_contents=config_file,
-        )
-
-        run(cmd, shell=True, check=True)
+        sudo_write_file(host_share_import_path, config_file.lstrip())
 
         imports += [host_share_import_path]
         updated_toml_str = """
@@ -214,17 +182,10 @@ export_mode = "layer_block_with_verity"
             nydus_image_path=join(COCO_ROOT, "bin", "nydus-image"),
         )
 
-        cmd = """
-sudo sh -c 'cat <<EOF > {destination_file}
-{file_contents}
-EOF'
-""".format(
-            destination_file=NYDUS_SNAPSHOTTER_HOST_SHARE_CONFIG,
-            file_contents=host_sharing_config,
+        sudo_write_file(
+            NYDUS_SNAPSHOTTER_HOST_SHARE_CONFIG, host_sharing_config.lstrip()
         )
 
-        run(cmd, shell=True, check=True)
-
     # Remove all nydus config for a clean start
     if clean:
         do_purge(debug=debug)
@@ -232,25 +193,30 @@ EOF'
     # Restart the nydus service
     restart_nydus_snapshotter()
 
-    print("Success!")
+    print_success()
 
 
 def restart_nydus_snapshotter():
     run("sudo service nydus-snapshotter restart", shell=True, check=True)
+    wait_for_unix_socket(NYDUS_SNAPSHOTTER_SOCKET, name="nydus-snapshotter")
 
 
 def set_log_level(log_level):
     """
     Set the log level for the nydus snapshotter
     """
-    for config_file in NYDUS_SNAPSHOTTER_CONFIG_FILES:
-        updated_toml_str = """
-        [log]
-        level = "{log_level}"
-        """.format(
-            log_level=log_level
-        )
-        update_toml(config_file, updated_toml_str)
+    updated_toml_str = """
+    [log]
+    level = "{log_level}"
+    """.format(
+        log_level=log_level
+    )
+    update_tomls(
+        {
+            config_file: updated_toml_str
+            for config_file in NYDUS_SNAPSHOTTER_CONFIG_FILES
+        }
+    )
 
     restart_nydus_snapshotter()
 
@@ -272,12 +238,7 @@ def wait_for_snapshot_metadata_to_be_gced(snapshotter, debug=False):
 
     while True:
         # Make a user-owned copy of the DB (bbolt complains otherwise)
-        run(f"sudo cp {db_path} {tmp_db_path}", shell=True, check=True)
-        run(
-            "sudo chown {}:{} {}".format(getuid(), getgid(), tmp_db_path),
-            shell=True,
-            check=True,
-        )
+        sudo_copy_file(db_path, tmp_db_path, uid=getuid(), gid=getgid())
 
         result = run(bbolt_cmd, shell=True, capture_output=True)
         stdout = result.stdout.decode("utf-8").strip()
@@ -431,15 +392,7 @@ RequiredBy=containerd.service
     )
 
     service_path = "/etc/systemd/system/nydus-snapshotter.service"
-    cmd = """
-sudo sh -c 'cat <<EOF > {destination_file}
-{file_contents}
-EOF'
-""".format(
-        destination_file=service_path,
-        file_contents=service_config,
-    )
-    run(cmd, shell=True, check=True)
+    sudo_write_file(service_path, service_config.lstrip())
 
     # Update all runtime configurations to use the right snapshotter. We
     # _always_ avoid having both snapshotters co-existing
@@ -448,14 +401,15 @@ EOF'
         if mode == "host-share"
         else NYDUS_SNAPSHOTTER_GUEST_PULL_NAME
     )
-    for runtime in KATA_RUNTIMES + SC2_RUNTIMES:
-        updated_toml_str = """
-        [plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime_name}]
-        snapshotter = "{snapshotter_name}"
-        """.format(
-            runtime_name=runtime, snapshotter_name=snap_name
-        )
-        update_toml(CONTAINERD_CONFIG_FILE, updated_toml_str)
+    with toml_transaction(CONTAINERD_CONFIG_FILE) as ctrd_conf:
+        for runtime in KATA_RUNTIMES + SC2_RUNTIMES:
+            updated_toml_str = """
+            [plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime_name}]
+            snapshotter = "{snapshotter_name}"
+            """.format(
+                runtime_name=runtime, snapshotter_name=snap_name
+            )
+            ctrd_conf.update(updated_toml_str)
 
     # Reload systemd to apply the new service configuration
     run("sudo systemctl daemon-reload", shell=True, check=True)
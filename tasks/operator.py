@@ -1,12 +1,18 @@
 from os.path import join
-from tasks.util.env import CONTAINERD_CONFIG_FILE, KATA_CONFIG_DIR, print_dotted_line
+from tasks.util.env import (
+    CONTAINERD_CONFIG_FILE,
+    KATA_CONFIG_DIR,
+    print_dotted_line,
+    print_success,
+)
 from tasks.util.kubeadm import (
     run_kubectl_command,
+    wait_for_all,
     wait_for_pods_in_ns,
+    wait_for_runtime_classes,
 )
-from tasks.util.toml import read_value_from_toml
+from tasks.util.toml import wait_for_toml_values
 from tasks.util.versions import COCO_VERSION
-from time import sleep
 
 OPERATOR_GITHUB_URL = "github.com/confidential-containers/operator"
 OPERATOR_NAMESPACE = "confidential-containers-system"
@@ -31,7 +37,7 @@ def install(debug=False):
         debug=debug,
     )
 
-    print("Success!")
+    print_success()
 
 
 def install_cc_runtime(debug=False):
@@ -47,15 +53,15 @@ def install_cc_runtime(debug=False):
         "ccruntime",
         "default?ref=v{}".format(COCO_VERSION),
     )
-    run_kubectl_command("create -k {}".format(cc_runtime_url), capture_output=not debug)
-
-    for pod_label in [
-        "name=cc-operator-pre-install-daemon",
-        "name=cc-operator-daemon-install",
-    ]:
-        wait_for_pods_in_ns(
-            OPERATOR_NAMESPACE, expected_num_of_pods=1, label=pod_label, debug=debug
-        )
+    run_kubectl_command("apply -k {}".format(cc_runtime_url), capture_output=not debug)
+
+    wait_for_all(
+        [
+            (OPERATOR_NAMESPACE, "name=cc-operator-pre-install-daemon", 1),
+            (OPERATOR_NAMESPACE, "name=cc-operator-daemon-install", 1),
+        ],
+        debug=debug,
+    )
 
     # We check that the registered runtime classes are the same ones
     # we expect. We deliberately hardcode the following list
@@ -67,20 +73,7 @@ def install_cc_runtime(debug=False):
         "kata-qemu-tdx",
         "kata-qemu-snp",
     ]
-    run_class_cmd = "get runtimeclass -o jsonpath='{.items..handler}'"
-    runtime_classes = run_kubectl_command(run_class_cmd, capture_output=True).split(" ")
-    while len(expected_runtime_classes) != len(runtime_classes):
-        if debug:
-            print(
-                "Not all expected runtime classes are registered ({} != {})".format(
-                    len(expected_runtime_classes), len(runtime_classes)
-                )
-            )
-
-        sleep(5)
-        runtime_classes = run_kubectl_command(run_class_cmd, capture_output=True).split(
-            " "
-        )
+    wait_for_runtime_classes(expected_runtime_classes, debug=debug)
 
     # The operator may report all runtime classes as created, but still be in
     # the process of modifying the config files. If we make progress without
@@ -88,30 +81,20 @@ def install_cc_runtime(debug=False):
     # containerd's config file. Therefore here we wait until all runtime
     # classes have been persisted to the config file.
     # See: sc2-sys/deploy/pull/120
+    expected_values = {}
     for runtime in expected_runtime_classes[1:]:
         runtime_no_kata = runtime[5:]
-        expected_config_path = (
-            f"{KATA_CONFIG_DIR}//configuration-{runtime_no_kata}.toml"
-        )
         toml_path = (
             f'plugins."io.containerd.grpc.v1.cri".containerd.runtimes'
             f".{runtime}.options.ConfigPath"
         )
+        expected_values[
+            toml_path
+        ] = f"{KATA_CONFIG_DIR}//configuration-{runtime_no_kata}.toml"
 
-        while expected_config_path != read_value_from_toml(
-            CONTAINERD_CONFIG_FILE, toml_path, tolerate_missing=True
-        ):
-            if debug:
-                print(
-                    (
-                        f"Waiting for operator to populate containerd "
-                        f"entry for runtime: {runtime}..."
-                    )
-                )
-
-            sleep(2)
+    wait_for_toml_values(CONTAINERD_CONFIG_FILE, expected_values, debug=debug)
 
-    print("Success!")
+    print_success()
 
 
 def uninstall():
@@ -1,6 +1,7 @@
 from invoke import task
-from os import environ, makedirs
-from os.path import exists, join
+from json import dumps as json_dumps, loads as json_loads
+from os import environ, makedirs, rename
+from os.path import join
 from subprocess import run
 from sys import exit
 from tasks.containerd import (
@@ -14,7 +15,10 @@ from tasks.demo_apps import (
 from tasks.k8s import install as k8s_tooling_install
 from tasks.k9s import install as k9s_install
 from tasks.kata import set_log_level as kata_set_log_level
-from tasks.kernel import build_guest as build_guest_kernel
+from tasks.kernel import (
+    do_build_guest as build_guest_kernel_only,
+    update_guest_kernel_config,
+)
 from tasks.knative import install as knative_install
 from tasks.kubeadm import create as k8s_create, destroy as k8s_destroy
 from tasks.nydus_snapshotter import (
@@ -27,8 +31,9 @@ from tasks.operator import (
     install_cc_runtime as operator_install_cc_runtime,
 )
 from tasks.ovmf import install as ovmf_install
-from tasks.util.containerd import restart_containerd
-from tasks.util.docker import pull_artifact_images
+from tasks.util.containerd import CONTAINERD_IMAGE_TAG, restart_containerd
+from tasks.util.dag import DAG_MAX_WORKERS, hash_file, run_dag
+from tasks.util.docker import get_image_digest, pull_artifact_images
 from tasks.util.env import (
     COCO_ROOT,
     CONF_FILES_DIR,
@@ -42,27 +47,52 @@ from tasks.util.env import (
     SC2_DEPLOYMENT_FILE,
     SC2_RUNTIMES,
     VM_CACHE_SIZE,
+    VM_CACHE_SOCKET,
+    VM_CACHE_START_TIMEOUT_SECS,
     print_dotted_line,
+    print_success,
 )
+from tasks.util.host import exists, read_file
 from tasks.util.kata import (
+    KATA_IMAGE_TAG,
     replace_agent as replace_kata_agent,
     replace_shim as replace_kata_shim,
 )
 from tasks.util.kernel import get_host_kernel_expected_prefix, get_host_kernel_version
-from tasks.util.kubeadm import run_kubectl_command
+from tasks.util.kubeadm import run_kubectl_command, wait_for_runtime_classes
+from tasks.util.nydus import NYDUS_IMAGE_TAG
+from tasks.util.nydus_snapshotter import NYDUS_SNAPSHOTTER_IMAGE_TAG
+from tasks.util.ovmf import OVMF_IMAGE_TAG
 from tasks.util.proxy import is_proxy_set, configure_docker_proxy
 from tasks.util.registry import (
     HOST_CERT_DIR,
     start as start_local_registry,
     stop as stop_local_registry,
 )
-from tasks.util.toml import update_toml
+from tasks.util.replay import MODE_REPLAY, get_replay_mode
+from tasks.util.sudo import sudo_copy_file
+from tasks.util.toml import toml_transaction, update_toml, update_tomls
+from tasks.util.unix_socket import wait_for_unix_socket
 from tasks.util.versions import (
+    CALICO_VERSION,
+    CNI_VERSION,
     COCO_VERSION,
+    CONTAINERD_VERSION,
+    CRICTL_VERSION,
+    GO_VERSION,
     GUEST_KERNEL_VERSION,
+    K8S_VERSION,
+    K9S_VERSION,
+    KATA_VERSION,
+    KNATIVE_VERSION,
+    NYDUS_SNAPSHOTTER_VERSION,
+    NYDUS_VERSION,
     OVMF_VERSION,
+    PAUSE_IMAGE_VERSION,
+    REGISTRY_VERSION,
+    RUST_VERSION,
 )
-from time import sleep
+from time import time
 
 
 def start_vm_cache(debug=False):
@@ -88,6 +118,12 @@ def start_vm_cache(debug=False):
         shell=True,
         check=True,
     )
+    wait_for_unix_socket(
+        VM_CACHE_SOCKET,
+        name="vm-cache",
+        timeout=VM_CACHE_START_TIMEOUT_SECS,
+        debug=debug,
+    )
 
 
 def install_sc2_runtime(debug=False):
@@ -99,36 +135,49 @@ def install_sc2_runtime(debug=False):
     dst_ctrd_path = f"{KATA_ROOT}/bin/containerd-shim-kata-sc2-v2"
     run(f"sudo cp {src_ctrd_path} {dst_ctrd_path}", shell=True, check=True)
 
-    # Modify containerd to add a new runtime class
-    if debug:
-        print("Patching containerd...")
-    for sc2_runtime in SC2_RUNTIMES:
-        # Update containerd to point the SC2 runtime to the right shim
-        updated_toml_str = """
-        [plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime_name}]
-        runtime_type = "io.containerd.kata-{runtime_name}.v2"
-        privileged_without_host_devices = true
-        pod_annotations = [ "io.katacontainers.*",]
-        snapshotter = "nydus"
-        runtime_path = "{ctrd_path}"
-        """.format(
-            runtime_name=sc2_runtime, ctrd_path=dst_ctrd_path
-        )
-        update_toml(CONTAINERD_CONFIG_FILE, updated_toml_str)
+    # Modify containerd to add a new runtime class. We batch all the updates
+    # to containerd's config file, and write it once at the end
+    with toml_transaction(CONTAINERD_CONFIG_FILE) as ctrd_conf:
+        if debug:
+            print("Patching containerd...")
+        for sc2_runtime in SC2_RUNTIMES:
+            # Update containerd to point the SC2 runtime to the right shim
+            updated_toml_str = """
+            [plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime_name}]
+            runtime_type = "io.containerd.kata-{runtime_name}.v2"
+            privileged_without_host_devices = true
+            pod_annotations = [ "io.katacontainers.*",]
+            snapshotter = "nydus"
+            runtime_path = "{ctrd_path}"
+            """.format(
+                runtime_name=sc2_runtime, ctrd_path=dst_ctrd_path
+            )
+            ctrd_conf.update(updated_toml_str)
 
-    # Copy configuration file from the corresponding source file (and patch
-    # if needed)
-    if debug:
-        print("Patching configuration files...")
-    for sc2_runtime in SC2_RUNTIMES:
-        if "snp" in sc2_runtime:
-            src_conf_path = join(KATA_CONFIG_DIR, "configuration-qemu-snp.toml")
-        elif "qemu-tdx" in sc2_runtime:
-            src_conf_path = join(KATA_CONFIG_DIR, "configuration-qemu-tdx.toml")
-        dst_conf_path = join(KATA_CONFIG_DIR, f"configuration-{sc2_runtime}.toml")
-        run(f"sudo cp {src_conf_path} {dst_conf_path}", shell=True, check=True)
-
-        # Patch config file to enable VM cache
+        # Copy configuration file from the corresponding source file, and
+        # patch all of them in one go
+        if debug:
+            print("Patching configuration files...")
+        dst_conf_paths = []
+        for sc2_runtime in SC2_RUNTIMES:
+            if "snp" in sc2_runtime:
+                src_conf_path = join(KATA_CONFIG_DIR, "configuration-qemu-snp.toml")
+            elif "qemu-tdx" in sc2_runtime:
+                src_conf_path = join(KATA_CONFIG_DIR, "configuration-qemu-tdx.toml")
+            dst_conf_path = join(KATA_CONFIG_DIR, f"configuration-{sc2_runtime}.toml")
+            sudo_copy_file(src_conf_path, dst_conf_path)
+            dst_conf_paths.append(dst_conf_path)
+
+            # Update containerd to point the SC2 runtime to the right config
+            updated_toml_str = """
+            [plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime_name}.options]
+            ConfigPath = "{conf_path}"
+            """.format(
+                runtime_name=sc2_runtime, conf_path=dst_conf_path
+            )
+            ctrd_conf.update(updated_toml_str)
+
+        # Patch config files to enable VM cache
         # FIXME: we need to update the default_memory to be able to run the
         # Knative chaining test. This will change when memory hot-plugging
         # is supported
@@ -148,23 +197,17 @@ def install_sc2_runtime(debug=False):
         """.format(
             vm_cache_number=VM_CACHE_SIZE
         )
-        update_toml(dst_conf_path, updated_toml_str)
-
-        # Update containerd to point the SC2 runtime to the right config
-        updated_toml_str = """
-        [plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime_name}.options]
-        ConfigPath = "{conf_path}"
-        """.format(
-            runtime_name=sc2_runtime, conf_path=dst_conf_path
+        update_tomls(
+            {dst_conf_path: updated_toml_str for dst_conf_path in dst_conf_paths},
+            debug=debug,
         )
-        update_toml(CONTAINERD_CONFIG_FILE, updated_toml_str)
 
     # Install runttime class on kubernetes
     if debug:
         print("Installing SC2 runtime class...")
     for sc2_runtime in SC2_RUNTIMES:
         sc2_runtime_file = join(CONF_FILES_DIR, f"{sc2_runtime}_runtimeclass.yaml")
-        run_kubectl_command(f"create -f {sc2_runtime_file}", capture_output=not debug)
+        run_kubectl_command(f"apply -f {sc2_runtime_file}", capture_output=not debug)
     expected_runtime_classes = [
         "kata",
         "kata-clh",
@@ -175,20 +218,7 @@ def install_sc2_runtime(debug=False):
         "kata-qemu-tdx",
         "kata-qemu-tdx-sc2",
     ]
-    run_class_cmd = "get runtimeclass -o jsonpath='{.items..handler}'"
-    runtime_classes = run_kubectl_command(run_class_cmd, capture_output=True).split(" ")
-    while len(expected_runtime_classes) != len(runtime_classes):
-        if debug:
-            print(
-                "Not all expected runtime classes are registered ({} != {})".format(
-                    len(expected_runtime_classes), len(runtime_classes)
-                )
-            )
-
-        sleep(5)
-        runtime_classes = run_kubectl_command(run_class_cmd, capture_output=True).split(
-            " "
-        )
+    wait_for_runtime_classes(expected_runtime_classes, debug=debug)
 
     # Replace the agent in the initrd
     if debug:
@@ -210,21 +240,374 @@ def install_sc2_runtime(debug=False):
     )
 
 
+def update_snp_qemu_path():
+    """
+    Update SNP class to use default QEMU (we use host kernel 6.11, so we
+    can use upstream QEMU 9.1). We do this update before generating the SC2
+    runtime classes, so they will inherit the QEMU value
+    """
+    # TODO: remove when bumping to a new CoCo release
+    qemu_path = join(KATA_ROOT, "bin", "qemu-system-x86_64")
+    updated_toml_str = """
+    [hypervisor.qemu]
+    path = "{qemu_path}"
+    valid_hypervisor_paths = [ "{qemu_path}" ]
+    """.format(
+        qemu_path=qemu_path
+    )
+    update_toml(
+        join(KATA_CONFIG_DIR, "configuration-qemu-snp.toml"),
+        updated_toml_str,
+        requires_root=True,
+    )
+
+
+def get_deploy_steps(debug=False, clean=False):
+    """
+    Get the list of steps to deploy SC2, and the dependencies between them
+
+    On top of the functional dependencies, we must respect the following
+    constraints when adding edges to the graph:
+    - Steps that modify the same config file must be chained, so that they
+      never run at the same time.
+    - Installing containerd, the operator installing the CoCo runtimes, and
+      starting the local registry, restart containerd and/or dockerd, so steps
+      that use docker must run strictly before or after them.
+    """
+
+    def conf_file(file_name):
+        return join(CONF_FILES_DIR, file_name)
+
+    def install_ovmf():
+        # Install an up-to-date version of OVMF (the one currently shipped
+        # with CoCo is not enough to run on 6.11 and QEMU 9.1)
+        print_dotted_line(f"Installing OVMF ({OVMF_VERSION})")
+        ovmf_install()
+        print_success()
+
+    def install_sc2():
+        print_dotted_line(f"Installing SC2 (v{COCO_VERSION})")
+        install_sc2_runtime(debug=debug)
+        print_success()
+
+    def build_guest_kernel():
+        print_dotted_line(
+            f"Build and install guest VM kernel (v{GUEST_KERNEL_VERSION})"
+        )
+        build_guest_kernel_only(debug=debug)
+        print_success()
+
+    def start_cvm_cache():
+        # Start the VM cache at the end so that we can pick up the latest
+        # config changes
+        print_dotted_line("Starting cVM cache...")
+        start_vm_cache(debug=debug)
+        print_success()
+
+    return [
+        # Pull all artifact container images necessary
+        {
+            "name": "pull-artifact-images",
+            "func": lambda: pull_artifact_images(debug=debug),
+            "deps": [],
+            "inputs": lambda: {
+                "versions": [
+                    CONTAINERD_VERSION,
+                    KATA_VERSION,
+                    NYDUS_VERSION,
+                    NYDUS_SNAPSHOTTER_VERSION,
+                    OVMF_VERSION,
+                ]
+            },
+        },
+        # Build and install containerd
+        {
+            "name": "containerd",
+            "func": lambda: containerd_install(debug=debug, clean=clean),
+            "deps": ["pull-artifact-images"],
+            "inputs": lambda: {
+                "version": CONTAINERD_VERSION,
+                "image": get_image_digest(CONTAINERD_IMAGE_TAG),
+                "cni_conf": hash_file(conf_file("10-containerd-net.conflist")),
+            },
+        },
+        # Install k8s tooling (including k9s)
+        {
+            "name": "k8s-tooling",
+            "func": lambda: k8s_tooling_install(debug=debug, clean=clean),
+            "deps": [],
+            "inputs": lambda: {
+                "versions": [K8S_VERSION, CNI_VERSION, CRICTL_VERSION],
+                "kubelet_conf": hash_file(conf_file("kubelet_service.conf")),
+                "kubelet_service": hash_file(conf_file("kubelet.service")),
+            },
+        },
+        {
+            "name": "k9s",
+            "func": lambda: k9s_install(debug=debug),
+            "deps": [],
+            "inputs": lambda: {"version": K9S_VERSION},
+        },
+        # Create a single-node k8s cluster. We can not run `kubeadm init` on
+        # top of a (partially) initialised cluster
+        {
+            "name": "kubeadm",
+            "func": lambda: k8s_create(debug=debug),
+            "deps": ["containerd", "k8s-tooling"],
+            "resumable": False,
+            "inputs": lambda: {
+                "versions": [K8S_VERSION, CALICO_VERSION],
+                "kubeadm_conf": hash_file(conf_file("kubeadm.conf")),
+            },
+        },
+        # Install the CoCo operator as well as the CC-runtimes
+        {
+            "name": "operator",
+            "func": lambda: operator_install(debug=debug),
+            "deps": ["kubeadm"],
+            "inputs": lambda: {"version": COCO_VERSION},
+        },
+        {
+            "name": "cc-runtime",
+            "func": lambda: operator_install_cc_runtime(debug=debug),
+            "deps": ["operator"],
+            "inputs": lambda: {"version": COCO_VERSION},
+        },
+        {
+            "name": "bbolt",
+            "func": lambda: bbolt_install(debug=debug, clean=clean),
+            "deps": ["cc-runtime"],
+            "inputs": lambda: {"version": GO_VERSION},
+        },
+        # Install the nydusify tool
+        {
+            "name": "nydus",
+            "func": nydus_install,
+            "deps": ["cc-runtime"],
+            "inputs": lambda: {
+                "version": NYDUS_VERSION,
+                "image": get_image_digest(NYDUS_IMAGE_TAG),
+            },
+        },
+        # Install the nydus-snapshotter (must happen after we install CoCo, and
+        # needs bbolt to purge the snapshotter's metadata)
+        {
+            "name": "nydus-snapshotter",
+            "func": lambda: nydus_snapshotter_install(debug=debug, clean=clean),
+            "deps": ["bbolt", "cc-runtime"],
+            "inputs": lambda: {
+                "version": NYDUS_SNAPSHOTTER_VERSION,
+                "image": get_image_digest(NYDUS_SNAPSHOTTER_IMAGE_TAG),
+            },
+        },
+        # Start a local docker registry (must happen before knative
+        # installation, as we rely on it to host our sidecar image, and before
+        # building the initrd, as we include the registry's certificates)
+        {
+            "name": "registry",
+            "func": lambda: start_local_registry(debug=debug, clean=clean),
+            "deps": ["bbolt", "nydus", "nydus-snapshotter"],
+            "inputs": lambda: {
+                "version": REGISTRY_VERSION,
+                "openssl_conf": hash_file(conf_file("openssl.cnf")),
+            },
+        },
+        # Install Knative
+        {
+            "name": "knative",
+            "func": lambda: knative_install(debug=debug),
+            "deps": ["registry"],
+            "inputs": lambda: {
+                "version": KNATIVE_VERSION,
+                "conf_files": [
+                    hash_file(conf_file(conf))
+                    for conf in [
+                        "knative_autoscaler_patch.yaml",
+                        "knative_config.yaml",
+                        "knative_controller_custom_certs.yaml.j2",
+                        "knative_replace_sidecar.yaml.j2",
+                        "metallb_config.yaml",
+                    ]
+                ],
+            },
+        },
+        {
+            "name": "ovmf",
+            "func": install_ovmf,
+            "deps": ["registry"],
+            "inputs": lambda: {
+                "version": OVMF_VERSION,
+                "image": get_image_digest(OVMF_IMAGE_TAG),
+            },
+        },
+        {
+            "name": "snp-qemu-path",
+            "func": update_snp_qemu_path,
+            "deps": ["cc-runtime"],
+        },
+        # Apply general patches to the Kata runtime
+        {
+            "name": "kata-shim",
+            "func": lambda: replace_kata_shim(
+                dst_shim_binary=join(KATA_ROOT, "bin", "containerd-shim-kata-v2"),
+                dst_runtime_binary=join(KATA_ROOT, "bin", "kata-runtime"),
+                sc2=False,
+            ),
+            "deps": ["registry"],
+            "inputs": lambda: {
+                "version": KATA_VERSION,
+                "image": get_image_digest(KATA_IMAGE_TAG),
+            },
+        },
+        # Apply general patches to the Kata Agent (and initrd)
+        {
+            "name": "kata-agent",
+            "func": lambda: replace_kata_agent(
+                dst_initrd_path=join(
+                    KATA_IMG_DIR,
+                    "kata-containers-initrd-confidential-sc2-baseline.img",
+                ),
+                debug=debug,
+                sc2=False,
+            ),
+            "deps": ["registry", "snp-qemu-path"],
+            "inputs": lambda: {
+                "versions": [KATA_VERSION, RUST_VERSION, PAUSE_IMAGE_VERSION],
+                "image": get_image_digest(KATA_IMAGE_TAG),
+            },
+        },
+        # Install sc2 runtime with patches (uses the same build directories
+        # as the baseline agent, so it must run after it)
+        {
+            "name": "sc2-runtime",
+            "func": install_sc2,
+            "deps": ["kata-agent", "kata-shim", "snp-qemu-path"],
+            "inputs": lambda: {
+                "versions": [KATA_VERSION, RUST_VERSION, PAUSE_IMAGE_VERSION],
+                "image": get_image_digest(KATA_IMAGE_TAG),
+                "vm_cache_size": VM_CACHE_SIZE,
+                "runtime_classes": [
+                    hash_file(conf_file(f"{runtime}_runtimeclass.yaml"))
+                    for runtime in SC2_RUNTIMES
+                ],
+            },
+        },
+        # Build the guest VM kernel. We can build it straight-away, but we can
+        # only patch the config files after installing SC2
+        {
+            "name": "guest-kernel-build",
+            "func": build_guest_kernel,
+            "deps": ["registry"],
+            "inputs": lambda: {
+                "version": GUEST_KERNEL_VERSION,
+                "image": get_image_digest(KATA_IMAGE_TAG),
+            },
+        },
+        {
+            "name": "guest-kernel-config",
+            "func": update_guest_kernel_config,
+            "deps": ["guest-kernel-build", "sc2-runtime"],
+        },
+        # Once we are done with installing components, restart containerd
+        {
+            "name": "restart-containerd",
+            "func": lambda: restart_containerd(debug=debug),
+            "deps": ["guest-kernel-config", "knative", "ovmf"],
+        },
+        {
+            "name": "vm-cache",
+            "func": start_cvm_cache,
+            "deps": ["restart-containerd"],
+            "inputs": lambda: {
+                "src": [
+                    hash_file(join(PROJ_ROOT, "vm-cache", vm_cache_file))
+                    for vm_cache_file in ["Cargo.toml", join("src", "main.rs")]
+                ]
+            },
+        },
+        # Push demo apps to local registry for easy testing
+        {
+            "name": "demo-apps",
+            "func": lambda: push_demo_apps_to_local_registry(debug=debug),
+            "deps": ["restart-containerd"],
+        },
+    ]
+
+
+def load_deployment_state():
+    """
+    Load the deployment state from the deployment file
+
+    The deployment file records the status of the deployment ("in-progress"
+    or "deployed"), the steps that have started but not finished, and, for
+    each completed step, the hash of its inputs. Files written by older
+    versions of this script are empty, and mean that SC2 has been fully
+    deployed.
+    """
+    if not exists(SC2_DEPLOYMENT_FILE):
+        return None
+
+    contents = read_file(SC2_DEPLOYMENT_FILE).strip()
+
+    if len(contents) == 0:
+        return {"status": "deployed", "steps": {}}
+
+    return json_loads(contents)
+
+
+def save_deployment_state(state):
+    """
+    Atomically write the deployment state to the deployment file. When
+    replaying a recording we have not deployed anything, so we do not write it
+    """
+    if get_replay_mode() == MODE_REPLAY:
+        return
+
+    makedirs(SC2_CONFIG_DIR, exist_ok=True)
+    tmp_file = f"{SC2_DEPLOYMENT_FILE}.tmp"
+    with open(tmp_file, "w") as fh:
+        fh.write(json_dumps(state, indent=2, sort_keys=True))
+    rename(tmp_file, SC2_DEPLOYMENT_FILE)
+
+
 @task(default=True)
-def deploy(ctx, debug=False, clean=False):
+def deploy(ctx, debug=False, clean=False, resume=False, workers=DAG_MAX_WORKERS):
     """
     Deploy an SC2-enabled bare-metal Kubernetes cluster
+
+    Use --resume to continue a deployment that failed (or to apply changes on
+    top of an existing one), skipping the steps whose inputs have not changed.
     """
     # If proxy environment variables present, apply to docker
     if is_proxy_set():
         configure_docker_proxy()
 
-    # Fail-fast if deployment exists
-    if exists(SC2_DEPLOYMENT_FILE):
-        print(f"ERROR: SC2 already deployed (file {SC2_DEPLOYMENT_FILE} exists)")
+    if clean and resume:
+        print("ERROR: --clean and --resume are mutually exclusive")
+        exit(1)
+
+    # Fail-fast if deployment exists, and we are not resuming it
+    deployment_state = load_deployment_state()
+    if deployment_state is not None and not resume:
+        if deployment_state["status"] == "deployed":
+            print(f"ERROR: SC2 already deployed (file {SC2_DEPLOYMENT_FILE} exists)")
+        else:
+            print(f"ERROR: found unfinished SC2 deployment ({SC2_DEPLOYMENT_FILE})")
+            print("ERROR: re-run with --resume to continue the deployment")
         print("ERROR: only remove deployment file if you know what you are doing!")
         exit(1)
 
+    # Deployment files from older versions do not record any steps, so we
+    # would re-run all of them, including the non-resumable ones
+    if (
+        deployment_state is not None
+        and deployment_state["status"] == "deployed"
+        and len(deployment_state["steps"]) == 0
+    ):
+        print("ERROR: can not resume a deployment without step records")
+        print("ERROR: run inv sc2.destroy, and deploy again")
+        exit(1)
+
     # Fail-fast if we are not using the expected host kernel
     host_kernel_version = get_host_kernel_version()
     host_kernel_expected_prefix = get_host_kernel_expected_prefix()
@@ -274,111 +657,65 @@ def deploy(ctx, debug=False, clean=False):
             print(result.stdout.decode("utf-8").strip())
 
     # Create SC2 config dir
-    if not exists(SC2_CONFIG_DIR):
-        makedirs(SC2_CONFIG_DIR)
+    makedirs(SC2_CONFIG_DIR, exist_ok=True)
 
     # Disable swap
     run("sudo swapoff -a", shell=True, check=True)
 
-    # Pull all artifact container images necessary
-    pull_artifact_images(debug=debug)
-
-    # Build and install containerd
-    containerd_install(debug=debug, clean=clean)
-    bbolt_install(debug=debug, clean=clean)
-
-    # Install k8s tooling (including k9s)
-    k8s_tooling_install(debug=debug, clean=clean)
-    k9s_install(debug=debug)
-
-    # Create a single-node k8s cluster
-    k8s_create(debug=debug)
-
-    # Install the CoCo operator as well as the CC-runtimes
-    operator_install(debug=debug)
-    operator_install_cc_runtime(debug=debug)
-
-    # Install the nydus-snapshotter (must happen after we install CoCo)
-    nydus_snapshotter_install(debug=debug, clean=clean)
-
-    # Install the nydusify tool
-    nydus_install()
-
-    # Start a local docker registry (must happen before knative installation,
-    # as we rely on it to host our sidecar image)
-    start_local_registry(debug=debug, clean=clean)
-
-    # Install Knative
-    knative_install(debug=debug)
-
-    # Install an up-to-date version of OVMF (the one currently shipped with
-    # CoCo is not enough to run on 6.11 and QEMU 9.1)
-    print_dotted_line(f"Installing OVMF ({OVMF_VERSION})")
-    ovmf_install()
-    print("Success!")
-
-    # Update SNP class to use default QEMU (we use host kernel 6.11, so we
-    # can use upstream QEMU 9.1). We do this update before generating the SC2
-    # runtime classes, so they will inherit the QEMU value
-    # TODO: remove when bumping to a new CoCo release
-    qemu_path = join(KATA_ROOT, "bin", "qemu-system-x86_64")
-    updated_toml_str = """
-    [hypervisor.qemu]
-    path = "{qemu_path}"
-    valid_hypervisor_paths = [ "{qemu_path}" ]
-    """.format(
-        qemu_path=qemu_path
-    )
-    update_toml(
-        join(KATA_CONFIG_DIR, "configuration-qemu-snp.toml"),
-        updated_toml_str,
-        requires_root=True,
-    )
-
-    # Apply general patches to the Kata runtime
-    replace_kata_shim(
-        dst_shim_binary=join(KATA_ROOT, "bin", "containerd-shim-kata-v2"),
-        dst_runtime_binary=join(KATA_ROOT, "bin", "kata-runtime"),
-        sc2=False,
-    )
-
-    # Apply general patches to the Kata Agent (and initrd)
-    replace_kata_agent(
-        dst_initrd_path=join(
-            KATA_IMG_DIR, "kata-containers-initrd-confidential-sc2-baseline.img"
-        ),
+    # Checkpoint every step as soon as it starts, and as soon as it finishes,
+    # so that we can resume a failed deployment
+    if deployment_state is None:
+        deployment_state = {"steps": {}}
+    deployment_state["status"] = "in-progress"
+    completed_hashes = {
+        name: step["hash"] for name, step in deployment_state["steps"].items()
+    }
+
+    # Steps that failed half-way through will run again from the start, so we
+    # can only resume them if they can run on top of a partial run
+    deploy_steps = get_deploy_steps(debug=debug, clean=clean)
+    interrupted_steps = [
+        step["name"]
+        for step in deploy_steps
+        if step["name"] in deployment_state.get("running", [])
+        and not step.get("resumable", True)
+    ]
+    if len(interrupted_steps) > 0:
+        print(f"ERROR: can not resume interrupted step(s): {interrupted_steps}")
+        print("ERROR: run inv sc2.destroy, and deploy again")
+        exit(1)
+    deployment_state["running"] = []
+
+    def on_step_start(name):
+        deployment_state["running"].append(name)
+        save_deployment_state(deployment_state)
+
+    def on_step_done(name, step_hash, step_time):
+        deployment_state["running"].remove(name)
+
+        # If the hash is the same, we have skipped the step
+        if completed_hashes.get(name) != step_hash:
+            deployment_state["steps"][name] = {
+                "completed_at": time(),
+                "duration_secs": step_time,
+                "hash": step_hash,
+            }
+        save_deployment_state(deployment_state)
+
+    # Run all the deployment steps respecting the dependencies between them,
+    # so that independent steps run at the same time
+    run_dag(
+        deploy_steps,
+        max_workers=workers,
         debug=debug,
-        sc2=False,
+        completed_hashes=completed_hashes,
+        on_step_start=on_step_start,
+        on_step_done=on_step_done,
     )
 
-    # Install sc2 runtime with patches
-    print_dotted_line(f"Installing SC2 (v{COCO_VERSION})")
-    install_sc2_runtime(debug=debug)
-    print("Success!")
-
-    # Build and install the guest VM kernel (must be after installing SC2, so
-    # that we can patch all config files)
-    print_dotted_line(f"Build and install guest VM kernel (v{GUEST_KERNEL_VERSION})")
-    build_guest_kernel()
-    print("Success!")
-
-    # Once we are done with installing components, restart containerd
-    restart_containerd(debug=debug)
-
-    # Start the VM cache at the end so that we can pick up the latest config
-    # changes
-    print_dotted_line("Starting cVM cache...")
-    start_vm_cache(debug=debug)
-    print("Success!")
-
-    # Push demo apps to local registry for easy testing
-    push_demo_apps_to_local_registry(debug=debug)
-
-    # Finally, create a deployment file (right now, it is empty)
-    result = run(f"touch {SC2_DEPLOYMENT_FILE}", shell=True, capture_output=True)
-    assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-    if debug:
-        print(result.stdout.decode("utf-8").strip())
+    # Finally, mark the deployment as completed
+    deployment_state["status"] = "deployed"
+    save_deployment_state(deployment_state)
 
 
 @task
@@ -1,8 +1,9 @@
 from invoke import task
-from os.path import exists, join
+from os.path import join
 from subprocess import run
 from tasks.util.docker import build_image, copy_from_ctr_image
 from tasks.util.env import GHCR_URL, GITHUB_ORG, PROJ_ROOT, SC2_ROOT
+from tasks.util.host import exists
 from tasks.util.kata import KATA_AGENT_SOURCE_DIR, KATA_IMAGE_TAG, KATA_SOURCE_DIR
 from tasks.util.kernel import get_host_kernel_version
 from tasks.util.versions import IGVM_VERSION
@@ -0,0 +1,166 @@
+from asyncio import (
+    CancelledError,
+    Semaphore,
+    TimeoutError as AsyncTimeoutError,
+    create_subprocess_shell,
+    gather as asyncio_gather,
+    get_running_loop,
+    run as asyncio_run,
+    shield,
+    sleep,
+    wait_for,
+)
+from asyncio.subprocess import DEVNULL, PIPE
+from subprocess import TimeoutExpired
+from tasks.util.cmd import (
+    NO_RETRY,
+    CmdResult,
+    check_cmd_result,
+    get_resource_semaphore,
+    get_retry_backoff_secs,
+)
+from tasks.util.replay import replay_cmd_async
+from tasks.util.tracing import SPAN_COMMAND, async_span
+from time import time
+
+
+async def _acquire_resource_semaphore(semaphore):
+    """
+    Acquire one of the (process-wide, thread-based) resource semaphores in
+    `tasks.util.cmd` without blocking the event loop. We wait for it in the
+    loop's executor, and if we are cancelled while waiting, we release it as
+    soon as we get it
+    """
+    if semaphore.acquire(blocking=False):
+        return
+
+    acquired = get_running_loop().run_in_executor(None, semaphore.acquire)
+    try:
+        await shield(acquired)
+    except CancelledError:
+        acquired.add_done_callback(lambda _: semaphore.release())
+        raise
+
+
+@replay_cmd_async
+async def _run_once(cmd, cwd, env, stdin, timeout, debug):
+    proc = await create_subprocess_shell(
+        cmd,
+        cwd=cwd,
+        env=env,
+        stdin=PIPE if stdin is not None else DEVNULL,
+        stdout=PIPE,
+        stderr=PIPE,
+    )
+
+    async def read_stream(stream):
+        lines = []
+        async for line in stream:
+            line = line.decode("utf-8")
+            lines.append(line)
+            if debug:
+                print(line, end="", flush=True)
+
+        return "".join(lines)
+
+    async def communicate():
+        if stdin is not None:
+            proc.stdin.write(stdin)
+            await proc.stdin.drain()
+            proc.stdin.close()
+
+        stdout, stderr = await asyncio_gather(
+            read_stream(proc.stdout), read_stream(proc.stderr)
+        )
+        await proc.wait()
+        return proc.returncode, stdout, stderr
+
+    try:
+        return await wait_for(communicate(), timeout)
+    except AsyncTimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise TimeoutExpired(cmd, timeout)
+
+
+async def run_cmd_async(
+    cmd,
+    cwd=None,
+    env=None,
+    stdin=None,
+    timeout=None,
+    retry=NO_RETRY,
+    resource=None,
+    check=True,
+    debug=False,
+    error_msg=None,
+):
+    """
+    Async version of `tasks.util.cmd.run_cmd` (see there for the parameters)
+    """
+    if isinstance(cmd, list):
+        cmd = " ".join(cmd)
+    if isinstance(stdin, str):
+        stdin = stdin.encode("utf-8")
+
+    semaphore = get_resource_semaphore(resource) if resource else None
+
+    for attempt in range(1, retry.max_attempts + 1):
+        start_ts = time()
+        if semaphore is not None:
+            await _acquire_resource_semaphore(semaphore)
+        try:
+            span_name = cmd.strip().split("\n")[0][:80]
+            with async_span(span_name, SPAN_COMMAND, {"cmd": cmd}):
+                returncode, stdout, stderr = await _run_once(
+                    cmd, cwd, env, stdin, timeout, debug
+                )
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+        result = CmdResult(cmd, returncode, stdout, stderr, time() - start_ts, attempt)
+        backoff_secs = get_retry_backoff_secs(result, retry, debug)
+        if backoff_secs is None:
+            break
+
+        await sleep(backoff_secs)
+
+    if check:
+        check_cmd_result(result, error_msg)
+
+    return result
+
+
+async def gather(*aws, max_concurrency=None):
+    """
+    Await a number of coroutines concurrently, and return their results in
+    order. Optionally, bound how many of them run at the same time
+
+    Unlike `asyncio.gather`, we always wait for all the coroutines to finish
+    (even if some fail), and then re-raise the first error, so that we do not
+    leave commands running in the background
+    """
+    if max_concurrency is not None:
+        semaphore = Semaphore(max_concurrency)
+
+        async def bounded(aw):
+            async with semaphore:
+                return await aw
+
+        aws = [bounded(aw) for aw in aws]
+
+    results = await asyncio_gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    return results
+
+
+def run_all(*aws, max_concurrency=None):
+    """
+    Run a number of coroutines concurrently, from synchronous (i.e. task) code,
+    and return their results in order
+    """
+    return asyncio_run(gather(*aws, max_concurrency=max_concurrency))
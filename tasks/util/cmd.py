@@ -0,0 +1,223 @@
+from collections import namedtuple
+from queue import Empty, Queue
+from tasks.util.replay import replay_cmd
+from tasks.util.tracing import SPAN_COMMAND, span
+from threading import BoundedSemaphore, Lock, Thread
+from time import sleep, time
+import subprocess
+
+# Result of running a command. `stdout` and `stderr` are decoded strings, and
+# `duration` is the wall time (in seconds) of the last attempt
+CmdResult = namedtuple(
+    "CmdResult", ["cmd", "returncode", "stdout", "stderr", "duration", "attempts"]
+)
+
+# Policy to retry failed commands: we run a command up to `max_attempts`
+# times, sleeping `backoff_secs * backoff_factor ** i` between attempt i and
+# i + 1. Commands are retried when they return a non-zero exit code, or when
+# `retry_if` (a callable taking a CmdResult) returns True
+RetryPolicy = namedtuple(
+    "RetryPolicy",
+    ["max_attempts", "backoff_secs", "backoff_factor", "retry_if"],
+    defaults=[1, 1, 2, None],
+)
+NO_RETRY = RetryPolicy()
+# Use this policy for commands that talk to services that may be (re)starting,
+# like the local registry, or the API server
+RETRY_ON_TRANSIENT_ERROR = RetryPolicy(max_attempts=3, backoff_secs=3, backoff_factor=1)
+
+# Maximum number of commands using the same resource that we run at the same
+# time, across all threads, and both sync and async commands. Commands are
+# tagged with a resource when we call `run_cmd` (or `run_cmd_async`)
+RESOURCE_LIMITS = {
+    "apt": 1,
+    "docker-build": 2,
+    "docker-pull": 4,
+    "docker-push": 4,
+}
+_RESOURCE_SEMAPHORES = {}
+_RESOURCE_SEMAPHORES_LOCK = Lock()
+
+
+def get_resource_semaphore(resource):
+    """
+    Get the process-wide semaphore that bounds the commands using a resource
+    """
+    with _RESOURCE_SEMAPHORES_LOCK:
+        if resource not in _RESOURCE_SEMAPHORES:
+            if resource not in RESOURCE_LIMITS:
+                print(f"ERROR: unrecognised resource: {resource}")
+                print(f"ERROR: resource must be one in: {list(RESOURCE_LIMITS)}")
+                raise RuntimeError("Unrecognised resource!")
+
+            _RESOURCE_SEMAPHORES[resource] = BoundedSemaphore(RESOURCE_LIMITS[resource])
+
+        return _RESOURCE_SEMAPHORES[resource]
+
+
+@replay_cmd
+def _run_once(cmd, cwd, env, stdin, timeout, debug):
+    """
+    Run a command once, and return its exit code, stdout, and stderr. If debug
+    is set, we also print the command's output as it runs
+    """
+    proc = subprocess.Popen(
+        cmd,
+        shell=True,
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    if not debug:
+        try:
+            stdout, stderr = proc.communicate(input=stdin, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise
+
+        return proc.returncode, stdout.decode("utf-8"), stderr.decode("utf-8")
+
+    # To stream the output, we read stdout and stderr from two threads, but
+    # print them from this one (as stdout may be buffered per-thread, see
+    # tasks/util/dag.py)
+    lines = Queue()
+
+    def read_stream(stream, name):
+        for line in stream:
+            lines.put((name, line.decode("utf-8")))
+        lines.put((name, None))
+
+    readers = [
+        Thread(target=read_stream, args=(proc.stdout, "stdout"), daemon=True),
+        Thread(target=read_stream, args=(proc.stderr, "stderr"), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    if stdin is not None:
+        proc.stdin.write(stdin)
+        proc.stdin.close()
+
+    output = {"stdout": [], "stderr": []}
+    num_open_streams = len(readers)
+    start_ts = time()
+    while num_open_streams > 0:
+        try:
+            name, line = lines.get(timeout=1)
+        except Empty:
+            if timeout is not None and time() - start_ts > timeout:
+                proc.kill()
+                proc.wait()
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            continue
+
+        if line is None:
+            num_open_streams -= 1
+            continue
+
+        output[name].append(line)
+        print(line, end="", flush=True)
+
+    proc.wait()
+    return proc.returncode, "".join(output["stdout"]), "".join(output["stderr"])
+
+
+def run_cmd(
+    cmd,
+    cwd=None,
+    env=None,
+    stdin=None,
+    timeout=None,
+    retry=NO_RETRY,
+    resource=None,
+    check=True,
+    debug=False,
+    error_msg=None,
+):
+    """
+    Run a shell command, and return a CmdResult
+
+    Parameters:
+    - cmd: shell command to run (as a string)
+    - cwd: directory to run the command from
+    - env: environment for the command (defaults to the current one)
+    - stdin: string or bytes to pipe into the command's stdin
+    - timeout: seconds after which we kill the command (and raise)
+    - retry: RetryPolicy for failed commands (defaults to no retries)
+    - resource: resource that the command uses, to bound how many commands
+                using it run at the same time (see RESOURCE_LIMITS)
+    - check: whether to raise an error if the command fails
+    - debug: whether to print the command's output as it runs
+    - error_msg: message for the error that we raise if the command fails
+    """
+    if isinstance(cmd, list):
+        cmd = " ".join(cmd)
+    if isinstance(stdin, str):
+        stdin = stdin.encode("utf-8")
+
+    semaphore = get_resource_semaphore(resource) if resource else None
+
+    for attempt in range(1, retry.max_attempts + 1):
+        start_ts = time()
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            with span(cmd.strip().split("\n")[0][:80], SPAN_COMMAND, {"cmd": cmd}):
+                returncode, stdout, stderr = _run_once(
+                    cmd, cwd, env, stdin, timeout, debug
+                )
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+        result = CmdResult(cmd, returncode, stdout, stderr, time() - start_ts, attempt)
+        backoff_secs = get_retry_backoff_secs(result, retry, debug)
+        if backoff_secs is None:
+            break
+
+        sleep(backoff_secs)
+
+    if check:
+        check_cmd_result(result, error_msg)
+
+    return result
+
+
+def get_retry_backoff_secs(result, retry, debug=False):
+    """
+    Return how long to wait before retrying a command, or None if we should
+    not retry it
+    """
+    must_retry = result.returncode != 0 or (
+        retry.retry_if is not None and retry.retry_if(result)
+    )
+    if not must_retry or result.attempts >= retry.max_attempts:
+        return None
+
+    if debug:
+        print(
+            f"WARNING: command failed (attempt {result.attempts}/"
+            f"{retry.max_attempts}), retrying: {result.cmd}"
+        )
+
+    return retry.backoff_secs * retry.backoff_factor ** (result.attempts - 1)
+
+
+def check_cmd_result(result, error_msg=None):
+    """
+    Raise an error (after printing the command's output) if a command failed
+    """
+    if result.returncode == 0:
+        return
+
+    print(f"ERROR: running command: {result.cmd}")
+    print(f"ERROR: exit code: {result.returncode} (attempts: {result.attempts})")
+    if result.stdout.strip():
+        print(f"ERROR: stdout: {result.stdout.strip()}")
+    if result.stderr.strip():
+        print(f"ERROR: stderr: {result.stderr.strip()}")
+    raise RuntimeError(error_msg or "Error running command!")
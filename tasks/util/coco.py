@@ -1,6 +1,6 @@
 from os.path import join
 from tasks.util.env import KATA_CONFIG_DIR, KBS_PORT, get_node_url
-from tasks.util.toml import read_value_from_toml, update_toml
+from tasks.util.toml import read_value_from_toml, toml_transaction, update_toml
 
 
 def guest_attestation(
@@ -14,25 +14,26 @@ def guest_attestation(
     """
     # Update the pre_attestation flag
     att_val = str(mode == "on").lower()
-    updated_toml_str = """
-    [hypervisor.qemu]
-    guest_pre_attestation = {att_val}
-    """.format(
-        att_val=att_val
-    )
-    update_toml(conf_file_path, updated_toml_str)
-
-    # We also update the KBS URI if pre_attestation is enabled
-    if mode == "on":
-        # We need to set the KBS URL to something that is reachable both from
-        # the host _and_ the guest
+    with toml_transaction(conf_file_path) as conf:
         updated_toml_str = """
         [hypervisor.qemu]
-        guest_pre_attestation_kbs_uri = "{kbs_url}:{kbs_port}"
+        guest_pre_attestation = {att_val}
         """.format(
-            kbs_url=get_node_url(), kbs_port=KBS_PORT
+            att_val=att_val
         )
-        update_toml(conf_file_path, updated_toml_str)
+        conf.update(updated_toml_str)
+
+        # We also update the KBS URI if pre_attestation is enabled
+        if mode == "on":
+            # We need to set the KBS URL to something that is reachable both
+            # from the host _and_ the guest
+            updated_toml_str = """
+            [hypervisor.qemu]
+            guest_pre_attestation_kbs_uri = "{kbs_url}:{kbs_port}"
+            """.format(
+                kbs_url=get_node_url(), kbs_port=KBS_PORT
+            )
+            conf.update(updated_toml_str)
 
 
 def signature_verification(
@@ -0,0 +1,211 @@
+from glob import glob
+from hashlib import sha256
+from json import dump as json_dump, load as json_load
+from os import getpid, makedirs, rename
+from os.path import exists, join
+from tasks.util.env import SC2_CONFIG_DIR
+from tasks.util.host import exists as host_exists, glob as host_glob
+from tasks.util.sudo import sudo_read_files, sudo_remove, sudo_write_files
+from time import time
+
+# Content-addressed store of config file snapshots. Each file's contents are
+# stored once, under their SHA256 digest, in the objects directory. A snapshot
+# is a manifest mapping file paths to digests (or None if the file did not
+# exist), and its ID is derived from the manifest, so taking the same snapshot
+# twice is free. We never modify a manifest once written: names are aliases,
+# kept in a separate file that maps each name to the last snapshot taken with it
+CONFIG_STORE_DIR = join(SC2_CONFIG_DIR, "config-store")
+CONFIG_OBJECTS_DIR = join(CONFIG_STORE_DIR, "objects")
+CONFIG_SNAPSHOTS_DIR = join(CONFIG_STORE_DIR, "snapshots")
+CONFIG_SNAPSHOT_NAMES_FILE = join(CONFIG_STORE_DIR, "names.json")
+
+SNAPSHOT_ID_LEN = 12
+
+
+def _get_digest(data):
+    return sha256(data).hexdigest()
+
+
+def _write_atomically(path, data, mode="wb"):
+    tmp_path = f"{path}.{getpid()}.tmp"
+    with open(tmp_path, mode) as fh:
+        if mode == "w":
+            json_dump(data, fh, indent=2)
+        else:
+            fh.write(data)
+    rename(tmp_path, path)
+
+
+def _read_object(digest):
+    with open(join(CONFIG_OBJECTS_DIR, digest), "rb") as fh:
+        data = fh.read()
+
+    if _get_digest(data) != digest:
+        print(f"ERROR: config store object is corrupted: {digest}")
+        raise RuntimeError("Corrupted config store!")
+
+    return data
+
+
+def read_config_files(file_paths):
+    """
+    Read the current contents of many (possibly root-owned) files, in one
+    privileged request. Missing files map to None
+    """
+    contents = {file_path: None for file_path in file_paths}
+    existing_paths = [file_path for file_path in file_paths if host_exists(file_path)]
+    if len(existing_paths) > 0:
+        contents.update(sudo_read_files(existing_paths))
+
+    return contents
+
+
+def expand_config_paths(file_paths):
+    """
+    Expand the glob patterns in a list of file paths. Paths without patterns
+    are always kept, so that we can record that they do not exist
+    """
+    expanded_paths = []
+    for file_path in file_paths:
+        if "*" in file_path:
+            expanded_paths += host_glob(file_path)
+        else:
+            expanded_paths.append(file_path)
+
+    return expanded_paths
+
+
+def take_config_snapshot(file_paths, name=None):
+    """
+    Store the current contents of a set of files, and return the snapshot's
+    manifest
+    """
+    makedirs(CONFIG_OBJECTS_DIR, exist_ok=True)
+    makedirs(CONFIG_SNAPSHOTS_DIR, exist_ok=True)
+
+    files = {}
+    for file_path, data in read_config_files(file_paths).items():
+        if data is None:
+            files[file_path] = None
+            continue
+
+        digest = _get_digest(data)
+        object_path = join(CONFIG_OBJECTS_DIR, digest)
+        if not exists(object_path):
+            _write_atomically(object_path, data)
+        files[file_path] = digest
+
+    snapshot_key = "\n".join(
+        [f"{file_path} {files[file_path]}" for file_path in sorted(files)]
+    )
+    snapshot_id = _get_digest(snapshot_key.encode("utf-8"))[:SNAPSHOT_ID_LEN]
+
+    manifest_path = join(CONFIG_SNAPSHOTS_DIR, f"{snapshot_id}.json")
+    if not exists(manifest_path):
+        manifest = {"id": snapshot_id, "files": files, "created": time()}
+        _write_atomically(manifest_path, manifest, mode="w")
+
+    if name is not None:
+        snapshot_names = get_config_snapshot_names()
+        snapshot_names[name] = snapshot_id
+        _write_atomically(CONFIG_SNAPSHOT_NAMES_FILE, snapshot_names, mode="w")
+
+    return get_config_snapshot(snapshot_id)
+
+
+def get_config_snapshot_names():
+    """
+    Return a dictionary mapping each snapshot name to a snapshot ID
+    """
+    if not exists(CONFIG_SNAPSHOT_NAMES_FILE):
+        return {}
+
+    with open(CONFIG_SNAPSHOT_NAMES_FILE, "r") as fh:
+        return json_load(fh)
+
+
+def list_config_snapshots():
+    """
+    Return the manifests of all snapshots, from oldest to newest. We add the
+    names that point to each snapshot to its manifest
+    """
+    if not exists(CONFIG_SNAPSHOTS_DIR):
+        return []
+
+    snapshot_names = get_config_snapshot_names()
+    manifests = []
+    for manifest_path in glob(join(CONFIG_SNAPSHOTS_DIR, "*.json")):
+        with open(manifest_path, "r") as fh:
+            manifest = json_load(fh)
+        manifest["names"] = sorted(
+            [
+                name
+                for name, snap_id in snapshot_names.items()
+                if snap_id == manifest["id"]
+            ]
+        )
+        manifests.append(manifest)
+
+    return sorted(manifests, key=lambda manifest: manifest["created"])
+
+
+def get_config_snapshot(snapshot_ref):
+    """
+    Get a snapshot's manifest given its ID, a unique prefix of it, or its name
+    """
+    manifests = list_config_snapshots()
+    matches = [m for m in manifests if m["id"] == snapshot_ref]
+    if len(matches) > 0:
+        return matches[-1]
+
+    # A name points to the last snapshot that we took with it
+    snapshot_id = get_config_snapshot_names().get(snapshot_ref)
+    matches = [m for m in manifests if m["id"] == snapshot_id]
+    if len(matches) > 0:
+        return matches[-1]
+
+    matches = [m for m in manifests if m["id"].startswith(snapshot_ref)]
+    if len(matches) == 0:
+        print(f"ERROR: no config snapshot with id or name: {snapshot_ref}")
+        raise RuntimeError("Config snapshot not found!")
+
+    if len(matches) > 1:
+        print(f"ERROR: ambiguous config snapshot: {snapshot_ref}")
+        print(f"ERROR: matches: {[m['id'] for m in matches]}")
+        raise RuntimeError("Ambiguous config snapshot!")
+
+    return matches[0]
+
+
+def restore_config_snapshot(manifest):
+    """
+    Restore the files in a snapshot, and return the list of paths that
+    changed. We check that we have all the contents we need before touching
+    any file, and then write all the changed files in one privileged batch,
+    replacing each of them atomically
+    """
+    files = manifest["files"]
+    target_contents = {
+        file_path: None if digest is None else _read_object(digest)
+        for file_path, digest in files.items()
+    }
+    current_contents = read_config_files(list(files))
+
+    changed_paths = [
+        file_path
+        for file_path in files
+        if target_contents[file_path] != current_contents[file_path]
+    ]
+    to_write = {
+        file_path: target_contents[file_path]
+        for file_path in changed_paths
+        if target_contents[file_path] is not None
+    }
+    if len(to_write) > 0:
+        sudo_write_files(to_write)
+
+    for file_path in changed_paths:
+        if target_contents[file_path] is None:
+            sudo_remove(file_path)
+
+    return changed_paths
@@ -1,8 +1,11 @@
-from json import loads as json_loads
-from os.path import exists, join
-from subprocess import CalledProcessError, run
+from json import JSONDecodeError, loads as json_loads
+from os.path import join
+from tasks.util.aio import run_cmd_async
+from tasks.util.cmd import run_cmd
 from tasks.util.docker import build_image
 from tasks.util.env import GHCR_URL, GITHUB_ORG, PROJ_ROOT
+from tasks.util.journal import JournalIndex
+from tasks.util.unix_socket import wait_for_unix_socket
 from tasks.util.versions import CONTAINERD_VERSION
 from time import sleep, time
 
@@ -10,6 +13,9 @@ CONTAINERD_IMAGE_TAG = (
     join(GHCR_URL, GITHUB_ORG, "containerd") + f":{CONTAINERD_VERSION}"
 )
 
+CONTAINERD_SOCKET_PATH = "/run/containerd/containerd.sock"
+CRICTL_CMD = f"sudo crictl --runtime-endpoint unix://{CONTAINERD_SOCKET_PATH}"
+
 
 def build_containerd_image(nocache, push, debug=True):
     build_image(
@@ -22,109 +28,132 @@ def build_containerd_image(nocache, push, debug=True):
 
 
 def is_containerd_active():
-    out = (
-        run("sudo systemctl is-active containerd", shell=True, capture_output=True)
-        .stdout.decode("utf-8")
-        .strip()
-    )
-    return out == "active"
+    result = run_cmd("sudo systemctl is-active containerd", check=False)
+    return result.stdout.strip() == "active"
 
 
 def restart_containerd(debug=False):
     """
     Utility function to gracefully restart the containerd service
     """
-    run("sudo service containerd restart", shell=True, check=True)
+    run_cmd("sudo service containerd restart", debug=debug)
 
-    # First wait for systemd to report containerd as active
-    while not is_containerd_active():
-        if debug:
-            print("Waiting for containerd to be active...")
+    # Containerd is ready once we can dial its socket
+    wait_for_containerd_socket(debug=debug)
 
-        sleep(2)
 
-    # Then make sure we can dial the socket
-    wait_for_containerd_socket()
+def get_crictl_images():
+    """
+    Get the images in containerd's image store (i.e. `sudo crictl images`)
+    """
+    result = run_cmd(f"{CRICTL_CMD} images -o json")
+    try:
+        return json_loads(result.stdout)["images"]
+    except JSONDecodeError as e:
+        print(
+            f"ERROR: run command: {result.cmd}, got stdout: {result.stdout}, "
+            f"stderr: {result.stderr}"
+        )
+        raise e
 
 
-def get_journalctl_containerd_logs(timeout_mins=1):
+def get_sandbox_id_from_container(container_id):
     """
-    Get the journalctl logs for containerd
-
-    We dump them to a temporary file to prevent the Popen output from being
-    clipped (or at least remove the chance of it being so)
+    Get the ID of the pod sandbox that a container runs in, or an empty string
+    if we can not find the container
     """
-    tmp_file = "/tmp/journalctl.log"
-    journalctl_cmd = "sudo journalctl -xeu containerd --no-tail "
-    journalctl_cmd += '--since "{} min ago" -o json > {}'.format(timeout_mins, tmp_file)
-    run(journalctl_cmd, shell=True, check=True)
+    result = run_cmd(f"{CRICTL_CMD} inspect -o json {container_id}", check=False)
+    if result.returncode != 0:
+        return ""
 
-    with open(tmp_file, "r") as fh:
-        lines = fh.readlines()
+    try:
+        return json_loads(result.stdout)["info"]["sandboxID"]
+    except (JSONDecodeError, KeyError):
+        return ""
 
-    return lines
 
+async def remove_crictl_image_async(image_id, debug=False):
+    await run_cmd_async(f"{CRICTL_CMD} rmi {image_id}", debug=debug)
 
-def get_event_from_containerd_logs(
+
+# We read new journal entries if our index is older than this, so that we do
+# not miss recent events (e.g. from the pod we have just started)
+JOURNAL_INDEX_MAX_AGE_SECS = 2
+
+_CONTAINERD_JOURNAL = JournalIndex("containerd")
+
+
+def get_containerd_journal(timeout_mins=1, refresh=False):
+    """
+    Return an index of the containerd journal, covering (at least) the last
+    `timeout_mins` minutes. We only read new entries if our index is stale
+    """
+    journal = _CONTAINERD_JOURNAL
+    if (
+        refresh
+        or journal.refresh_ts is None
+        or time() - journal.refresh_ts > JOURNAL_INDEX_MAX_AGE_SECS
+        or journal.since_ts > time() - timeout_mins * 60
+    ):
+        journal.refresh(timeout_mins)
+
+    return journal
+
+
+def _find_containerd_events(
     event_name, event_id, num_events, extra_event_id=None, timeout_mins=1
 ):
     """
-    Get the last `num_events` events in containerd logs that correspond to
-    the `event_name` for sandbox/pod/container id `event_id`
+    Get the positions, in the containerd journal index, of the last
+    `num_events` events that correspond to the `event_name` for
+    sandbox/pod/container id `event_id`
     """
-    # Parsing from `journalctl` is slightly hacky, and prone to spurious
-    # errors. We put a lot of assertions here to make sure that the timestamps
-    # we read are the adequate ones, thus we allow some failures and retry
+    # Events may take a while to show up in the journal, so we allow some
+    # failures and retry (re-reading the journal)
     num_repeats = 3
     backoff_secs = 3
     for i in range(num_repeats):
-        try:
-            out = get_journalctl_containerd_logs(timeout_mins)
-
-            event_json = []
-            for o in out:
-                o_json = json_loads(o)
-                if (
-                    o_json is None
-                    or "MESSAGE" not in o_json
-                    or o_json["MESSAGE"] is None
-                ):
-                    # Sometimes, after resetting containerd, some of the
-                    # journal messages won't have a "MESSAGE" in it, so we skip
-                    # them
-                    continue
-                try:
-                    if (
-                        event_name in o_json["MESSAGE"]
-                        and event_id in o_json["MESSAGE"]
-                    ):
-                        if (
-                            extra_event_id is None
-                            or extra_event_id in o_json["MESSAGE"]
-                        ):
-                            event_json.append(o_json)
-                except TypeError as e:
-                    print(o_json)
-                    print(e)
-                    raise e
-
-            assert (
-                len(event_json) >= num_events
-            ), "Not enough events in log: {} !>= {}".format(len(event_json), num_events)
-
-            return event_json[-num_events:]
-        except AssertionError as e:
-            print(e)
-            print(
-                "WARNING: Failed getting event {} (id: {}) (attempt {}/{})".format(
-                    event_name,
-                    event_id,
-                    i + 1,
-                    num_repeats,
-                )
+        journal = get_containerd_journal(timeout_mins, refresh=i > 0)
+        positions = journal.find(
+            event_name,
+            event_id,
+            extra_event_id=extra_event_id,
+            since_ts=time() - timeout_mins * 60,
+        )
+        if len(positions) >= num_events:
+            return journal, positions[-num_events:]
+
+        print("Not enough events in log: {} !>= {}".format(len(positions), num_events))
+        print(
+            "WARNING: Failed getting event {} (id: {}) (attempt {}/{})".format(
+                event_name,
+                event_id,
+                i + 1,
+                num_repeats,
             )
+        )
+        if i < num_repeats - 1:
             sleep(backoff_secs)
-            continue
+
+    print(f"ERROR: can not find {num_events} event(s) {event_name} (id: {event_id})")
+    raise RuntimeError("Error getting event from containerd logs!")
+
+
+def get_event_from_containerd_logs(
+    event_name, event_id, num_events, extra_event_id=None, timeout_mins=1
+):
+    """
+    Get the last `num_events` events in containerd logs that correspond to
+    the `event_name` for sandbox/pod/container id `event_id`
+    """
+    journal, positions = _find_containerd_events(
+        event_name,
+        event_id,
+        num_events,
+        extra_event_id=extra_event_id,
+        timeout_mins=timeout_mins,
+    )
+    return [journal.get_entry(idx) for idx in positions]
 
 
 def get_ts_for_containerd_event(
@@ -137,10 +166,14 @@ def get_ts_for_containerd_event(
     """
     Get the journalctl timestamp for one event in the containerd logs
     """
-    event_json = get_event_from_containerd_logs(
-        event_name, event_id, 1, extra_event_id=None, timeout_mins=timeout_mins
-    )[0]
-    ts = int(event_json["__REALTIME_TIMESTAMP"]) / 1e6
+    journal, positions = _find_containerd_events(
+        event_name,
+        event_id,
+        1,
+        extra_event_id=extra_event_id,
+        timeout_mins=timeout_mins,
+    )
+    ts = journal.get_ts(positions[0])
 
     if lower_bound is not None:
         assert (
@@ -163,7 +196,7 @@ def get_start_end_ts_for_containerd_event(
     Get the start and end timestamps (in epoch floating seconds) for a given
     event from the containerd journalctl logs
     """
-    event_json = get_event_from_containerd_logs(
+    journal, positions = _find_containerd_events(
         event_name,
         event_id,
         2,
@@ -171,8 +204,8 @@ def get_start_end_ts_for_containerd_event(
         timeout_mins=timeout_mins,
     )
 
-    start_ts = int(event_json[-2]["__REALTIME_TIMESTAMP"]) / 1e6
-    end_ts = int(event_json[-1]["__REALTIME_TIMESTAMP"]) / 1e6
+    start_ts = journal.get_ts(positions[-2])
+    end_ts = journal.get_ts(positions[-1])
 
     assert end_ts > start_ts, "End and start timestamp not in order: {} !> {}".format(
         end_ts, start_ts
@@ -196,71 +229,26 @@ def get_all_events_in_between(
     events with `start_event` and `start_event_id` in their message and
     `end_event` and `end_event_id`.
     """
-    out = get_journalctl_containerd_logs()
-    events_json = []
-
-    # First, find the sub-list containing all events between our begining
-    # and end event
-    start_event_idx = -1
-    end_event_idx = -1
-    for idx, o in enumerate(out):
-        o_json = json_loads(o)
-        if o_json is None or "MESSAGE" not in o_json or o_json["MESSAGE"] is None:
-            continue
-
-        if start_event in o_json["MESSAGE"] and start_event_id in o_json["MESSAGE"]:
-            start_event_idx = idx
-
-        if end_event in o_json["MESSAGE"] and end_event_id in o_json["MESSAGE"]:
-            end_event_idx = idx
+    # First, find the last end event (re-reading the journal until it shows
+    # up), and then the last beginning event
+    journal, end_positions = _find_containerd_events(end_event, end_event_id, 1)
+    start_positions = journal.find(start_event, start_event_id)
 
     # Sanity check the indexes
-    assert start_event_idx >= 0, "Could not find start event: {} (id: {})".format(
+    assert len(start_positions) > 0, "Could not find start event: {} (id: {})".format(
         start_event, start_event_id
     )
-    assert end_event_idx >= 0, "Could not find end event: {} (id: {})".format(
-        end_event, end_event_id
-    )
+    start_event_idx = start_positions[-1]
+    end_event_idx = end_positions[-1]
     assert end_event_idx > start_event_idx, "End event earlier than start event"
 
-    # Then filter the sub-list for the events we are interested in
-    for o in out[start_event_idx:end_event_idx]:
-        o_json = json_loads(o)
-        if event_to_find in o_json["MESSAGE"]:
-            events_json.append(o_json)
-
-    return events_json
-
-
-def wait_for_containerd_socket():
-    timeout = 10
-    interval = 1
-    socket_path = "/run/containerd/containerd.sock"
-
-    # Socket is root-owned, so we need to be careful when probing it
-    socket_test_script = f"""
-import socket
-try:
-    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
-        s.connect('{socket_path}')
-except Exception as e:
-    exit(1)
-exit(0)
-"""
-    start_time = time()
-    while time() - start_time < timeout:
-        if exists(socket_path):
-            try:
-                run(
-                    f'sudo python3 -c "{socket_test_script}"',
-                    shell=True,
-                    check=True,
-                )
-
-                return
-            except CalledProcessError:
-                pass
-
-        sleep(interval)
-
-    raise RuntimeError("Error dialing containerd socket!")
+    # Then filter the events in between for the ones we are interested in
+    return [
+        journal.get_entry(idx)
+        for idx in range(start_event_idx, end_event_idx)
+        if event_to_find in journal.get_message(idx)
+    ]
+
+
+def wait_for_containerd_socket(debug=False):
+    wait_for_unix_socket(CONTAINERD_SOCKET_PATH, name="containerd", debug=debug)
@@ -0,0 +1,230 @@
+from datetime import datetime
+from json import JSONDecodeError, dumps as json_dumps, loads as json_loads
+from re import compile as regex_compile
+from subprocess import DEVNULL, PIPE, Popen
+from tasks.util.cmd import run_cmd
+from threading import Lock, Thread
+
+# Subscribe to containerd's event stream, to timestamp the lifecycle of each
+# sandbox (and its containers and snapshots) without scraping containerd's
+# logs. Containerd timestamps each event when it publishes it (with ns
+# precision), so the timestamps do not depend on when we read the events.
+#
+# We read the events with `ctr events`, which prints one event per line:
+# <date> <time> <offset> <tz> <namespace> <topic> <event as JSON>
+CONTAINERD_EVENTS_NAMESPACE = "k8s.io"
+CONTAINERD_EVENT_TOPICS = ["/tasks/", "/containers/", "/snapshot/"]
+
+# Labels and annotations that the CRI plugin sets on every container
+CRI_KIND_LABEL = "io.cri-containerd.kind"
+CRI_POD_NAME_LABEL = "io.kubernetes.pod.name"
+CRI_POD_NAMESPACE_LABEL = "io.kubernetes.pod.namespace"
+CRI_SANDBOX_ID_ANNOTATION = "io.kubernetes.cri.sandbox-id"
+
+_ID_RE = regex_compile(r"[0-9a-f]{64}")
+
+
+def _parse_go_timestamp(date, time_of_day, offset):
+    """
+    Parse a timestamp as printed by Go (e.g. 2024-05-01 10:00:00.123456789
+    +0000), keeping the sub-second part as a float to avoid truncating it
+    """
+    hms, _, fraction = time_of_day.partition(".")
+    ts = datetime.strptime(f"{date} {hms}{offset}", "%Y-%m-%d %H:%M:%S%z")
+    return ts.timestamp() + (float(f"0.{fraction}") if fraction else 0)
+
+
+def _get_event_object_id(topic, event):
+    """
+    Return the ID of the container that an event is about. In the CRI plugin,
+    the sandbox's (pause) container has the sandbox's ID, and each container's
+    rootfs snapshot has the container's ID as key
+    """
+    if topic.startswith("/tasks/"):
+        return event.get("container_id")
+
+    if topic.startswith("/containers/"):
+        return event.get("id")
+
+    # Snapshot keys for image layers are not container IDs
+    key = event.get("key", "").rsplit("/", 1)[-1]
+    return key if _ID_RE.fullmatch(key) else None
+
+
+def parse_containerd_event(line):
+    """
+    Parse one line of `ctr events`' output into an event record, or return
+    None if the line is not an event that we are interested in
+    """
+    parts = line.strip().split(" ", 6)
+    if len(parts) < 6:
+        return None
+
+    date, time_of_day, offset, _, namespace, topic = parts[:6]
+    if namespace != CONTAINERD_EVENTS_NAMESPACE:
+        return None
+    if not any(topic.startswith(prefix) for prefix in CONTAINERD_EVENT_TOPICS):
+        return None
+
+    try:
+        ts = _parse_go_timestamp(date, time_of_day, offset)
+        event = json_loads(parts[6]) if len(parts) == 7 and parts[6] else {}
+    except (ValueError, JSONDecodeError):
+        return None
+
+    return {
+        "ts": ts,
+        "topic": topic,
+        "id": _get_event_object_id(topic, event),
+        "event": event,
+    }
+
+
+def get_cri_container_info(container_id):
+    """
+    Return the kind (sandbox or container), sandbox ID, and pod for a
+    container in the CRI namespace, or None if we can not find it
+    """
+    result = run_cmd(
+        f"sudo ctr -n {CONTAINERD_EVENTS_NAMESPACE} containers info {container_id}",
+        check=False,
+    )
+    if result.returncode != 0:
+        return None
+
+    try:
+        info = json_loads(result.stdout)
+    except JSONDecodeError:
+        return None
+
+    labels = info.get("Labels") or {}
+    kind = labels.get(CRI_KIND_LABEL, "")
+    if kind == "sandbox":
+        sandbox_id = container_id
+    else:
+        annotations = (info.get("Spec") or {}).get("annotations") or {}
+        sandbox_id = annotations.get(CRI_SANDBOX_ID_ANNOTATION, "")
+
+    return {
+        "kind": kind,
+        "sandbox_id": sandbox_id,
+        "pod": "{}/{}".format(
+            labels.get(CRI_POD_NAMESPACE_LABEL, ""),
+            labels.get(CRI_POD_NAME_LABEL, ""),
+        ),
+    }
+
+
+class ContainerdEventSubscriber:
+    """
+    Record the lifecycle events of all sandboxes and containers in the CRI
+    namespace. Use as a context manager (or call `start` and `stop`), and get
+    the recorded events with `get_records`
+    """
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.proc = None
+        self.reader = None
+        self.records = []
+        self.containers = {}
+        self.lock = Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.proc = Popen(
+            [
+                "sudo",
+                "ctr",
+                "events",
+                f"namespace=={CONTAINERD_EVENTS_NAMESPACE}",
+            ],
+            stdin=DEVNULL,
+            stdout=PIPE,
+            stderr=DEVNULL,
+            text=True,
+        )
+        self.reader = Thread(target=self._read_events, daemon=True)
+        self.reader.start()
+
+    def _read_events(self):
+        for line in self.proc.stdout:
+            record = parse_containerd_event(line)
+            if record is None:
+                continue
+
+            # Containers only exist between their create and delete events, so
+            # we look them up as soon as they are created
+            if record["topic"] == "/containers/create":
+                info = get_cri_container_info(record["id"])
+                if info is not None:
+                    with self.lock:
+                        self.containers[record["id"]] = info
+
+            if self.debug:
+                print(f"{record['ts']:.6f} {record['topic']} {record['id']}")
+
+            with self.lock:
+                self.records.append(record)
+
+    def stop(self):
+        if self.proc is None:
+            return
+
+        # `ctr` runs as root, so we can not signal it directly. Sudo relays
+        # the signal to it
+        run_cmd(f"sudo kill {self.proc.pid}", check=False)
+        self.proc.wait()
+        self.reader.join()
+        self.proc = None
+
+    def get_records(self):
+        """
+        Return all the events that we have recorded, in order, together with
+        the sandbox (and pod) that each of them belongs to
+        """
+        with self.lock:
+            records = [dict(record) for record in self.records]
+            containers = dict(self.containers)
+
+        for record in records:
+            info = containers.get(record["id"], {})
+            record["kind"] = info.get("kind", "")
+            record["sandbox_id"] = info.get("sandbox_id", "")
+            record["pod"] = info.get("pod", "")
+
+        return sorted(records, key=lambda record: record["ts"])
+
+
+def write_containerd_event_records(records, records_file):
+    """
+    Write event records to a file, one JSON object per line
+    """
+    with open(records_file, "w") as fh:
+        for record in records:
+            fh.write(json_dumps(record) + "\n")
+
+
+def group_events_by_sandbox(records):
+    """
+    Group event records by sandbox, and return a dictionary of sandbox ID to
+    the pod it belongs to, and its events in order. Events that we could not
+    attribute to any sandbox (e.g. image layer snapshots) are not included
+    """
+    sandboxes = {}
+    for record in records:
+        if not record["sandbox_id"]:
+            continue
+
+        sandbox = sandboxes.setdefault(
+            record["sandbox_id"], {"pod": record["pod"], "events": []}
+        )
+        sandbox["events"].append(record)
+
+    return sandboxes
@@ -1,6 +1,7 @@
-from os.path import exists, join
+from os.path import join
 from subprocess import run
 from tasks.util.env import K8S_CONFIG_DIR
+from tasks.util.host import exists
 
 COSIGN_BINARY = "cosign"
 
@@ -0,0 +1,229 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hashlib import sha256
+from io import StringIO
+from json import dumps as json_dumps
+from os.path import exists
+from tasks.util.tracing import SPAN_DAG_STEP, span
+from threading import local
+from time import time
+import sys
+
+# Default number of steps that we run at the same time
+DAG_MAX_WORKERS = 4
+
+
+class _ThreadBufferedStdout:
+    """
+    Wrapper around stdout that buffers all the writes from a thread that has
+    registered a buffer, and forwards the rest to the wrapped stream. We use
+    it to prevent the `print_dotted_line` output of concurrent steps from
+    interleaving
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = local()
+
+    def start_buffering(self):
+        self._local.buffer = StringIO()
+
+    def stop_buffering(self):
+        buf = getattr(self._local, "buffer", None)
+        self._local.buffer = None
+        return buf.getvalue() if buf is not None else ""
+
+    def write(self, data):
+        buf = getattr(self._local, "buffer", None)
+        if buf is None:
+            return self._stream.write(data)
+
+        return buf.write(data)
+
+    def flush(self):
+        if getattr(self._local, "buffer", None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def hash_file(file_path):
+    """
+    Return the SHA256 digest of a file's contents, or an empty string if the
+    file does not exist (so that it can be used as a step input)
+    """
+    if not exists(file_path):
+        return ""
+
+    with open(file_path, "rb") as fh:
+        return sha256(fh.read()).hexdigest()
+
+
+def get_step_hash(step, dep_hashes):
+    """
+    Get the hash of a step's inputs. We also include the hashes of all the
+    step's dependencies, so that changing the inputs to one step also
+    invalidates all the steps that depend on it
+    """
+    inputs = step["inputs"]() if "inputs" in step else {}
+    hash_input = {
+        "name": step["name"],
+        "inputs": inputs,
+        "deps": {dep: dep_hashes[dep] for dep in sorted(step.get("deps", []))},
+    }
+    return sha256(
+        json_dumps(hash_input, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def validate_dag(steps):
+    """
+    Check that step names are unique, that all dependencies exist, and that
+    there are no cycles. Return the step names in a valid execution order
+    """
+    names = [step["name"] for step in steps]
+    if len(set(names)) != len(names):
+        print(f"ERROR: duplicate step names in DAG: {names}")
+        raise RuntimeError("Duplicate step names in DAG!")
+
+    for step in steps:
+        for dep in step.get("deps", []):
+            if dep not in names:
+                print(f"ERROR: step {step['name']} depends on unknown step {dep}")
+                raise RuntimeError("Unknown dependency in DAG!")
+
+    # Kahn's algorithm, preserving the order in which steps are declared
+    pending = {step["name"]: set(step.get("deps", [])) for step in steps}
+    order = []
+    while pending:
+        ready = [name for name in names if name in pending and not pending[name]]
+        if not ready:
+            print(f"ERROR: cycle detected between steps: {list(pending.keys())}")
+            raise RuntimeError("Cycle in DAG!")
+
+        for name in ready:
+            del pending[name]
+            order.append(name)
+        for deps in pending.values():
+            deps.difference_update(ready)
+
+    return order
+
+
+def run_dag(
+    steps,
+    max_workers=DAG_MAX_WORKERS,
+    debug=False,
+    completed_hashes=None,
+    on_step_start=None,
+    on_step_done=None,
+):
+    """
+    Run a list of steps, respecting the dependencies between them, using a
+    bounded pool of worker threads
+
+    Each step is a dictionary with the following keys:
+    - name: unique name for the step
+    - func: callable (with no arguments) that executes the step
+    - deps: list of step names that must finish before this step starts
+    - inputs: (optional) callable returning a JSON-serialisable dictionary
+              with everything that determines the outcome of the step (e.g.
+              versions, config files, or image digests)
+    - resumable: (optional) set to False for steps that can not run on top of
+                 a previous run of themselves (defaults to True)
+
+    Before running a step we hash its inputs (see `get_step_hash`). If the
+    hash matches the one in `completed_hashes`, we skip the step. If it does
+    not, and the step is not resumable, we fail. We call `on_step_start(name)`
+    before scheduling a step, and `on_step_done(name, step_hash, step_time)`
+    after it finishes, both from the main thread, so that callers can
+    checkpoint their progress.
+
+    The output of each step is buffered, and printed once the step finishes,
+    so that the output of steps running at the same time does not interleave.
+    If a step fails, we do not schedule any more steps, wait for the running
+    ones to finish, and re-raise the first error.
+    """
+    validate_dag(steps)
+    steps_by_name = {step["name"]: step for step in steps}
+    pending = {step["name"]: set(step.get("deps", [])) for step in steps}
+    completed_hashes = completed_hashes or {}
+    step_hashes = {}
+
+    buffered_stdout = _ThreadBufferedStdout(sys.stdout)
+
+    def do_run_step(step):
+        buffered_stdout.start_buffering()
+        start_ts = time()
+        step_hash = None
+        error = None
+        try:
+            with span(step["name"], cat=SPAN_DAG_STEP):
+                step_hash = get_step_hash(step, step_hashes)
+                if completed_hashes.get(step["name"]) == step_hash:
+                    print(f"Skipping step: {step['name']} (inputs unchanged)")
+                elif step["name"] in completed_hashes and not step.get(
+                    "resumable", True
+                ):
+                    print(f"ERROR: inputs to step {step['name']} have changed")
+                    print("ERROR: step can not run on top of a previous run")
+                    raise RuntimeError("Can not re-run step!")
+                else:
+                    step["func"]()
+        except Exception as e:
+            error = e
+        output = buffered_stdout.stop_buffering()
+
+        return output, step_hash, time() - start_ts, error
+
+    step_times = {}
+    first_error = None
+    prev_stdout = sys.stdout
+    sys.stdout = buffered_stdout
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            running = {}
+            while pending or running:
+                if first_error is None:
+                    ready = [name for name, deps in pending.items() if not deps]
+                    for name in ready:
+                        del pending[name]
+                        if debug:
+                            print(f"Starting step: {name}")
+                        if on_step_start is not None:
+                            on_step_start(name)
+                        future = pool.submit(do_run_step, steps_by_name[name])
+                        running[future] = name
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    output, step_hash, step_time, error = future.result()
+                    print(output, end="", flush=True)
+                    if error is not None:
+                        print(f"\nERROR: step {name} failed: {error}")
+                        if first_error is None:
+                            first_error = error
+                        continue
+
+                    step_times[name] = step_time
+                    step_hashes[name] = step_hash
+                    if on_step_done is not None:
+                        on_step_done(name, step_hash, step_time)
+                    if debug:
+                        print(f"Finished step: {name} ({step_time:.2f} s)")
+
+                    for deps in pending.values():
+                        deps.discard(name)
+    finally:
+        sys.stdout = prev_stdout
+
+    if first_error is not None:
+        if pending:
+            print(f"WARNING: skipped steps: {list(pending.keys())}")
+        raise first_error
+
+    return step_times
@@ -1,6 +1,16 @@
-from os.path import dirname, exists, join
-from subprocess import run
-from tasks.util.env import GHCR_URL, GITHUB_ORG, PROJ_ROOT, print_dotted_line
+from os import makedirs
+from os.path import dirname, join
+from tasks.util.aio import run_all, run_cmd_async
+from tasks.util.cmd import run_cmd
+from tasks.util.env import (
+    GHCR_URL,
+    GITHUB_ORG,
+    PROJ_ROOT,
+    print_dotted_line,
+    print_success,
+)
+from tasks.util.host import exists
+from tasks.util.sudo import sudo_makedirs
 from tasks.util.versions import (
     CONTAINERD_VERSION,
     KATA_VERSION,
@@ -8,6 +18,7 @@ from tasks.util.versions import (
     NYDUS_VERSION,
     OVMF_VERSION,
 )
+from uuid import uuid4
 
 # Base software image (note that we tag with a CoCo release version, but we
 # allow it to fall behind as we should not re-build the base image often)
@@ -47,51 +58,38 @@ def build_image(
     docker_cmd = "docker build {} {} -t {} -f {} .".format(
         "--no-cache" if nocache else "", build_args_cmd, image_tag, dockerfile
     )
-    result = run(docker_cmd, shell=True, capture_output=True, cwd=cwd)
-    assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-    if debug:
-        print(result.stdout.decode("utf-8").strip())
+    run_cmd(docker_cmd, cwd=cwd, resource="docker-build", debug=debug)
 
     if push:
-        result = run(f"docker push {image_tag}", shell=True, capture_output=True)
-        assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-        if debug:
-            print(result.stdout.decode("utf-8").strip())
+        run_cmd(f"docker push {image_tag}", resource="docker-push", debug=debug)
 
 
 def copy_from_ctr_image(ctr_image, ctr_paths, host_paths, requires_sudo=False):
     """
     Copy from a container image without actually running the container
     """
-    tmp_ctr_name = "tmp-build-ctr"
-    result = run(
-        f"docker create --name {tmp_ctr_name} {ctr_image}",
-        shell=True,
-        capture_output=True,
-    )
-    assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
+    # Use a unique container name, as we may copy from different images at
+    # the same time
+    tmp_ctr_name = f"tmp-build-ctr-{uuid4().hex[:8]}"
+    run_cmd(f"docker create --name {tmp_ctr_name} {ctr_image}")
 
     def cleanup():
-        result = run(f"docker rm -f {tmp_ctr_name}", shell=True, capture_output=True)
-        assert result.returncode == 0
+        run_cmd(f"docker rm -f {tmp_ctr_name}")
 
     for ctr_path, host_path in zip(ctr_paths, host_paths):
         host_dir = dirname(host_path)
         if not exists(host_dir):
-            mkdir = "sudo mkdir" if requires_sudo else "mkdir"
-            result = run(f"{mkdir} -p {host_dir}", shell=True, capture_output=True)
-            assert result.returncode == 0
-
-        try:
-            prefix = "sudo " if requires_sudo else ""
-            result = run(
-                f"{prefix}docker cp {tmp_ctr_name}:{ctr_path} {host_path}",
-                shell=True,
-                capture_output=True,
-            )
-            assert result.returncode == 0
-        except AssertionError:
-            stderr = result.stderr.decode("utf-8").strip()
+            if requires_sudo:
+                sudo_makedirs(host_dir)
+            else:
+                makedirs(host_dir, exist_ok=True)
+
+        prefix = "sudo " if requires_sudo else ""
+        result = run_cmd(
+            f"{prefix}docker cp {tmp_ctr_name}:{ctr_path} {host_path}", check=False
+        )
+        if result.returncode != 0:
+            stderr = result.stderr.strip()
             print(f"Error copying {ctr_image}:{ctr_path} to {host_path}: {stderr}")
             cleanup()
             raise RuntimeError("Error copying from container!")
@@ -105,14 +103,29 @@ def is_ctr_running(ctr_name):
     """
     docker_cmd = ["docker container inspect", "-f '{{.State.Running}}'", ctr_name]
     docker_cmd = " ".join(docker_cmd)
-    out = run(docker_cmd, shell=True, capture_output=True)
-    if out.returncode == 0:
-        value = out.stdout.decode("utf-8").strip()
-        return value == "true"
+    result = run_cmd(docker_cmd, check=False)
+    if result.returncode == 0:
+        return result.stdout.strip() == "true"
 
     return False
 
 
+def get_image_digest(image_tag):
+    """
+    Get the digest of a local container image, or an empty string if the
+    image is not present locally
+    """
+    result = run_cmd(f"docker image inspect -f '{{{{.Id}}}}' {image_tag}", check=False)
+    if result.returncode != 0:
+        return ""
+
+    return result.stdout.strip()
+
+
+async def pull_image_async(image_tag, debug=False):
+    await run_cmd_async(f"docker pull {image_tag}", resource="docker-pull", debug=debug)
+
+
 def pull_artifact_images(debug=False):
     print_dotted_line("Pulling artifact container images")
     components = ["containerd", "kata-containers", "nydus", "nydus-snapshotter", "ovmf"]
@@ -123,11 +136,11 @@ def pull_artifact_images(debug=False):
         NYDUS_SNAPSHOTTER_VERSION,
         OVMF_VERSION,
     ]
-    for component, version in zip(components, versions):
-        docker_cmd = f"docker pull {GHCR_URL}/{GITHUB_ORG}/{component}:{version}"
-        result = run(docker_cmd, shell=True, capture_output=True)
-        assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-        if debug:
-            print(result.stdout.decode("utf-8").strip())
-
-    print("Success!")
+    run_all(
+        *[
+            pull_image_async(f"{GHCR_URL}/{GITHUB_ORG}/{component}:{version}", debug)
+            for component, version in zip(components, versions)
+        ]
+    )
+
+    print_success()
@@ -1,5 +1,7 @@
 from os.path import dirname, expanduser, realpath, join
-from subprocess import run
+from tasks.util.cmd import run_cmd
+from tasks.util.probe import cached_probe
+from tasks.util.tracing import end_step, start_step
 from tasks.util.versions import PAUSE_IMAGE_VERSION
 
 PROJ_ROOT = dirname(dirname(dirname(realpath(__file__))))
@@ -65,13 +67,31 @@ KBS_PORT = 44444
 # VM Cache config
 
 VM_CACHE_SIZE = 10
+# The Kata VM factory's gRPC server listens on this socket once it has started
+# the VM cache
+VM_CACHE_SOCKET = "/run/kata-containers/cache.sock"
+VM_CACHE_START_TIMEOUT_SECS = 60
+
+# APT config
+
+# Some deployment steps run at the same time, so we make `apt` wait for the
+# dpkg lock instead of failing straight away
+APT_LOCK_TIMEOUT_SECS = 600
 
 
 def print_dotted_line(message, dot_length=90):
+    start_step(message)
     dots = "." * (dot_length - len(message))
     print(f"{message}{dots}", end="", flush=True)
 
 
+def print_success():
+    print("Success!")
+    end_step()
+
+
+# The node's IP only changes if the host's network configuration changes
+@cached_probe(ttl_secs=600, persist=True)
 def get_node_url():
     """
     Get the external node IP that can be reached from both host and guest
@@ -84,12 +104,7 @@ def get_node_url():
     reached both from the host and the guest
     """
     ip_cmd = "ip -o route get to 8.8.8.8"
-    ip_cmd_out = (
-        run(ip_cmd, shell=True, capture_output=True)
-        .stdout.decode("utf-8")
-        .strip()
-        .split(" ")
-    )
+    ip_cmd_out = run_cmd(ip_cmd, check=False).stdout.strip().split(" ")
     idx = ip_cmd_out.index("src") + 1
     kbs_url = ip_cmd_out[idx]
     return kbs_url
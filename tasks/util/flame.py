@@ -1,6 +1,8 @@
 from os.path import join
 from subprocess import run
 from tasks.util.env import PROJ_ROOT
+from tasks.util.host import getgid, getuid
+from tasks.util.sudo import sudo_copy_file
 
 FLAME_GRAPH_ROOT = join(PROJ_ROOT, "..", "FlameGraph")
 
@@ -12,12 +14,15 @@ def generate_flame_graph(pid, time_in_secs, flame_path):
     )
     run(cmd, shell=True, check=True)
 
+    # Get a user-owned copy of the (root-owned) perf data, so that all the
+    # files that we generate from it are user-owned too
+    user_perf_data_file = "/tmp/perf.user.data"
+    sudo_copy_file(perf_data_file, user_perf_data_file, uid=getuid(), gid=getgid())
+
     perf_out_file = "/tmp/perf.out"
-    cmd = "sudo perf script -i {} > {}".format(perf_data_file, perf_out_file)
+    cmd = "sudo perf script -i {} > {}".format(user_perf_data_file, perf_out_file)
     run(cmd, shell=True, check=True)
 
-    run("sudo chown csegarra:csegarra {}".format(perf_out_file), shell=True, check=True)
-
     perf_folded_file = "/tmp/out.folded"
     cmd = "{}/stackcollapse-perf.pl {} > {}".format(
         FLAME_GRAPH_ROOT,
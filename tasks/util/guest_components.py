@@ -1,5 +1,5 @@
 from os.path import join
-from subprocess import run
+from tasks.util.cmd import run_cmd
 from tasks.util.env import COMPONENTS_DIR
 from time import sleep
 
@@ -28,7 +28,7 @@ def start_coco_keyprovider(host_key_path, guest_key_path):
         "coco_keyprovider -- --socket 127.0.0.1:{}'".format(COCO_KEYPROVIDER_CTR_PORT),
     ]
     docker_cmd = " ".join(docker_cmd)
-    run(docker_cmd, shell=True, check=True)
+    run_cmd(docker_cmd, debug=True)
 
     # Wait for the gRPC server to be ready
     poll_period = 2
@@ -36,7 +36,7 @@ def start_coco_keyprovider(host_key_path, guest_key_path):
     while True:
         sleep(poll_period)
         logs_cmd = "docker logs {}".format(COCO_KEYPROVIDER_CTR_NAME)
-        ctr_logs = run(logs_cmd, shell=True, capture_output=True).stderr.decode("utf-8")
+        ctr_logs = run_cmd(logs_cmd, check=False).stderr
         if string_to_check in ctr_logs:
             print("gRPC server ready!")
             break
@@ -49,4 +49,4 @@ def stop_coco_keyprovider():
     Stop the CoCo key-provider
     """
     docker_cmd = "docker rm -f {}".format(COCO_KEYPROVIDER_CTR_NAME)
-    run(docker_cmd, shell=True, check=True)
+    run_cmd(docker_cmd, debug=True)
@@ -0,0 +1,96 @@
+from glob import glob as glob_glob
+from os import (
+    getegid as os_getegid,
+    geteuid as os_geteuid,
+    getgid as os_getgid,
+    getuid as os_getuid,
+    stat as os_stat,
+    stat_result,
+    uname,
+)
+from os.path import exists as os_exists
+from tasks.util.replay import replay_host_fact
+
+# Facts about the host that tasks read directly, without running a command.
+# Tasks must read them through these methods (instead of the ones in `os`) so
+# that, when recording commands (see tasks/util/replay.py), we also record the
+# host facts that the commands depend on, and replay them on a different host.
+#
+# We only need to do so for paths that commands or privileged file operations
+# create or modify (e.g. /etc/containerd/config.toml, or a build directory
+# that we populate with `docker cp`), not for files in this repo, or scratch
+# directories that we only manage in-process
+_STAT_TIME_FIELDS = [
+    "st_atime",
+    "st_mtime",
+    "st_ctime",
+    "st_atime_ns",
+    "st_mtime_ns",
+    "st_ctime_ns",
+]
+
+
+@replay_host_fact
+def exists(path):
+    return os_exists(path)
+
+
+@replay_host_fact
+def glob(pattern):
+    """
+    Same as `glob.glob`, but sorted
+    """
+    return sorted(glob_glob(pattern))
+
+
+@replay_host_fact
+def _stat(path):
+    stat_info = os_stat(path)
+    return list(stat_info), {
+        field: getattr(stat_info, field) for field in _STAT_TIME_FIELDS
+    }
+
+
+def stat(path):
+    """
+    Same as `os.stat`. We record the fields in the result, and re-build it
+    """
+    fields, time_fields = _stat(path)
+    return stat_result(fields, time_fields)
+
+
+@replay_host_fact
+def read_file(path):
+    """
+    Read a (user-readable) text file that a command has written
+    """
+    with open(path, "r") as fh:
+        return fh.read()
+
+
+@replay_host_fact
+def get_kernel_release():
+    """
+    Get the running kernel's release (i.e. `uname -r`)
+    """
+    return uname().release
+
+
+@replay_host_fact
+def getuid():
+    return os_getuid()
+
+
+@replay_host_fact
+def getgid():
+    return os_getgid()
+
+
+@replay_host_fact
+def geteuid():
+    return os_geteuid()
+
+
+@replay_host_fact
+def getegid():
+    return os_getegid()
@@ -0,0 +1,166 @@
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from os import close, fsencode, read, strerror
+from os.path import abspath, basename, dirname
+from select import select
+from struct import calcsize, unpack_from
+from tasks.util.replay import MODE_REPLAY, get_replay_mode
+from time import time
+
+# Wait for changes to files with inotify(7), instead of polling them. We bind
+# to libc directly, so that we do not need any extra dependencies. If inotify
+# is not available (e.g. non-Linux hosts, or we run out of watches) we fall
+# back to polling every FALLBACK_POLL_PERIOD_SECS. When replaying a recording
+# (see tasks/util/replay.py) the files do not change, but the recorded reads
+# do, so we do not wait at all.
+#
+# We watch the parent directory, and not the file itself, as many tools (and
+# our own TOML helpers) update files by writing a temporary file and renaming
+# it over the original one, which would silently drop a watch on the file
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+IN_Q_OVERFLOW = 0x00004000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+WATCH_MASK |= IN_DELETE
+
+FALLBACK_POLL_PERIOD_SECS = 2
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_EVENT_HEADER_FMT = "iIII"
+_EVENT_HEADER_SIZE = calcsize(_EVENT_HEADER_FMT)
+_READ_BUFFER_SIZE = 64 * 1024
+
+_LIBC = {}
+
+
+def _get_libc():
+    if "libc" not in _LIBC:
+        try:
+            libc = CDLL(find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1
+            libc.inotify_add_watch
+        except (OSError, AttributeError):
+            libc = None
+        _LIBC["libc"] = libc
+
+    return _LIBC["libc"]
+
+
+class FileWatcher:
+    """
+    Watch a set of files for changes. Use as a context manager, and call
+    `wait` to block until one of the files changes (or a timeout expires)
+    """
+
+    def __init__(self, file_paths):
+        self.file_paths = [abspath(file_path) for file_path in file_paths]
+        self.fd = None
+        self.watched_names = {}
+
+    def __enter__(self):
+        libc = _get_libc()
+        if libc is None or get_replay_mode() == MODE_REPLAY:
+            return self
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return self
+
+        for watch_dir in set([dirname(f) for f in self.file_paths]):
+            wd = libc.inotify_add_watch(fd, fsencode(watch_dir), WATCH_MASK)
+            if wd < 0:
+                print(
+                    f"WARNING: can not watch {watch_dir} "
+                    f"({strerror(get_errno())}), falling back to polling"
+                )
+                close(fd)
+                return self
+
+            self.watched_names[wd] = set(
+                [basename(f) for f in self.file_paths if dirname(f) == watch_dir]
+            )
+
+        self.fd = fd
+        return self
+
+    def __exit__(self, *args):
+        if self.fd is not None:
+            close(self.fd)
+            self.fd = None
+
+    def _read_events(self):
+        """
+        Drain all pending events, and return whether any of them concerns one
+        of the watched files
+        """
+        changed = False
+        while True:
+            try:
+                buf = read(self.fd, _READ_BUFFER_SIZE)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, name_len = unpack_from(_EVENT_HEADER_FMT, buf, offset)
+                offset += _EVENT_HEADER_SIZE
+                name = buf[offset : offset + name_len].rstrip(b"\0").decode("utf-8")
+                offset += name_len
+
+                if mask & IN_Q_OVERFLOW or name in self.watched_names.get(wd, []):
+                    changed = True
+
+    def wait(self, timeout=None):
+        """
+        Block until one of the watched files changes, and return True, or
+        return False if the timeout (in seconds) expires first. If we can not
+        use inotify, we sleep for the polling period and return True
+        """
+        if get_replay_mode() == MODE_REPLAY:
+            return True
+
+        if self.fd is None:
+            poll_period = FALLBACK_POLL_PERIOD_SECS
+            if timeout is not None:
+                poll_period = min(poll_period, timeout)
+            select([], [], [], poll_period)
+            return True
+
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time())
+            ready, _, _ = select([self.fd], [], [], remaining)
+            if len(ready) == 0:
+                return False
+
+            if self._read_events():
+                return True
+
+
+def wait_for_files(file_paths, predicate, timeout=None, debug=False):
+    """
+    Block until `predicate()` returns True, re-evaluating it every time one of
+    the files in `file_paths` changes. Raise an error if `timeout` seconds
+    pass before the predicate holds
+    """
+    deadline = None if timeout is None else time() + timeout
+    # Start watching before we evaluate the predicate for the first time, so
+    # that we do not miss changes in between
+    with FileWatcher(file_paths) as watcher:
+        while not predicate():
+            remaining = None if deadline is None else deadline - time()
+            if remaining is not None and remaining <= 0:
+                print(f"ERROR: timed-out waiting for changes to: {file_paths}")
+                raise RuntimeError("Timed-out waiting for files!")
+
+            if debug:
+                print(f"Waiting for changes to: {', '.join(file_paths)}")
+
+            watcher.wait(remaining)
@@ -0,0 +1,283 @@
+from grp import getgrnam
+from json import JSONDecodeError, loads as json_loads
+from os import geteuid, getgroups
+from re import compile as regex_compile
+from tasks.util.cmd import run_cmd
+from time import time
+
+# In-memory index of a systemd unit's journal entries. Reading the journal
+# (with `journalctl -o json`) and parsing it is slow, so we parse each entry
+# once, and index it by the words in its message (e.g. event names like
+# RunPodSandbox) and by the (sandbox, container, or image) IDs it mentions.
+# Looking up the timestamps of many events then needs one read of the journal.
+#
+# Lookups match event names and IDs anywhere in the message (not only whole
+# words), we only use the indexes to narrow down the entries that we scan, so
+# they return the same entries as scanning all of them.
+#
+# After the first read, we remember the cursor of the last entry we have read,
+# and only read the entries after it, so the cost of refreshing the index
+# depends on the number of new entries, not on the size of the journal. We
+# use the native journal API if python-systemd is installed, and we can read
+# the system journal, and `journalctl` otherwise
+JOURNAL_READER_GROUPS = ["systemd-journal", "adm", "wheel"]
+# We drop all entries, and re-read the journal, if the index grows beyond this
+JOURNAL_INDEX_MAX_ENTRIES = 500000
+_WORD_RE = regex_compile(r"\w+")
+_HEX_RE = regex_compile(r"[0-9a-f]+")
+_ID_RE = regex_compile(r"[0-9a-f]{64}")
+# IDs may be glued to other characters (e.g. shim_<id>_1), or to other hex
+# characters, so we index every ID-sized window of each run of hex characters
+_HEX_RUN_RE = regex_compile(r"[0-9a-f]{64,}")
+
+
+def _can_read_system_journal():
+    """
+    Whether we can read the system journal without sudo (otherwise, the
+    journal API silently skips the files that we can not read)
+    """
+    if geteuid() == 0:
+        return True
+
+    for group in JOURNAL_READER_GROUPS:
+        try:
+            if getgrnam(group).gr_gid in getgroups():
+                return True
+        except KeyError:
+            continue
+
+    return False
+
+
+def _read_native_journal_entries(unit, since_mins=None, after_cursor=None):
+    """
+    Read journal entries with the native journal API (python-systemd), and
+    return them in the same format as `journalctl -o json`, together with the
+    last entry's cursor, or None if we can not use the API
+    """
+    if not _can_read_system_journal():
+        return None
+
+    # python-systemd is an optional dependency, we import it when needed
+    try:
+        from systemd import journal
+    except ImportError:
+        return None
+
+    entries = []
+    cursor = after_cursor
+    with journal.Reader() as reader:
+        reader.add_match(_SYSTEMD_UNIT=f"{unit}.service")
+        if after_cursor is not None:
+            reader.seek_cursor(after_cursor)
+        else:
+            reader.seek_realtime(time() - since_mins * 60)
+
+        for raw_entry in reader:
+            # Seeking to a cursor places us at that entry, which we have read
+            if raw_entry["__CURSOR"] == after_cursor:
+                continue
+
+            cursor = raw_entry["__CURSOR"]
+            if not isinstance(raw_entry.get("MESSAGE"), str):
+                continue
+
+            entry = {k: v for k, v in raw_entry.items() if isinstance(v, str)}
+            entry["__REALTIME_TIMESTAMP"] = str(
+                int(raw_entry["__REALTIME_TIMESTAMP"].timestamp() * 1e6)
+            )
+            entries.append(entry)
+
+    return entries, cursor
+
+
+def read_journal_entries(unit, since_mins=None, after_cursor=None):
+    """
+    Read the JSON-formatted journal entries for a systemd unit, for the last
+    `since_mins` minutes, or only the ones after a cursor. Returns the entries
+    and the cursor of the last entry that we read, or None if we fail to read
+    after the cursor (e.g. if the journal has been rotated or flushed)
+
+    We dump them to a temporary file to prevent the Popen output from being
+    clipped (or at least remove the chance of it being so)
+    """
+    native_result = _read_native_journal_entries(
+        unit, since_mins=since_mins, after_cursor=after_cursor
+    )
+    if native_result is not None:
+        return native_result
+
+    tmp_file = f"/tmp/journalctl_{unit}.log"
+    journalctl_cmd = f"sudo journalctl -xeu {unit} --no-tail "
+    if after_cursor is not None:
+        journalctl_cmd += f'--after-cursor "{after_cursor}" '
+    else:
+        journalctl_cmd += f'--since "{since_mins} min ago" '
+    journalctl_cmd += f"-o json > {tmp_file}"
+    result = run_cmd(journalctl_cmd, check=after_cursor is None)
+    if result.returncode != 0:
+        return None
+
+    entries = []
+    cursor = after_cursor
+    with open(tmp_file, "r") as fh:
+        for line in fh:
+            try:
+                entry = json_loads(line)
+            except JSONDecodeError:
+                continue
+
+            if entry is None:
+                continue
+            cursor = entry.get("__CURSOR", cursor)
+
+            # Sometimes, after resetting containerd, some of the journal
+            # entries won't have a "MESSAGE" in it, so we skip them. The
+            # message may also be an array of bytes if it is not valid UTF-8
+            if not isinstance(entry.get("MESSAGE"), str):
+                continue
+
+            entries.append(entry)
+
+    return entries, cursor
+
+
+class JournalIndex:
+    """
+    Index of the journal entries for a systemd unit, by word and ID
+    """
+
+    def __init__(self, unit):
+        self.unit = unit
+        self.since_ts = None
+        self.refresh_ts = None
+        self.cursor = None
+        self._reset()
+
+    def _reset(self):
+        self.entries = []
+        self.by_word = {}
+        self.by_id = {}
+        self._word_matches = {}
+
+    def refresh(self, since_mins):
+        """
+        Read the journal entries after the last one we have read. We (re-)read
+        all the entries for the last `since_mins` minutes if we have not read
+        the journal yet, if our index does not go back that far, or if it has
+        grown too large
+        """
+        refresh_ts = time()
+        since_ts = refresh_ts - since_mins * 60
+
+        result = None
+        if (
+            self.cursor is not None
+            and self.since_ts <= since_ts
+            and len(self.entries) < JOURNAL_INDEX_MAX_ENTRIES
+        ):
+            result = read_journal_entries(self.unit, after_cursor=self.cursor)
+
+        if result is None:
+            result = read_journal_entries(self.unit, since_mins=since_mins)
+            self._reset()
+            self.since_ts = since_ts
+
+        entries, self.cursor = result
+        for entry in entries:
+            self._add_entry(entry)
+        self.refresh_ts = refresh_ts
+
+    def _add_entry(self, entry):
+        idx = len(self.entries)
+        message = entry["MESSAGE"]
+        self.entries.append((int(entry["__REALTIME_TIMESTAMP"]) / 1e6, message, entry))
+
+        # Index each entry once per word or ID, even if it appears many times.
+        # We index IDs separately, and skip hex words (e.g. IDs and numbers),
+        # so as not to blow up the number of words
+        for word in set(_WORD_RE.findall(message)):
+            if _HEX_RE.fullmatch(word) is None:
+                self.by_word.setdefault(word, []).append(idx)
+        event_ids = set()
+        for hex_run in _HEX_RUN_RE.findall(message):
+            for start in range(len(hex_run) - 63):
+                event_ids.add(hex_run[start : start + 64])
+        for event_id in event_ids:
+            self.by_id.setdefault(event_id, []).append(idx)
+
+        self._word_matches = {}
+
+    def _get_word_matches(self, query):
+        """
+        Return the positions of the entries whose message contains `query`,
+        a (non-hex) word. Such a query can only appear inside one of the words
+        in the message, so we only need to check the words we have indexed
+        """
+        if query not in self._word_matches:
+            positions = set()
+            for word, word_positions in self.by_word.items():
+                if query in word:
+                    positions.update(word_positions)
+            self._word_matches[query] = sorted(positions)
+
+        return self._word_matches[query]
+
+    def _get_candidates(self, queries):
+        """
+        Return the (sorted) positions of the entries that may contain all the
+        queries, using the smallest index match
+
+        Each run of word characters in a query (e.g. each word in a query with
+        spaces) must appear inside one of the words in a matching message, so
+        we look up the non-hex ones. We can only look up hex queries if they
+        are IDs
+        """
+        candidates = None
+        for query in queries:
+            if query is None:
+                continue
+
+            if _ID_RE.fullmatch(query):
+                candidate_lists = [self.by_id.get(query, [])]
+            else:
+                candidate_lists = [
+                    self._get_word_matches(word)
+                    for word in _WORD_RE.findall(query)
+                    if not _HEX_RE.fullmatch(word)
+                ]
+
+            for positions in candidate_lists:
+                if candidates is None or len(positions) < len(candidates):
+                    candidates = positions
+
+        return range(len(self.entries)) if candidates is None else candidates
+
+    def find(self, event_name, event_id, extra_event_id=None, since_ts=None):
+        """
+        Return the positions of the entries, in order, whose message contains
+        an event name and ID (and an extra ID, if given), optionally only
+        for entries after a timestamp
+        """
+        positions = []
+        for idx in self._get_candidates([event_name, event_id, extra_event_id]):
+            ts, message, _ = self.entries[idx]
+            if since_ts is not None and ts < since_ts:
+                continue
+
+            if event_name not in message or event_id not in message:
+                continue
+
+            if extra_event_id is None or extra_event_id in message:
+                positions.append(idx)
+
+        return positions
+
+    def get_entry(self, idx):
+        return self.entries[idx][2]
+
+    def get_message(self, idx):
+        return self.entries[idx][1]
+
+    def get_ts(self, idx):
+        return self.entries[idx][0]
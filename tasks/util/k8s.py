@@ -1,9 +1,18 @@
-from jinja2 import Environment, FileSystemLoader
 from os.path import basename, dirname
+from tasks.util.k8s_api import (
+    get_pods_path,
+    is_k8s_api_enabled,
+    k8s_api_apply,
+    k8s_api_get,
+)
 from tasks.util.kubeadm import run_kubectl_command
+from tasks.util.manifests import load_manifest_objects
+from time import time
 
 
 def template_k8s_file(template_file_path, output_file_path, template_vars):
+    from jinja2 import Environment, FileSystemLoader
+
     # Load and render the template using jinja
     env = Environment(
         loader=FileSystemLoader(dirname(template_file_path)),
@@ -20,12 +29,53 @@ def template_k8s_file(template_file_path, output_file_path, template_vars):
         fh.write(output_data)
 
 
-def get_container_id_from_pod(pod_name, container_name):
+def get_container_id_from_pod(pod_name, container_name, ns=None):
     """
     Get the container ID from a pod. The container name must be something in the
     style of 'user-container'
     """
-    kubectl_cmd = "kubectl get pod {} -o jsonpath='{{..status.contain".format(pod_name)
-    kubectl_cmd += 'erStatuses[?@(.name=="{}")].containerID}}'.format(container_name)
-    out = run_kubectl_command(kubectl_cmd, capture_output=True)
+    pod = k8s_api_get(f"{get_pods_path(ns)}/{pod_name}")
+    if pod is not None:
+        out = " ".join(
+            [
+                status.get("containerID", "")
+                for status in pod.get("status", {}).get("containerStatuses", [])
+                if status["name"] == container_name
+            ]
+        )
+    else:
+        kubectl_cmd = "-n {} get pod {} -o jsonpath='{{..status.contain".format(
+            ns or "default", pod_name
+        )
+        kubectl_cmd += 'erStatuses[?(@.name=="{}")].containerID}}\''.format(
+            container_name
+        )
+        out = run_kubectl_command(kubectl_cmd, capture_output=True)
+
     return out.removeprefix("containerd://")
+
+
+def apply_manifests(manifests, debug=False):
+    """
+    Apply a list of manifests (local files or URLs) in one go. We parse all
+    the objects in them, and server-side apply them (CRDs first) over one
+    connection to the API server, instead of running `kubectl apply` for each
+    manifest. If we can not, we fall back to `kubectl apply`
+    """
+    start_ts = time()
+    timings = None
+    if is_k8s_api_enabled():
+        objects = load_manifest_objects(manifests)
+        if objects is not None:
+            timings = k8s_api_apply(objects)
+
+    if timings is None:
+        for manifest in manifests:
+            run_kubectl_command(f"apply -f {manifest}", capture_output=not debug)
+        return
+
+    if debug:
+        for obj_desc, time_ms in timings:
+            print(f"{obj_desc} applied ({time_ms:.1f} ms)")
+        total_ms = (time() - start_ts) * 1000
+        print(f"Applied {len(timings)} objects in {total_ms:.1f} ms")
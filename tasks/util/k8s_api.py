@@ -0,0 +1,493 @@
+from base64 import b64decode
+from http.client import HTTPException, HTTPSConnection
+from json import dumps as json_dumps, loads as json_loads
+from math import ceil
+from os import environ, stat
+from os.path import join
+from ssl import PROTOCOL_TLS_CLIENT, SSLContext, SSLError
+from tasks.util.env import KUBEADM_KUBECONFIG_FILE
+from tasks.util.replay import get_replay_mode
+from tasks.util.tracing import SPAN_COMMAND, span
+from tempfile import TemporaryDirectory
+from threading import Lock, local
+from time import sleep, time
+from urllib.parse import urlencode, urlparse
+
+# Minimal client for the Kubernetes API server. Running `kubectl` for every
+# query means forking a process, starting the Go runtime, parsing the
+# kubeconfig, and doing a TLS handshake. Instead, we keep one keep-alive
+# HTTPS connection per thread, and send JSON requests over it.
+#
+# The client is best-effort: if we can not talk to the API server (e.g. the
+# cluster is not up yet, PyYAML is missing, or the request fails) we return
+# None and callers fall back to `kubectl`. We also fall back when recording or
+# replaying commands (see tasks/util/replay.py), so that recordings include
+# all k8s queries. Set SC2_K8S_API=off to always use `kubectl`
+K8S_API_ENV_VAR = "SC2_K8S_API"
+K8S_API_TIMEOUT_SECS = 30
+# Watches are long-lived requests, we ask the API server to end them after a
+# while, and re-start them (as recommended by the API docs)
+K8S_WATCH_TIMEOUT_SECS = 300
+
+_CONFIG = {"key": None, "config": None}
+_CONFIG_LOCK = Lock()
+_THREAD_STATE = local()
+
+
+def is_k8s_api_enabled():
+    return environ.get(K8S_API_ENV_VAR, "on") != "off" and get_replay_mode() is None
+
+
+def _b64_to_str(data):
+    return b64decode(data).decode("utf-8")
+
+
+def _load_kubeconfig(kubeconfig_file):
+    """
+    Parse a kubeconfig file, and return the API server's URL and an SSL
+    context to talk to it, and the extra headers (if any) for each request
+    """
+    from yaml import safe_load
+
+    with open(kubeconfig_file, "r") as fh:
+        kubeconfig = safe_load(fh)
+
+    context_name = kubeconfig["current-context"]
+    context = [
+        c["context"] for c in kubeconfig["contexts"] if c["name"] == context_name
+    ][0]
+    cluster = [
+        c["cluster"] for c in kubeconfig["clusters"] if c["name"] == context["cluster"]
+    ][0]
+    user = [u["user"] for u in kubeconfig["users"] if u["name"] == context["user"]][0]
+
+    ssl_context = SSLContext(PROTOCOL_TLS_CLIENT)
+    if "certificate-authority-data" in cluster:
+        ssl_context.load_verify_locations(
+            cadata=_b64_to_str(cluster["certificate-authority-data"])
+        )
+    else:
+        ssl_context.load_verify_locations(cafile=cluster["certificate-authority"])
+
+    headers = {"Accept": "application/json"}
+    if "client-certificate-data" in user:
+        # SSLContext can only load a client certificate from a file, so we
+        # write it to a private temporary directory, and remove it right away
+        with TemporaryDirectory() as tmp_dir:
+            cert_file = join(tmp_dir, "client.crt")
+            key_file = join(tmp_dir, "client.key")
+            with open(cert_file, "w") as fh:
+                fh.write(_b64_to_str(user["client-certificate-data"]))
+            with open(key_file, "w") as fh:
+                fh.write(_b64_to_str(user["client-key-data"]))
+            ssl_context.load_cert_chain(cert_file, key_file)
+    elif "client-certificate" in user:
+        ssl_context.load_cert_chain(user["client-certificate"], user["client-key"])
+    elif "token" in user:
+        headers["Authorization"] = f"Bearer {user['token']}"
+
+    url = urlparse(cluster["server"])
+    return {
+        "host": url.hostname,
+        "port": url.port or 443,
+        "ssl_context": ssl_context,
+        "headers": headers,
+    }
+
+
+def _get_config(kubeconfig_file=KUBEADM_KUBECONFIG_FILE):
+    """
+    Return the parsed kubeconfig, or None if we can not use it. We re-parse it
+    if the file changes (e.g. after re-creating the cluster)
+    """
+    try:
+        stat_info = stat(kubeconfig_file)
+    except OSError:
+        return None
+
+    config_key = (stat_info.st_ino, stat_info.st_mtime_ns, stat_info.st_size)
+    with _CONFIG_LOCK:
+        if _CONFIG["key"] != config_key:
+            try:
+                config = _load_kubeconfig(kubeconfig_file)
+            except (ImportError, OSError, SSLError, KeyError, IndexError) as e:
+                print(f"WARNING: can not use kubeconfig for k8s API client: {e}")
+                config = None
+            _CONFIG.update(key=config_key, config=config)
+
+        return _CONFIG["config"]
+
+
+def _new_connection(config, timeout=K8S_API_TIMEOUT_SECS):
+    return HTTPSConnection(
+        config["host"], config["port"], context=config["ssl_context"], timeout=timeout
+    )
+
+
+def _get_connection(config, reconnect=False):
+    """
+    Return this thread's connection to the API server, creating it if needed
+    """
+    conn = getattr(_THREAD_STATE, "conn", None)
+    if conn is not None and (reconnect or _THREAD_STATE.config is not config):
+        conn.close()
+        conn = None
+
+    if conn is None:
+        conn = _new_connection(config)
+        _THREAD_STATE.conn = conn
+        _THREAD_STATE.config = config
+
+    return conn
+
+
+def _k8s_api_request(method, path, params=None, body=None, content_type=None):
+    """
+    Send a request to the API server, and return the response's status and
+    decoded JSON body, or None if the client is disabled or we can not talk
+    to the API server
+    """
+    if not is_k8s_api_enabled():
+        return None
+
+    config = _get_config()
+    if config is None:
+        return None
+
+    if params:
+        path = f"{path}?{urlencode(params)}"
+
+    headers = config["headers"]
+    if content_type is not None:
+        headers = dict(headers, **{"Content-Type": content_type})
+
+    with span(f"{method} {path}", SPAN_COMMAND, {"path": path}):
+        # If the server closed our idle connection, we only find out when we
+        # use it, so we retry once with a new connection
+        for reconnect in [False, True]:
+            conn = _get_connection(config, reconnect=reconnect)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response_body = response.read()
+                break
+            except (HTTPException, OSError):
+                conn.close()
+                if reconnect:
+                    return None
+
+    try:
+        return response.status, json_loads(response_body)
+    except ValueError:
+        return response.status, None
+
+
+def k8s_api_get(path, params=None):
+    """
+    GET a path from the API server (e.g. /api/v1/nodes), and return the
+    decoded JSON response, or None if the client is disabled or the request
+    fails (callers should then fall back to `kubectl`)
+    """
+    response = _k8s_api_request("GET", path, params=params)
+    if response is None or response[0] != 200:
+        return None
+
+    return response[1]
+
+
+def k8s_api_list(path, params=None):
+    """
+    List the objects of a kind (e.g. /api/v1/namespaces/default/pods), and
+    return their items, or None if the request fails
+    """
+    response = k8s_api_get(path, params=params)
+    if response is None:
+        return None
+
+    return response.get("items") or []
+
+
+def get_pods_path(ns=None):
+    # Like `kubectl`, default to the default namespace
+    return f"/api/v1/namespaces/{ns or 'default'}/pods"
+
+
+def _get_object_key(obj):
+    return (obj["metadata"].get("namespace"), obj["metadata"]["name"])
+
+
+def _open_watch(config, path, params, resource_version, timeout_secs):
+    """
+    Start watching the objects in a path from a resource version, and return
+    the (streamed) response, or None if the API server rejects the watch
+    """
+    params = dict(params or {})
+    params.update(
+        watch="1",
+        resourceVersion=resource_version,
+        timeoutSeconds=str(timeout_secs),
+        allowWatchBookmarks="true",
+    )
+    # We do not use this thread's pooled connection, as the watch holds the
+    # connection until it ends
+    conn = _new_connection(config, timeout=timeout_secs + K8S_API_TIMEOUT_SECS)
+    try:
+        conn.request("GET", f"{path}?{urlencode(params)}", headers=config["headers"])
+        response = conn.getresponse()
+    except (HTTPException, OSError):
+        conn.close()
+        return None
+
+    if response.status != 200:
+        conn.close()
+        return None
+
+    return conn, response
+
+
+def wait_for_k8s_objects(path, predicate, params=None, timeout=None):
+    """
+    Block until `predicate` holds for the list of objects in a path (e.g.
+    /api/v1/nodes), re-evaluating it every time one of the objects changes.
+    We list the objects once, and then watch them for changes, so we return
+    the moment the predicate holds, without polling.
+
+    Returns True once the predicate holds, or None if we can not watch the
+    objects (callers should then fall back to polling with `kubectl`). Raises
+    an error if `timeout` seconds pass before the predicate holds
+    """
+    if not is_k8s_api_enabled() or _get_config() is None:
+        return None
+
+    deadline = None if timeout is None else time() + timeout
+
+    def get_remaining_secs():
+        if deadline is None:
+            return K8S_WATCH_TIMEOUT_SECS
+
+        remaining_secs = deadline - time()
+        if remaining_secs <= 0:
+            print(f"ERROR: timed-out waiting for k8s objects in: {path}")
+            raise RuntimeError("Timed-out waiting for k8s objects!")
+
+        return min(ceil(remaining_secs), K8S_WATCH_TIMEOUT_SECS)
+
+    with span(f"WATCH {path}", SPAN_COMMAND, {"path": path, "params": params}):
+        while True:
+            # (Re-)list all the objects, to get a consistent starting point
+            response = k8s_api_get(path, params=params)
+            if response is None:
+                return None
+
+            objects = {_get_object_key(obj): obj for obj in response.get("items") or []}
+            if predicate(list(objects.values())):
+                return True
+
+            watch = _open_watch(
+                _get_config(),
+                path,
+                params,
+                response["metadata"]["resourceVersion"],
+                get_remaining_secs(),
+            )
+            if watch is None:
+                return None
+
+            conn, stream = watch
+            try:
+                # The watch streams one JSON event per line. It ends when the
+                # server-side timeout expires, or with an ERROR event if our
+                # resource version is too old. In both cases we re-list
+                for line in stream:
+                    event = json_loads(line)
+                    if event["type"] == "ERROR":
+                        break
+                    if event["type"] == "BOOKMARK":
+                        continue
+
+                    obj = event["object"]
+                    if event["type"] == "DELETED":
+                        objects.pop(_get_object_key(obj), None)
+                    else:
+                        objects[_get_object_key(obj)] = obj
+
+                    if predicate(list(objects.values())):
+                        return True
+            except (HTTPException, OSError, ValueError):
+                pass
+            finally:
+                conn.close()
+
+            get_remaining_secs()
+
+
+# ------------------------------------------------------------------------------
+# Server-side apply
+# ------------------------------------------------------------------------------
+
+# Name under which we own the fields that we apply (see `kubectl apply
+# --server-side --field-manager`)
+K8S_APPLY_FIELD_MANAGER = "sc2"
+# Kinds that other objects depend on, so we apply them first, in this order.
+# We apply all other objects in the order in which they appear
+K8S_APPLY_FIRST_KINDS = ["Namespace", "CustomResourceDefinition"]
+CRDS_PATH = "/apis/apiextensions.k8s.io/v1/customresourcedefinitions"
+CRDS_ESTABLISHED_TIMEOUT_SECS = 60
+# The API server may take a moment to serve the kinds of a CRD that we have
+# just applied (e.g. a new API group returns a 404), so we retry discovery
+K8S_API_DISCOVERY_TIMEOUT_SECS = 10
+
+# Resources served for each API version (e.g. apps/v1), by kind
+_API_RESOURCES = {}
+
+
+def _get_api_version_path(api_version):
+    if "/" not in api_version:
+        return f"/api/{api_version}"
+
+    return f"/apis/{api_version}"
+
+
+def _get_api_resource(api_version, kind):
+    """
+    Return the resource that serves a kind (with its plural name, and whether
+    it is namespaced), or None if we can not talk to the API server.
+
+    If we can not find the kind, we query the API server again, as it may
+    have been added by a CRD, and we keep retrying for a short while if the
+    API server does not serve it (yet). Raises an error if it never does
+    """
+    resource = _API_RESOURCES.get(api_version, {}).get(kind)
+    deadline = time() + K8S_API_DISCOVERY_TIMEOUT_SECS
+    backoff_secs = 0.1
+    while resource is None:
+        response = _k8s_api_request("GET", _get_api_version_path(api_version))
+        if response is None:
+            return None
+
+        status, body = response
+        if status == 200:
+            resources = {
+                resource["kind"]: resource
+                for resource in body["resources"]
+                # Skip sub-resources, e.g. pods/log
+                if "/" not in resource["name"]
+            }
+            _API_RESOURCES[api_version] = resources
+            resource = resources.get(kind)
+        elif status != 404:
+            print(f"ERROR: discovering {api_version} failed (status: {status})")
+            raise RuntimeError("Error applying k8s object!")
+
+        if resource is None:
+            if time() > deadline:
+                print(f"ERROR: API server does not serve: {api_version}/{kind}")
+                raise RuntimeError("Error applying k8s object!")
+
+            sleep(backoff_secs)
+            backoff_secs = min(backoff_secs * 2, 1)
+
+    return resource
+
+
+def get_object_desc(obj):
+    return f"{obj['kind']}/{obj['metadata']['name']}"
+
+
+def _apply_k8s_object(obj):
+    """
+    Server-side apply one object, and return True, or None if we can not talk
+    to the API server. Raises an error if the API server rejects the object
+    """
+    resource = _get_api_resource(obj["apiVersion"], obj["kind"])
+    if resource is None:
+        return None
+
+    path = _get_api_version_path(obj["apiVersion"])
+    if resource["namespaced"]:
+        # Like `kubectl`, default to the default namespace
+        path += f"/namespaces/{obj['metadata'].get('namespace', 'default')}"
+    path += f"/{resource['name']}/{obj['metadata']['name']}"
+
+    # Apply patches are YAML, and JSON is valid YAML
+    response = _k8s_api_request(
+        "PATCH",
+        path,
+        params={"fieldManager": K8S_APPLY_FIELD_MANAGER, "force": "true"},
+        body=json_dumps(obj).encode("utf-8"),
+        content_type="application/apply-patch+yaml",
+    )
+    if response is None:
+        return None
+
+    status, body = response
+    if status not in [200, 201]:
+        message = body.get("message") if isinstance(body, dict) else status
+        print(f"ERROR: applying {get_object_desc(obj)} failed: {message}")
+        raise RuntimeError("Error applying k8s object!")
+
+    return True
+
+
+def _wait_for_crds_established(crd_names):
+    def are_established(crds):
+        established = [
+            crd["metadata"]["name"]
+            for crd in crds
+            if any(
+                cond["type"] == "Established" and cond["status"] == "True"
+                for cond in crd.get("status", {}).get("conditions", [])
+            )
+        ]
+        return all(name in established for name in crd_names)
+
+    return wait_for_k8s_objects(
+        CRDS_PATH, are_established, timeout=CRDS_ESTABLISHED_TIMEOUT_SECS
+    )
+
+
+def k8s_api_apply(objects):
+    """
+    Server-side apply a list of objects over this thread's connection to the
+    API server. We apply namespaces and CRDs first, and wait for the CRDs to
+    be established before applying any other object.
+
+    Returns a list with each object's description (e.g. Namespace/foo) and the
+    time (in ms) that it took to apply it, or None if we can not talk to the
+    API server (callers should then fall back to `kubectl apply`). Raises an
+    error if the API server rejects an object
+    """
+    if not is_k8s_api_enabled() or _get_config() is None:
+        return None
+
+    def get_priority(obj):
+        if obj["kind"] in K8S_APPLY_FIRST_KINDS:
+            return K8S_APPLY_FIRST_KINDS.index(obj["kind"])
+
+        return len(K8S_APPLY_FIRST_KINDS)
+
+    # Sorting is stable, so we keep the order of all other objects
+    objects = sorted(objects, key=get_priority)
+
+    timings = []
+    crd_names = []
+    for obj in objects:
+        # Objects may depend on any CRD, so we wait for all of them at once
+        if len(crd_names) > 0 and obj["kind"] != "CustomResourceDefinition":
+            if _wait_for_crds_established(crd_names) is None:
+                return None
+            crd_names = []
+
+        start_ts = time()
+        with span(f"Apply: {get_object_desc(obj)}"):
+            if _apply_k8s_object(obj) is None:
+                return None
+        timings.append((get_object_desc(obj), (time() - start_ts) * 1000))
+
+        if obj["kind"] == "CustomResourceDefinition":
+            crd_names.append(obj["metadata"]["name"])
+
+    if len(crd_names) > 0 and _wait_for_crds_established(crd_names) is None:
+        return None
+
+    return timings
@@ -1,8 +1,9 @@
 from os import environ, makedirs
-from os.path import dirname, exists, join
-from subprocess import run
+from os.path import dirname, join
+from tasks.util.cmd import run_cmd
 from tasks.util.docker import build_image, copy_from_ctr_image, is_ctr_running
 from tasks.util.env import (
+    APT_LOCK_TIMEOUT_SECS,
     CONTAINERD_CONFIG_FILE,
     GHCR_URL,
     GITHUB_ORG,
@@ -16,9 +17,17 @@ from tasks.util.env import (
     SC2_RUNTIMES,
 )
 from tasks.util.gc import GC_SOURCE_DIR
+from tasks.util.host import exists
 from tasks.util.registry import HOST_CERT_PATH
+from tasks.util.sudo import (
+    sudo_copy_file,
+    sudo_makedirs,
+    sudo_read_file,
+    sudo_remove,
+    sudo_write_file,
+)
 from tasks.util.versions import KATA_VERSION, PAUSE_IMAGE_VERSION, RUST_VERSION
-from tasks.util.toml import update_toml
+from tasks.util.toml import toml_transaction, update_tomls
 
 KATA_IMAGE_TAG = join(GHCR_URL, GITHUB_ORG, "kata-containers") + f":{KATA_VERSION}"
 
@@ -51,12 +60,12 @@ def build_pause_image(sc2, debug, hot_replace):
     """
     pause_image_build_dir = "/tmp/sc2-pause-image-build-dir"
 
-    if exists(pause_image_build_dir):
-        run(f"sudo rm -rf {pause_image_build_dir}", shell=True, check=True)
-
-    makedirs(pause_image_build_dir)
-    makedirs(join(pause_image_build_dir, "static-build"))
-    makedirs(join(pause_image_build_dir, "scripts"))
+    # When replaying a recording we do not actually remove the directory, so
+    # it may already exist
+    sudo_remove(pause_image_build_dir, recursive=True)
+    makedirs(pause_image_build_dir, exist_ok=True)
+    makedirs(join(pause_image_build_dir, "static-build"), exist_ok=True)
+    makedirs(join(pause_image_build_dir, "scripts"), exist_ok=True)
 
     script_files = ["static-build/pause-image", "scripts/lib.sh"]
     for ctr_path, host_path in zip(
@@ -81,26 +90,18 @@ def build_pause_image(sc2, debug, hot_replace):
             "pause_image_version": PAUSE_IMAGE_VERSION,
         }
     )
-    out = run(
+    run_cmd(
         "./build.sh",
-        shell=True,
         cwd=join(pause_image_build_dir, "static-build", "pause-image"),
         env=work_env,
-        capture_output=True,
-    )
-    assert out.returncode == 0, "Error building pause image: {}".format(
-        out.stderr.decode("utf-8")
+        debug=debug,
+        error_msg="Error building pause image!",
     )
 
     # Generate tarball of pause bundle
     pause_bundle_tarball_name = "pause_bundle_sc2.tar.xz"
     tar_cmd = f"tar -cJf {pause_bundle_tarball_name} pause_bundle"
-    run(
-        tar_cmd,
-        shell=True,
-        check=True,
-        cwd=join(pause_image_build_dir, "static-build", "pause-image"),
-    )
+    run_cmd(tar_cmd, cwd=join(pause_image_build_dir, "static-build", "pause-image"))
 
     return join(
         pause_image_build_dir, "static-build", "pause-image", pause_bundle_tarball_name
@@ -115,6 +116,10 @@ def run_kata_workon_ctr(mount_path=None, gc_mount_path=None):
     if is_ctr_running(KATA_WORKON_CTR_NAME):
         return False
 
+    # Remove the container if it exists but is not running (e.g. if we
+    # restarted docker half-way through a deployment)
+    run_cmd("docker rm -f {}".format(KATA_WORKON_CTR_NAME), check=False)
+
     docker_cmd = [
         "docker run",
         "-d -t",
@@ -125,22 +130,13 @@ def run_kata_workon_ctr(mount_path=None, gc_mount_path=None):
         "bash",
     ]
     docker_cmd = " ".join(docker_cmd)
-    out = run(docker_cmd, shell=True, capture_output=True)
-    assert out.returncode == 0, "Error starting Kata workon ctr: {}".format(
-        out.stderr.decode("utf-8")
-    )
+    run_cmd(docker_cmd, error_msg="Error starting Kata workon ctr!")
 
     return True
 
 
 def stop_kata_workon_ctr():
-    result = run(
-        "docker rm -f {}".format(KATA_WORKON_CTR_NAME),
-        shell=True,
-        check=True,
-        capture_output=True,
-    )
-    assert result.returncode == 0
+    run_cmd("docker rm -f {}".format(KATA_WORKON_CTR_NAME))
 
 
 def copy_from_kata_workon_ctr(
@@ -164,12 +160,7 @@ def copy_from_kata_workon_ctr(
         if debug:
             print(docker_cmd)
 
-        result = run(docker_cmd, shell=True, capture_output=True)
-        assert result.returncode == 0, "Error copying from container: {}".format(
-            result.stderr.decode("utf-8")
-        )
-        if debug:
-            print(result.stdout.decode("utf-8").strip())
+        run_cmd(docker_cmd, debug=debug, error_msg="Error copying from container!")
     else:
         # If not hot-replacing, use the built-in method to copy from a
         # container rootfs without initializing it
@@ -188,20 +179,17 @@ def prepare_rootfs(tmp_rootfs_base_dir, debug=False, sc2=False, hot_replace=Fals
     tmp_rootfs_dir = join(tmp_rootfs_base_dir, "rootfs")
     tmp_rootfs_scripts_dir = join(tmp_rootfs_base_dir, "osbuilder")
 
-    if exists(tmp_rootfs_base_dir):
-        out = run(f"sudo rm -rf {tmp_rootfs_base_dir}", shell=True, capture_output=True)
-        assert out.returncode == 0, "Error removing previous rootfs: {}".format(
-            out.stderr.decode("utf-8")
-        )
-
-    makedirs(tmp_rootfs_base_dir)
-    makedirs(tmp_rootfs_dir)
-    makedirs(tmp_rootfs_scripts_dir)
-    makedirs(join(tmp_rootfs_scripts_dir, "image-builder"))
-    makedirs(join(tmp_rootfs_scripts_dir, "initrd-builder"))
-    makedirs(join(tmp_rootfs_scripts_dir, "rootfs-builder"))
-    makedirs(join(tmp_rootfs_scripts_dir, "rootfs-builder", "ubuntu"))
-    makedirs(join(tmp_rootfs_scripts_dir, "scripts"))
+    # When replaying a recording we do not actually remove the directory, so
+    # it may already exist
+    sudo_remove(tmp_rootfs_base_dir, recursive=True)
+    makedirs(tmp_rootfs_base_dir, exist_ok=True)
+    makedirs(tmp_rootfs_dir, exist_ok=True)
+    makedirs(tmp_rootfs_scripts_dir, exist_ok=True)
+    makedirs(join(tmp_rootfs_scripts_dir, "image-builder"), exist_ok=True)
+    makedirs(join(tmp_rootfs_scripts_dir, "initrd-builder"), exist_ok=True)
+    makedirs(join(tmp_rootfs_scripts_dir, "rootfs-builder"), exist_ok=True)
+    makedirs(join(tmp_rootfs_scripts_dir, "rootfs-builder", "ubuntu"), exist_ok=True)
+    makedirs(join(tmp_rootfs_scripts_dir, "scripts"), exist_ok=True)
 
     # Copy all the tooling/script files we need from the container
     script_files = [
@@ -246,12 +234,11 @@ def prepare_rootfs(tmp_rootfs_base_dir, debug=False, sc2=False, hot_replace=Fals
     # ----- Prepare kata agent tarball -----
 
     tmp_rootfs_agent_tarball_dir = join(tmp_rootfs_base_dir, "agent-tarball")
-    makedirs(tmp_rootfs_agent_tarball_dir)
-    makedirs(join(tmp_rootfs_agent_tarball_dir, "usr"))
-    makedirs(join(tmp_rootfs_agent_tarball_dir, "usr", "bin"))
-    makedirs(join(tmp_rootfs_agent_tarball_dir, "usr", "lib"))
-    makedirs(join(tmp_rootfs_agent_tarball_dir, "usr", "lib", "systemd"))
-    makedirs(join(tmp_rootfs_agent_tarball_dir, "usr", "lib", "systemd", "system"))
+    makedirs(join(tmp_rootfs_agent_tarball_dir, "usr", "bin"), exist_ok=True)
+    makedirs(
+        join(tmp_rootfs_agent_tarball_dir, "usr", "lib", "systemd", "system"),
+        exist_ok=True,
+    )
 
     # Copy our kata agent
     agent_host_path = join(
@@ -282,23 +269,15 @@ def prepare_rootfs(tmp_rootfs_base_dir, debug=False, sc2=False, hot_replace=Fals
         )
 
     agent_tarball = join(tmp_rootfs_base_dir, "kata_agent.tar.xz")
-    result = run(
-        f"tar cvJf {agent_tarball} ./usr",
-        shell=True,
-        capture_output=True,
-        cwd=tmp_rootfs_agent_tarball_dir,
-    )
-    assert result.returncode == 0, result.stderr.decode("utf-8")
+    run_cmd(f"tar cvJf {agent_tarball} ./usr", cwd=tmp_rootfs_agent_tarball_dir)
 
     # ----- Populate rootfs with base ubuntu using Kata's scripts -----
 
-    out = run(
-        "sudo DEBIAN_FRONTEND=noninteractive apt install -y makedev multistrap",
-        shell=True,
-        capture_output=True,
-    )
-    assert out.returncode == 0, "Error preparing rootfs: {}".format(
-        out.stderr.decode("utf-8")
+    run_cmd(
+        "sudo DEBIAN_FRONTEND=noninteractive apt install -y "
+        f"-o DPkg::Lock::Timeout={APT_LOCK_TIMEOUT_SECS} makedev multistrap",
+        resource="apt",
+        error_msg="Error preparing rootfs!",
     )
 
     rootfs_builder_dir = join(tmp_rootfs_scripts_dir, "rootfs-builder")
@@ -322,18 +301,13 @@ def prepare_rootfs(tmp_rootfs_base_dir, debug=False, sc2=False, hot_replace=Fals
         "ROOTFS_DIR": tmp_rootfs_dir,
     }
     rootfs_builder_cmd = f"sudo -E {rootfs_builder_dir}/rootfs.sh ubuntu"
-    out = run(
+    run_cmd(
         rootfs_builder_cmd,
-        shell=True,
-        env=work_env,
         cwd=rootfs_builder_dir,
-        capture_output=True,
-    )
-    assert out.returncode == 0, "Error preparing rootfs: {}".format(
-        out.stderr.decode("utf-8")
+        env=work_env,
+        debug=debug,
+        error_msg="Error preparing rootfs!",
     )
-    if debug:
-        print(out.stdout.decode("utf-8").strip())
 
     # ----- Add extra files to the rootfs -----
 
@@ -353,24 +327,12 @@ def prepare_rootfs(tmp_rootfs_base_dir, debug=False, sc2=False, hot_replace=Fals
 
             guest_path = join(tmp_rootfs_dir, rel_guest_path)
             if not exists(dirname(guest_path)):
-                run(
-                    "sudo mkdir -p {}".format(dirname(guest_path)),
-                    shell=True,
-                    check=True,
-                )
+                sudo_makedirs(dirname(guest_path))
 
             if exists(guest_path) and extra_files[host_path]["mode"] == "a":
-                run(
-                    'sudo sh -c "cat {} >> {}"'.format(host_path, guest_path),
-                    shell=True,
-                    check=True,
-                )
+                sudo_write_file(guest_path, sudo_read_file(host_path), append=True)
             else:
-                run(
-                    "sudo cp {} {}".format(host_path, guest_path),
-                    shell=True,
-                    check=True,
-                )
+                sudo_copy_file(host_path, guest_path)
 
 
 def replace_agent(
@@ -405,15 +367,13 @@ def replace_agent(
             dst_initrd_path if package == "initrd" else dst_img_path,
             tmp_rootfs_dir,
         )
-        out = run(pack_cmd, shell=True, env=work_env, capture_output=True)
-        assert out.returncode == 0, "Error packing {}: {}".format(
-            package, out.stderr.decode("utf-8")
+        run_cmd(
+            pack_cmd, env=work_env, debug=debug, error_msg=f"Error packing {package}!"
         )
-        if debug:
-            print(out.stdout.decode("utf-8").strip())
 
     # Lastly, update the Kata config to point to the new initrd
     target_runtimes = SC2_RUNTIMES if sc2 else KATA_RUNTIMES
+    updates = {}
     for runtime in target_runtimes:
         # QEMU uses an optimized image file (no initrd) so we keep it that way
         # also, for the time being, the QEMU baseline requires no patches
@@ -423,21 +383,24 @@ def replace_agent(
         conf_file_path = join(KATA_CONFIG_DIR, "configuration-{}.toml".format(runtime))
 
         if runtime == "qemu-coco-dev" or "tdx" in runtime:
-            updated_toml_str = """
+            updates[
+                conf_file_path
+            ] = """
             [hypervisor.qemu]
             image = "{new_image_path}"
             """.format(
                 new_image_path=dst_img_path
             )
-            update_toml(conf_file_path, updated_toml_str)
         else:
-            updated_toml_str = """
+            updates[
+                conf_file_path
+            ] = """
             [hypervisor.qemu]
             initrd = "{new_initrd_path}"
             """.format(
                 new_initrd_path=dst_initrd_path
             )
-            update_toml(conf_file_path, updated_toml_str)
+    update_tomls(updates, debug=debug)
 
 
 def replace_shim(
@@ -471,12 +434,13 @@ def replace_shim(
     )
 
     target_runtimes = SC2_RUNTIMES if sc2 else KATA_RUNTIMES
-    for runtime in target_runtimes:
-        updated_toml_str = """
-        [plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime_name}]
-        runtime_type = "io.containerd.kata-{runtime_name}.v2"
-        runtime_path = "{ctrd_path}"
-        """.format(
-            runtime_name=runtime, ctrd_path=dst_shim_binary
-        )
-        update_toml(CONTAINERD_CONFIG_FILE, updated_toml_str)
+    with toml_transaction(CONTAINERD_CONFIG_FILE) as ctrd_conf:
+        for runtime in target_runtimes:
+            updated_toml_str = """
+            [plugins."io.containerd.grpc.v1.cri".containerd.runtimes.kata-{runtime_name}]
+            runtime_type = "io.containerd.kata-{runtime_name}.v2"
+            runtime_path = "{ctrd_path}"
+            """.format(
+                runtime_name=runtime, ctrd_path=dst_shim_binary
+            )
+            ctrd_conf.update(updated_toml_str)
@@ -2,9 +2,7 @@ from base64 import b64encode
 from json import dumps as json_dumps
 from os import makedirs
 from os.path import join
-from pymysql import connect as mysql_connect
-from pymysql.cursors import DictCursor
-from subprocess import run
+from tasks.util.cmd import run_cmd
 from tasks.util.cosign import COSIGN_PUB_KEY
 from tasks.util.env import COMPONENTS_DIR
 from tasks.util.sev import get_launch_digest
@@ -46,11 +44,7 @@ def get_kbs_db_ip():
     docker_cmd += (
         "'.[].Containers[] | select(.Name | test(\"simple-kbs[_-]db.*\")).IPv4Address'"
     )
-    db_ip = (
-        run(docker_cmd, shell=True, capture_output=True)
-        .stdout.decode("utf-8")
-        .strip()[:-3]
-    )
+    db_ip = run_cmd(docker_cmd, check=False).stdout.strip()[:-3]
     return db_ip
 
 
@@ -58,6 +52,9 @@ def connect_to_kbs_db():
     """
     Get a working MySQL connection to the KBS DB
     """
+    from pymysql import connect as mysql_connect
+    from pymysql.cursors import DictCursor
+
     # Get the database IP
     db_ip = get_kbs_db_ip()
 
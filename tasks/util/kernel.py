@@ -1,5 +1,9 @@
 from os import environ
-from subprocess import run
+from re import MULTILINE, sub
+from tasks.util.cmd import run_cmd
+from tasks.util.host import get_kernel_release
+from tasks.util.probe import cached_probe
+from tasks.util.sudo import sudo_read_file, sudo_write_file
 from tasks.util.versions import HOST_KERNEL_VERSION_SNP, HOST_KERNEL_VERSION_TDX
 
 
@@ -15,14 +19,13 @@ def get_host_kernel_expected_prefix():
     raise RuntimeError("Error detecting expected host kernel")
 
 
+@cached_probe()
 def get_host_kernel_version():
-    # Use a tmp file to not rely on being able to capture our stdout
-    tmp_file = "/tmp/svsm_kernel_config"
-    run(f"uname -r > {tmp_file}", shell=True, check=True)
-    with open(tmp_file, "r") as fh:
-        current_kernel_name = fh.read().strip()
-
-    return current_kernel_name
+    """
+    Get the running kernel's release (i.e. `uname -r`), which can only change
+    after a reboot
+    """
+    return get_kernel_release()
 
 
 def grub_update_default_kernel(kernel_version):
@@ -30,13 +33,13 @@ def grub_update_default_kernel(kernel_version):
     This method replaces the GRUB_DEFAULT value
     """
     grub_default = f"Advanced options for Ubuntu>Ubuntu, with Linux {kernel_version}"
-    result = run(
-        f"sudo sed -i 's/^GRUB_DEFAULT=.*/GRUB_DEFAULT=\"{grub_default}\"/' "
-        "/etc/default/grub",
-        shell=True,
-        capture_output=True,
+    grub_file = "/etc/default/grub"
+    grub_config = sudo_read_file(grub_file).decode("utf-8")
+    grub_config = sub(
+        r"^GRUB_DEFAULT=.*$",
+        lambda _: f'GRUB_DEFAULT="{grub_default}"',
+        grub_config,
+        flags=MULTILINE,
     )
-    assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-
-    result = run("sudo update-grub", shell=True, capture_output=True)
-    assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
+    sudo_write_file(grub_file, grub_config)
+    run_cmd("sudo update-grub")
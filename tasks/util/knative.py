@@ -1,11 +1,10 @@
 from os import makedirs
 from os.path import exists, join
-from subprocess import run
+from tasks.util.cmd import RETRY_ON_TRANSIENT_ERROR, run_cmd
 from tasks.util.env import CONF_FILES_DIR, LOCAL_REGISTRY_URL, TEMPLATED_FILES_DIR
-from tasks.util.k8s import template_k8s_file
-from tasks.util.kubeadm import run_kubectl_command
+from tasks.util.k8s import apply_manifests, template_k8s_file
+from tasks.util.kubeadm import run_kubectl_command, run_kubectl_command_async
 from tasks.util.registry import K8S_SECRET_NAME
-from time import sleep
 
 # Knative Serving Side-Car Tag
 KNATIVE_SIDECAR_IMAGE_TAG = "gcr.io/knative-releases/knative.dev/serving/cmd/"
@@ -17,15 +16,6 @@ KNATIVE_SIDECAR_IMAGE_TAG += (
 def replace_sidecar(
     reset_default=False, image_repo=LOCAL_REGISTRY_URL, quiet=False, skip_push=False
 ):
-    def do_run(cmd, quiet):
-        if quiet:
-            out = run(cmd, shell=True, capture_output=True)
-            assert out.returncode == 0, "Error running cmd: {} (error: {})".format(
-                cmd, out.stderr
-            )
-        else:
-            out = run(cmd, shell=True, check=True)
-
     k8s_filename = "knative_replace_sidecar.yaml"
 
     if reset_default:
@@ -36,44 +26,36 @@ def replace_sidecar(
             out_k8s_file,
             {"knative_sidecar_image_url": KNATIVE_SIDECAR_IMAGE_TAG},
         )
-        run_kubectl_command("apply -f {}".format(out_k8s_file), capture_output=quiet)
+        apply_manifests([out_k8s_file], debug=not quiet)
         return
 
     # Pull the right Knative Serving side-car image tag
     docker_cmd = "docker pull {}".format(KNATIVE_SIDECAR_IMAGE_TAG)
-    do_run(docker_cmd, quiet)
+    run_cmd(docker_cmd, resource="docker-pull", debug=not quiet)
 
     # Re-tag it, and push it to our controlled registry
     image_name = "system/knative-sidecar"
     image_tag = "unencrypted"
     new_image_url = "{}/{}:{}".format(image_repo, image_name, image_tag)
     docker_cmd = "docker tag {} {}".format(KNATIVE_SIDECAR_IMAGE_TAG, new_image_url)
-    do_run(docker_cmd, quiet)
+    run_cmd(docker_cmd, debug=not quiet)
 
     if not skip_push:
-        docker_cmd = "docker push {}".format(new_image_url)
-
         # Retry a few times, as the registry may be booting up
-        num_retries = 3
-        for i in range(num_retries):
-            try:
-                do_run(docker_cmd, quiet)
-                break
-            except AssertionError:
-                sleep(3)
-
-            # Error if we have not managed to break
-            if i == num_retries - 1:
-                raise RuntimeError("Error pushing image to registry")
+        run_cmd(
+            "docker push {}".format(new_image_url),
+            retry=RETRY_ON_TRANSIENT_ERROR,
+            resource="docker-push",
+            debug=not quiet,
+            error_msg="Error pushing image to registry",
+        )
 
     # Get the digest for the recently pulled image, and use it to update
     # Knative's deployment configmap
     docker_cmd = 'docker images {} --digests --format "{{{{.Digest}}}}"'.format(
         join(image_repo, image_name),
     )
-    image_digest = (
-        run(docker_cmd, shell=True, capture_output=True).stdout.decode("utf-8").strip()
-    )
+    image_digest = run_cmd(docker_cmd).stdout.strip()
     assert len(image_digest) > 0
 
     if not exists(TEMPLATED_FILES_DIR):
@@ -85,25 +67,16 @@ def replace_sidecar(
     template_k8s_file(
         in_k8s_file, out_k8s_file, {"knative_sidecar_image_url": new_image_url_digest}
     )
-    run_kubectl_command("apply -f {}".format(out_k8s_file), capture_output=quiet)
+    apply_manifests([out_k8s_file], debug=not quiet)
 
     # FIXME: to prevent an issue with nydus, we need to manually fetch the
     # contents of the image
-    result = run(
-        f"sudo ctr -n k8s.io content fetch -k {new_image_url}",
-        shell=True,
-        capture_output=True,
-    )
-    assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-    if not quiet:
-        print(result.stdout.decode("utf-8").strip())
+    run_cmd(f"sudo ctr -n k8s.io content fetch -k {new_image_url}", debug=not quiet)
 
     # Finally, make sure to remove all pulled container images to avoid
     # unintended caching issues with CoCo
-    docker_cmd = "docker rmi {}".format(KNATIVE_SIDECAR_IMAGE_TAG)
-    do_run(docker_cmd, quiet)
-    docker_cmd = "docker rmi {}".format(new_image_url)
-    do_run(docker_cmd, quiet)
+    run_cmd("docker rmi {}".format(KNATIVE_SIDECAR_IMAGE_TAG), debug=not quiet)
+    run_cmd("docker rmi {}".format(new_image_url), debug=not quiet)
 
 
 def configure_self_signed_certs(
@@ -128,13 +101,13 @@ def configure_self_signed_certs(
     )
 
 
-def patch_autoscaler(debug=False):
+async def patch_autoscaler_async(debug=False):
     """
     Patch Knative's auto-scaler so that our services are initially scaled-down
     to zero. They will scale-up the first time we send an HTTP request.
     """
     k8s_filename = "knative_autoscaler_patch.yaml"
-    run_kubectl_command(
+    await run_kubectl_command_async(
         "-n knative-serving patch configmap config-autoscaler --patch-file {}".format(
             join(CONF_FILES_DIR, k8s_filename)
         ),
@@ -1,69 +1,404 @@
-from subprocess import run
+from asyncio import to_thread
+from functools import partial
+from tasks.util.aio import run_all, run_cmd_async
+from tasks.util.probe import cached_probe
+from tasks.util.cmd import run_cmd
 from tasks.util.env import KUBEADM_KUBECONFIG_FILE
-from time import sleep
+from tasks.util.k8s_api import get_pods_path, k8s_api_list, wait_for_k8s_objects
+from tasks.util.manifests import use_cached_manifests
+from threading import Lock
+from time import sleep, time
+
+RUNTIME_CLASSES_PATH = "/apis/node.k8s.io/v1/runtimeclasses"
+
+
+def get_kubectl_command(cmd):
+    return "kubectl --kubeconfig={} {}".format(KUBEADM_KUBECONFIG_FILE, cmd)
 
 
 def run_kubectl_command(cmd, capture_output=False):
-    k8s_cmd = "kubectl --kubeconfig={} {}".format(KUBEADM_KUBECONFIG_FILE, cmd)
+    k8s_cmd = get_kubectl_command(use_cached_manifests(cmd))
 
     if capture_output:
-        return (
-            run(k8s_cmd, shell=True, capture_output=True).stdout.decode("utf-8").strip()
-        )
+        return run_cmd(k8s_cmd, check=False).stdout.strip()
 
-    run(k8s_cmd, shell=True, check=True)
+    run_cmd(k8s_cmd, debug=True)
 
 
-def wait_for_pods_in_ns(ns=None, expected_num_of_pods=0, label=None, debug=False):
+async def run_kubectl_command_async(cmd, capture_output=False):
     """
-    Wait for pods in a namespace to be ready
+    Async version of `run_kubectl_command`, to run many independent kubectl
+    commands at the same time (see `tasks.util.aio.run_all`)
     """
-    while True:
+    k8s_cmd = get_kubectl_command(use_cached_manifests(cmd))
+
+    if capture_output:
+        return (await run_cmd_async(k8s_cmd, check=False)).stdout.strip()
+
+    await run_cmd_async(k8s_cmd, debug=True)
+
+
+def get_pods_ready_cmd(ns=None, label=None):
+    cmd = [
+        "-n {}".format(ns) if ns else "",
+        "get pods",
+        "-l {}".format(label) if label else "",
+        "-o jsonpath='{..status.conditions[?(@.type==\"Ready\")].status}'",
+    ]
+    return " ".join(cmd)
+
+
+def get_pods_ready_output(pods):
+    """
+    Given a list of pod objects, return the same output as running the command
+    in `get_pods_ready_cmd`
+    """
+    return " ".join(
+        [
+            cond["status"]
+            for pod in pods
+            for cond in pod.get("status", {}).get("conditions", [])
+            if cond["type"] == "Ready"
+        ]
+    )
+
+
+def get_pods_ready_from_api(ns=None, label=None):
+    """
+    Same output as running the command in `get_pods_ready_cmd`, but querying
+    the API server directly. Returns None if we can not reach it
+    """
+    params = {"labelSelector": label} if label else None
+    pods = k8s_api_list(get_pods_path(ns), params=params)
+    if pods is None:
+        return None
+
+    return get_pods_ready_output(pods)
+
+
+def are_pods_ready(output, expected_num_of_pods=0, debug=False):
+    """
+    Given the output of the command in `get_pods_ready_cmd`, work out whether
+    all the pods we are waiting for are ready
+    """
+    statuses = [o.strip() for o in output.split(" ") if o.strip()]
+    if expected_num_of_pods > 0 and len(statuses) != expected_num_of_pods:
         if debug:
             print(
-                f"Waiting for {expected_num_of_pods} pods to be ready in ns: "
-                f"{ns} (label: {label})"
+                "Expecting {} pods, have {}".format(expected_num_of_pods, len(statuses))
             )
+    elif all([s == "True" for s in statuses]):
+        if debug:
+            print("All pods ready, continuing...")
 
-        cmd = [
-            "-n {}".format(ns) if ns else "",
-            "get pods",
-            "-l {}".format(label) if label else "",
-            "-o jsonpath='{..status.conditions[?(@.type==\"Ready\")].status}'",
-        ]
+        return True
 
-        output = run_kubectl_command(
-            " ".join(cmd),
-            capture_output=True,
+    if debug:
+        print("Pods not ready, waiting ({})".format(output))
+
+    return False
+
+
+def watch_pods_in_ns(ns=None, expected_num_of_pods=0, label=None, debug=False):
+    """
+    Wait for pods in a namespace to be ready, watching them through the API
+    server. Returns None if we can not watch them
+    """
+    return wait_for_k8s_objects(
+        get_pods_path(ns),
+        lambda pods: are_pods_ready(
+            get_pods_ready_output(pods), expected_num_of_pods, debug=debug
+        ),
+        params={"labelSelector": label} if label else None,
+    )
+
+
+def wait_for_pods_in_ns(ns=None, expected_num_of_pods=0, label=None, debug=False):
+    """
+    Wait for pods in a namespace to be ready
+    """
+    if debug:
+        print(
+            f"Waiting for {expected_num_of_pods} pods to be ready in ns: "
+            f"{ns} (label: {label})"
         )
 
-        statuses = [o.strip() for o in output.split(" ") if o.strip()]
-        if expected_num_of_pods > 0 and len(statuses) != expected_num_of_pods:
-            if debug:
-                print(
-                    "Expecting {} pods, have {}".format(
-                        expected_num_of_pods, len(statuses)
+    if watch_pods_in_ns(ns, expected_num_of_pods, label, debug) is not None:
+        return
+
+    # If we can not watch the pods, poll for them instead
+    while True:
+        output = get_pods_ready_from_api(ns=ns, label=label)
+        if output is None:
+            output = run_kubectl_command(
+                get_pods_ready_cmd(ns=ns, label=label), capture_output=True
+            )
+        if are_pods_ready(output, expected_num_of_pods, debug=debug):
+            break
+
+        sleep(5)
+
+
+def matches_label_selector(labels, label_selector):
+    """
+    Work out whether a set of labels matches an (equality-based) label
+    selector, e.g.: "app=foo,tier!=backend"
+    """
+    if not label_selector:
+        return True
+
+    for requirement in [r.strip() for r in label_selector.split(",")]:
+        if "!=" in requirement:
+            key, value = requirement.split("!=", 1)
+            if labels.get(key.strip()) == value.strip():
+                return False
+        elif "=" in requirement:
+            key, value = requirement.replace("==", "=").split("=", 1)
+            if labels.get(key.strip()) != value.strip():
+                return False
+        elif requirement.startswith("!"):
+            if requirement[1:] in labels:
+                return False
+        elif requirement not in labels:
+            return False
+
+    return True
+
+
+def wait_for_all(selectors, timeout=None, debug=False):
+    """
+    Wait for many sets of pods to be ready at the same time. Each selector is
+    a tuple (namespace, label, expected_num_of_pods), where label may be None
+
+    We watch all the pods in each namespace once, and match the selectors
+    against them locally. If `timeout` seconds pass before all the pods are
+    ready, we report the selectors that are still pending, and raise an error
+    """
+    pending = list(selectors)
+    pending_lock = Lock()
+
+    def print_pending(prefix):
+        for ns, label, expected_num_of_pods in pending:
+            print(f"{prefix}{expected_num_of_pods} pods in ns: {ns} (label: {label})")
+
+    def check_ns(ns, pods):
+        with pending_lock:
+            for selector in [s for s in pending if s[0] == ns]:
+                matching_pods = [
+                    pod
+                    for pod in pods
+                    if matches_label_selector(
+                        pod["metadata"].get("labels", {}), selector[1]
                     )
+                ]
+                output = get_pods_ready_output(matching_pods)
+                if are_pods_ready(output, selector[2]):
+                    pending.remove(selector)
+                    if debug:
+                        print(f"Pods ready in ns: {ns} (label: {selector[1]})")
+
+            return not any([s[0] == ns for s in pending])
+
+    if debug:
+        print_pending("Waiting for ")
+
+    namespaces = list(dict.fromkeys([s[0] for s in selectors]))
+    deadline = None if timeout is None else time() + timeout
+    try:
+        watched = run_all(
+            *[
+                to_thread(
+                    wait_for_k8s_objects,
+                    get_pods_path(ns),
+                    partial(check_ns, ns),
+                    timeout=timeout,
                 )
-        elif all([s == "True" for s in statuses]):
-            if debug:
-                print("All pods ready, continuing...")
+                for ns in namespaces
+            ]
+        )
+    except RuntimeError:
+        print("ERROR: timed-out waiting for pods to be ready, still waiting for:")
+        print_pending("ERROR: - ")
+        raise
+
+    if all([w is not None for w in watched]):
+        return
 
+    # If we can not watch the pods, poll for all the pending ones at once
+    async def is_ready(ns, label, expected_num_of_pods):
+        output = await to_thread(get_pods_ready_from_api, ns=ns, label=label)
+        if output is None:
+            output = await run_kubectl_command_async(
+                get_pods_ready_cmd(ns=ns, label=label), capture_output=True
+            )
+        return are_pods_ready(output, expected_num_of_pods, debug=debug)
+
+    while len(pending) > 0:
+        polled = list(pending)
+        ready = run_all(*[is_ready(*selector) for selector in polled])
+        for selector, selector_ready in zip(polled, ready):
+            if selector_ready:
+                pending.remove(selector)
+
+        if len(pending) == 0:
             break
 
-        if debug:
-            print("Pods not ready, waiting ({})".format(output))
+        if deadline is not None and time() > deadline:
+            print("ERROR: timed-out waiting for pods to be ready, still waiting for:")
+            print_pending("ERROR: - ")
+            raise RuntimeError("Timed-out waiting for pods!")
 
         sleep(5)
 
 
 def get_pod_names_in_ns(ns):
+    pods = k8s_api_list(get_pods_path(ns))
+    if pods is not None:
+        return [pod["metadata"]["name"] for pod in pods]
+
     kubectl_cmd = "get pods -n {} -o jsonpath='{{..metadata.name}}'".format(ns)
     pods = run_kubectl_command(kubectl_cmd, capture_output=True).split(" ")
     return [p for p in pods if len(p) > 0]
 
 
+def get_runtime_class_handlers():
+    runtime_classes = k8s_api_list(RUNTIME_CLASSES_PATH)
+    if runtime_classes is not None:
+        return [runtime_class["handler"] for runtime_class in runtime_classes]
+
+    kubectl_cmd = "get runtimeclass -o jsonpath='{.items..handler}'"
+    handlers = run_kubectl_command(kubectl_cmd, capture_output=True).split(" ")
+    return [h for h in handlers if len(h) > 0]
+
+
+def wait_for_runtime_classes(expected_runtime_classes, debug=False):
+    """
+    Wait until all the expected runtime classes are registered
+    """
+
+    def are_registered(handlers):
+        missing = [rc for rc in expected_runtime_classes if rc not in handlers]
+        if debug and len(missing) > 0:
+            print(f"Waiting for runtime classes to be registered: {missing}")
+
+        return len(missing) == 0
+
+    watched = wait_for_k8s_objects(
+        RUNTIME_CLASSES_PATH,
+        lambda runtime_classes: are_registered(
+            [runtime_class["handler"] for runtime_class in runtime_classes]
+        ),
+    )
+    if watched is not None:
+        return
+
+    while not are_registered(get_runtime_class_handlers()):
+        sleep(5)
+
+
+def get_node_state():
+    """
+    Return the state of the (single) node in the cluster, as reported by
+    `kubectl get nodes`
+    """
+    # We could use a jsonpath format here, but couldn't quite work it out
+    out = run_kubectl_command("get nodes --no-headers", capture_output=True).split(" ")
+    out = [_ for _ in out if len(_) > 0]
+    return out[1] if len(out) > 1 else ""
+
+
+def are_nodes_ready(nodes):
+    return len(nodes) > 0 and all(
+        [
+            any(
+                [
+                    cond["type"] == "Ready" and cond["status"] == "True"
+                    for cond in node.get("status", {}).get("conditions", [])
+                ]
+            )
+            for node in nodes
+        ]
+    )
+
+
+def wait_for_node_ready(debug=False):
+    """
+    Wait for the node in the cluster to be in ready state
+    """
+    if debug:
+        print("Waiting for node to be ready...")
+
+    if wait_for_k8s_objects("/api/v1/nodes", are_nodes_ready) is not None:
+        return
+
+    while get_node_state() != "Ready":
+        if debug:
+            print("Waiting for node to be ready...")
+
+        sleep(3)
+
+
+def get_service_ingress_ip(service):
+    ingress = service.get("status", {}).get("loadBalancer", {}).get("ingress") or []
+    if len(ingress) == 0:
+        return ""
+
+    return ingress[0].get("ip", "")
+
+
+def is_ipv4(ip):
+    return len(ip.split(".")) == 4
+
+
+def wait_for_service_ingress_ip(ns, service_name, debug=False):
+    """
+    Wait for a LoadBalancer service to be assigned an external IP, and
+    return it
+    """
+    if debug:
+        print(f"Waiting for external IP to be assigned to service: {service_name}")
+
+    ips = []
+
+    def has_ingress_ip(services):
+        ips[:] = [get_service_ingress_ip(service) for service in services]
+        return len(ips) > 0 and is_ipv4(ips[0])
+
+    watched = wait_for_k8s_objects(
+        f"/api/v1/namespaces/{ns}/services",
+        has_ingress_ip,
+        params={"fieldSelector": f"metadata.name={service_name}"},
+    )
+    if watched is not None:
+        return ips[0]
+
+    ip_cmd = [
+        "--namespace {}".format(ns),
+        "get service {}".format(service_name),
+        "-o jsonpath='{.status.loadBalancer.ingress[0].ip}'",
+    ]
+    ip_cmd = " ".join(ip_cmd)
+    actual_ip = run_kubectl_command(ip_cmd, capture_output=True)
+    while not is_ipv4(actual_ip):
+        sleep(3)
+        actual_ip = run_kubectl_command(ip_cmd, capture_output=True)
+
+    return actual_ip
+
+
+@cached_probe()
 def get_node_name():
+    nodes = k8s_api_list("/api/v1/nodes")
+    if nodes is not None:
+        return " ".join(
+            [
+                address["address"]
+                for node in nodes
+                for address in node["status"].get("addresses", [])
+                if address["type"] == "Hostname"
+            ]
+        )
+
     cmd = "get nodes -o jsonpath="
     cmd += "'{.items..status..addresses[?(@.type==\"Hostname\")].address}'"
     return run_kubectl_command(cmd, capture_output=True)
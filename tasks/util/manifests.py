@@ -0,0 +1,181 @@
+from hashlib import sha256
+from os import environ, getpid, makedirs, rename
+from os.path import exists, join
+from re import compile as regex_compile
+from tasks.util.cmd import run_cmd
+from tasks.util.env import K8S_CONFIG_DIR
+from tasks.util.replay import get_replay_mode
+from tasks.util.tracing import span
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+# We apply many k8s manifests (and kustomizations) straight from the internet.
+# Fetching them (and, even more so, resolving remote kustomizations) is slow,
+# so we keep a local copy of every manifest whose URL pins a version. Next to
+# each copy we store its checksum, and we re-fetch it if it does not match.
+#
+# As with the k8s API client, we do not use the cache when recording or
+# replaying commands (see tasks/util/replay.py). Set SC2_MANIFEST_CACHE=off to
+# always use the remote manifests
+MANIFEST_CACHE_DIR = join(K8S_CONFIG_DIR, "manifests")
+MANIFEST_CACHE_ENV_VAR = "SC2_MANIFEST_CACHE"
+MANIFEST_FETCH_TIMEOUT_SECS = 60
+
+# A manifest is pinned if its URL includes a version (e.g. v1.2.3, or 0.13.11)
+_PINNED_VERSION_RE = regex_compile(r"v?[0-9]+\.[0-9]+")
+
+
+def is_manifest_cache_enabled():
+    return (
+        environ.get(MANIFEST_CACHE_ENV_VAR, "on") != "off" and get_replay_mode() is None
+    )
+
+
+def is_remote_manifest(source, kustomize=False):
+    if source.startswith("http://") or source.startswith("https://"):
+        return True
+
+    # Remote kustomizations need not have a scheme (e.g. github.com/org/repo)
+    return kustomize and not exists(source) and "/" in source
+
+
+def _get_digest(data):
+    return sha256(data).hexdigest()
+
+
+def _get_cache_paths(source, kustomize):
+    key = _get_digest(f"{'-k' if kustomize else '-f'} {source}".encode("utf-8"))
+    cached_file = join(MANIFEST_CACHE_DIR, f"{key[:16]}.yaml")
+    return cached_file, f"{cached_file}.sha256"
+
+
+def _is_cached_manifest_valid(cached_file, checksum_file):
+    if not exists(cached_file) or not exists(checksum_file):
+        return False
+
+    with open(checksum_file, "r") as fh:
+        expected_digest = fh.read().split(" ")[0].strip()
+    with open(cached_file, "rb") as fh:
+        return _get_digest(fh.read()) == expected_digest
+
+
+def _fetch_manifest(source, kustomize):
+    """
+    Fetch a manifest, or return None if we fail to (we then leave it to
+    kubectl to report the error)
+    """
+    if kustomize:
+        # Render the kustomization once, so that we do not need to resolve it
+        # again (which means cloning its repository)
+        result = run_cmd(f"kubectl kustomize {source}", check=False)
+        if result.returncode != 0:
+            return None
+        return result.stdout.encode("utf-8")
+
+    try:
+        with urlopen(source, timeout=MANIFEST_FETCH_TIMEOUT_SECS) as response:
+            return response.read()
+    except OSError:
+        return None
+
+
+def _write_atomically(path, data):
+    tmp_path = f"{path}.{getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(data)
+    rename(tmp_path, path)
+
+
+def get_cached_manifest(source, kustomize=False):
+    """
+    Return the path to a local copy of a remote (pinned) manifest, or rendered
+    kustomization, fetching it if necessary. If we can not cache it, we return
+    None, and callers should use the remote source
+    """
+    if not is_manifest_cache_enabled() or not is_remote_manifest(source, kustomize):
+        return None
+
+    # Only look for the version in the path, not in the host name
+    url = urlparse(source if "://" in source else f"https://{source}")
+    if _PINNED_VERSION_RE.search(f"{url.path}?{url.query}") is None:
+        return None
+
+    cached_file, checksum_file = _get_cache_paths(source, kustomize)
+    if _is_cached_manifest_valid(cached_file, checksum_file):
+        return cached_file
+
+    with span(f"Fetch manifest: {source}"):
+        data = _fetch_manifest(source, kustomize)
+    if data is None:
+        return None
+
+    makedirs(MANIFEST_CACHE_DIR, exist_ok=True)
+    _write_atomically(cached_file, data)
+    _write_atomically(checksum_file, f"{_get_digest(data)}  {source}\n".encode())
+
+    return cached_file
+
+
+def use_cached_manifests(kubectl_cmd):
+    """
+    Replace the remote manifests (-f <url>) and kustomizations (-k <url>) in a
+    kubectl command by their local copies
+    """
+    parts = kubectl_cmd.split(" ")
+    for idx in range(len(parts) - 1):
+        if parts[idx] not in ["-f", "-k"]:
+            continue
+
+        cached_file = get_cached_manifest(parts[idx + 1], parts[idx] == "-k")
+        if cached_file is not None:
+            parts[idx] = "-f"
+            parts[idx + 1] = cached_file
+
+    return " ".join(parts)
+
+
+def load_manifest_objects(sources):
+    """
+    Parse the k8s objects in a list of manifests (local files or URLs), using
+    our local copies of remote manifests if possible. Returns None if we can
+    not read (or parse) a manifest, and leave it to `kubectl` to report the
+    error
+    """
+    try:
+        from yaml import YAMLError, safe_load_all
+    except ImportError:
+        return None
+
+    objects = []
+    for source in sources:
+        cached_file = get_cached_manifest(source)
+        if cached_file is not None:
+            source = cached_file
+
+        if is_remote_manifest(source):
+            data = _fetch_manifest(source, False)
+        else:
+            try:
+                with open(source, "rb") as fh:
+                    data = fh.read()
+            except OSError:
+                data = None
+        if data is None:
+            return None
+
+        try:
+            docs = list(safe_load_all(data))
+        except YAMLError:
+            return None
+
+        for doc in docs:
+            if not doc:
+                continue
+
+            # Flatten lists of objects (e.g. the output of `kubectl get -o`)
+            if doc.get("kind") == "List":
+                objects += doc.get("items") or []
+            else:
+                objects.append(doc)
+
+    return objects
@@ -1,6 +1,6 @@
 from os import environ
 from os.path import dirname, join
-from subprocess import run
+from tasks.util.cmd import run_cmd
 from tasks.util.docker import build_image
 from tasks.util.env import COCO_ROOT, GHCR_URL, GITHUB_ORG, PROJ_ROOT
 from tasks.util.versions import NYDUS_VERSION
@@ -27,10 +27,8 @@ def nydusify(src_tag, dst_tag):
     work_env["PATH"] = work_env.get("PATH", "") + ":" + dirname(NYDUS_IMAGE_HOST_PATH)
 
     # Note that nydusify automatically pushes the image
-    result = run(
+    run_cmd(
         f"{NYDUSIFY_PATH} convert --source {src_tag} --target {dst_tag}",
-        shell=True,
-        capture_output=True,
         env=work_env,
+        resource="docker-push",
     )
-    assert result.returncode == 0, result.stderr.decode("utf-8").strip()
@@ -1,7 +1,6 @@
-from psutil import process_iter
-
-
 def get_pid(string):
+    from psutil import process_iter
+
     for proc in process_iter():
         if string in proc.name():
             return proc.pid
@@ -0,0 +1,189 @@
+from datetime import datetime
+from json import dumps as json_dumps
+from tasks.util.containerd import get_sandbox_id_from_container
+from tasks.util.env import CONTAINERD_CONFIG_FILE
+from tasks.util.k8s import get_container_id_from_pod
+from tasks.util.k8s_api import get_pods_path, wait_for_k8s_objects
+from tasks.util.toml import read_values_from_toml
+from time import time
+
+# Namespace where we deploy all the demo apps (see demo-apps/)
+SC2_DEMO_NAMESPACE = "sc2-demo"
+
+# Transitions in a pod's lifecycle, in the order in which they happen. For
+# each, we record the first time we see it happen
+POD_LIFECYCLE_EVENTS = [
+    "created",
+    "scheduled",
+    "sandbox_ready",
+    "containers_started",
+    "ready",
+]
+
+# Pod conditions that signal each transition. The sandbox (i.e. the VM, for
+# Kata runtimes) condition was renamed in k8s 1.29
+_CONDITION_EVENTS = {
+    "PodScheduled": "scheduled",
+    "PodReadyToStartContainers": "sandbox_ready",
+    "PodHasNetwork": "sandbox_ready",
+    "Ready": "ready",
+}
+
+# Snapshotter names for each nydus-snapshotter mode (see
+# tasks/nydus_snapshotter.py)
+_SNAPSHOTTER_MODES = {"nydus": "guest-pull", "nydus-hs": "host-share"}
+
+
+def _parse_k8s_timestamp(timestamp):
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+
+def _get_pod_events(pod):
+    """
+    Return the lifecycle events that a pod has gone through, as a dictionary
+    of event name to the (k8s-reported) timestamp. K8s timestamps only have
+    second precision
+    """
+    events = {"created": _parse_k8s_timestamp(pod["metadata"]["creationTimestamp"])}
+    status = pod.get("status", {})
+    for cond in status.get("conditions", []):
+        event = _CONDITION_EVENTS.get(cond["type"])
+        if event is not None and cond["status"] == "True":
+            events[event] = _parse_k8s_timestamp(cond["lastTransitionTime"])
+
+    ctr_statuses = status.get("containerStatuses", [])
+    started_ats = [
+        s.get("state", {}).get("running", {}).get("startedAt") for s in ctr_statuses
+    ]
+    if len(started_ats) > 0 and all(started_ats):
+        events["containers_started"] = max(
+            [_parse_k8s_timestamp(started_at) for started_at in started_ats]
+        )
+
+    return events
+
+
+def get_runtime_snapshotter(runtime_class):
+    """
+    Return the snapshotter mode (or, if not a nydus one, the snapshotter) that
+    containerd uses for a runtime class. Our runtime class names match the
+    runtime names in containerd's config
+    """
+    toml_path = (
+        f'plugins."io.containerd.grpc.v1.cri".containerd.runtimes'
+        f".{runtime_class}.snapshotter"
+    )
+    snapshotter = read_values_from_toml(
+        CONTAINERD_CONFIG_FILE, [toml_path], tolerate_missing=True
+    )[0]
+    return _SNAPSHOTTER_MODES.get(snapshotter, snapshotter)
+
+
+def track_pods(
+    ns=SC2_DEMO_NAMESPACE, num_pods=1, label=None, timeout=None, debug=False
+):
+    """
+    Watch pods in a namespace, and timestamp each transition in their
+    lifecycle, until `num_pods` (not already ready) pods are ready. Returns a
+    list with one record per pod. If we time-out, we return the records that
+    we have, and mark the pods that are not ready with `timed_out`
+
+    We only compare timestamps from the same clock within a record. For pods
+    that we see created, we timestamp each transition when we see it in the
+    watch stream (with sub-second precision). For pods that already existed
+    when we started watching, we use the timestamps that k8s reports (with
+    second precision) for all transitions
+    """
+    records = {}
+    ignored_uids = set()
+    state = {"initial_list": True}
+
+    def on_pods(pods):
+        now = time()
+        for pod in pods:
+            uid = pod["metadata"]["uid"]
+            if uid in ignored_uids:
+                continue
+
+            pod_events = _get_pod_events(pod)
+            is_new = uid not in records
+            if is_new and state["initial_list"] and "ready" in pod_events:
+                # Ignore pods that were ready before we started watching
+                ignored_uids.add(uid)
+                continue
+
+            if is_new:
+                records[uid] = {
+                    "pod": pod["metadata"]["name"],
+                    "namespace": pod["metadata"]["namespace"],
+                    "runtime_class": pod["spec"].get("runtimeClassName", ""),
+                    "container": pod["spec"]["containers"][0]["name"],
+                    # Pods that show up in the watch (i.e. not in the initial
+                    # list) were created (roughly) now
+                    "clock": "k8s" if state["initial_list"] else "watch",
+                    "events": {},
+                }
+
+            record = records[uid]
+            for event, k8s_ts in pod_events.items():
+                if event in record["events"]:
+                    continue
+
+                record["events"][event] = k8s_ts if record["clock"] == "k8s" else now
+                if debug:
+                    print(f"{record['pod']}: {event}")
+
+        state["initial_list"] = False
+        num_ready = len([r for r in records.values() if "ready" in r["events"]])
+        return num_ready >= num_pods
+
+    try:
+        watched = wait_for_k8s_objects(
+            get_pods_path(ns),
+            on_pods,
+            params={"labelSelector": label} if label else None,
+            timeout=timeout,
+        )
+    except RuntimeError:
+        # We have already printed the error, we still return what we have
+        watched = False
+
+    if watched is None:
+        print("ERROR: can not watch pods through the k8s API server")
+        raise RuntimeError("Error tracking pods!")
+
+    # Correlate each pod with its sandbox, and the containerd snapshotter it
+    # used. We do it after the pods are ready, not to delay the watch
+    snapshotters = {}
+    for record in records.values():
+        record["timed_out"] = "ready" not in record["events"]
+
+        runtime_class = record["runtime_class"]
+        if runtime_class not in snapshotters:
+            snapshotters[runtime_class] = get_runtime_snapshotter(runtime_class)
+        record["snapshotter"] = snapshotters[runtime_class]
+
+        # All containers in a pod share the sandbox, so we only need one
+        ctr_id = get_container_id_from_pod(
+            record["pod"], record["container"], ns=record["namespace"]
+        )
+        record["container_id"] = ctr_id
+        record["sandbox_id"] = get_sandbox_id_from_container(ctr_id) if ctr_id else ""
+
+        created_ts = record["events"]["created"]
+        record["latencies_ms"] = {
+            event: round((record["events"][event] - created_ts) * 1000, 1)
+            for event in POD_LIFECYCLE_EVENTS
+            if event in record["events"]
+        }
+
+    return list(records.values())
+
+
+def write_pod_records(records, records_file):
+    """
+    Append the pod records to a file, one JSON object per line
+    """
+    with open(records_file, "a") as fh:
+        for record in records:
+            fh.write(json_dumps(record) + "\n")
@@ -0,0 +1,123 @@
+from functools import wraps
+from json import JSONDecodeError, dump as json_dump, load as json_load
+from os import getpid, makedirs, rename
+from os.path import dirname, exists, expanduser, join
+from tasks.util.replay import get_replay_mode
+from threading import Lock
+from time import time
+
+# Facts about the host (e.g. its IP, or CPU model) are expensive to probe, as
+# we need to fork a process, but rarely change. We cache them per-process and,
+# optionally, on disk, so that they survive across `inv` invocations. On-disk
+# entries are only valid for the boot they were recorded in. When recording or
+# replaying commands (see tasks/util/replay.py) we only cache in memory, so
+# that every probe's command makes it to the recording, and replayed values do
+# not leak into the cache.
+#
+# NOTE: this is the same directory as SC2_CONFIG_DIR in tasks/util/env.py, but
+# we can not import it from there, as tasks/util/env.py uses this module
+PROBE_CACHE_FILE = join(expanduser("~"), ".config", "sc2", "probe_cache.json")
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+
+_CACHE = {}
+_CACHE_LOCK = Lock()
+
+
+def _get_boot_id():
+    try:
+        with open(BOOT_ID_FILE, "r") as fh:
+            return fh.read().strip()
+    except OSError:
+        return ""
+
+
+def _read_disk_cache():
+    if not exists(PROBE_CACHE_FILE):
+        return {}
+
+    try:
+        with open(PROBE_CACHE_FILE, "r") as fh:
+            disk_cache = json_load(fh)
+    except (OSError, JSONDecodeError):
+        return {}
+
+    if disk_cache.get("boot_id") != _get_boot_id():
+        return {}
+
+    return disk_cache.get("probes", {})
+
+
+def _write_disk_cache(probes):
+    makedirs(dirname(PROBE_CACHE_FILE), exist_ok=True)
+    tmp_file = f"{PROBE_CACHE_FILE}.{getpid()}"
+    with open(tmp_file, "w") as fh:
+        json_dump({"boot_id": _get_boot_id(), "probes": probes}, fh)
+    rename(tmp_file, PROBE_CACHE_FILE)
+
+
+def _is_fresh(entry, ttl_secs):
+    return ttl_secs is None or time() - entry["ts"] < ttl_secs
+
+
+def cached_probe(ttl_secs=None, persist=False):
+    """
+    Decorator to cache the (JSON-serialisable) result of a function with no
+    arguments that probes the host
+
+    Parameters:
+    - ttl_secs: how long the cached value is valid for (None means forever)
+    - persist: whether to also cache the value on disk, across processes
+    """
+
+    def decorator(func):
+        probe_name = f"{func.__module__}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper():
+            use_disk = persist and get_replay_mode() is None
+            with _CACHE_LOCK:
+                entry = _CACHE.get(probe_name)
+                if entry is None and use_disk:
+                    entry = _read_disk_cache().get(probe_name)
+                if entry is not None and _is_fresh(entry, ttl_secs):
+                    _CACHE[probe_name] = entry
+                    return entry["value"]
+
+            value = func()
+            entry = {"value": value, "ts": time()}
+            with _CACHE_LOCK:
+                _CACHE[probe_name] = entry
+                if use_disk:
+                    probes = _read_disk_cache()
+                    probes[probe_name] = entry
+                    _write_disk_cache(probes)
+
+            return value
+
+        wrapper.invalidate = lambda: invalidate_probes(probe_name)
+        return wrapper
+
+    return decorator
+
+
+def invalidate_probes(*probe_names):
+    """
+    Invalidate the cached value of the given probes (e.g. after changing the
+    fact that they probe), both in memory and on disk. If no names are given,
+    we invalidate all probes
+    """
+    with _CACHE_LOCK:
+        if len(probe_names) == 0:
+            _CACHE.clear()
+            if exists(PROBE_CACHE_FILE):
+                _write_disk_cache({})
+            return
+
+        for probe_name in probe_names:
+            _CACHE.pop(probe_name, None)
+
+        probes = _read_disk_cache()
+        if any([probe_name in probes for probe_name in probe_names]):
+            for probe_name in probe_names:
+                probes.pop(probe_name, None)
+            _write_disk_cache(probes)
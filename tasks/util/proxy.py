@@ -1,7 +1,8 @@
 from pathlib import Path
 import os
 import json
-from subprocess import run
+from tasks.util.cmd import run_cmd
+from tasks.util.sudo import sudo_makedirs, sudo_write_file
 
 
 def is_proxy_set():
@@ -49,7 +50,7 @@ def configure_containerd_proxy(debug=False):
     proxy_dir = Path("/etc/systemd/system/containerd.service.d")
     proxy_conf = proxy_dir / "proxy.conf"
 
-    run(f"sudo mkdir -p {proxy_dir}", shell=True, check=True)
+    sudo_makedirs(str(proxy_dir))
 
     config_content = """[Service]
 Environment="HTTP_PROXY={HTTP_PROXY}"
@@ -59,14 +60,9 @@ Environment="NO_PROXY={NO_PROXY}"
         **proxy_settings
     )
 
-    run(
-        f"sudo tee {proxy_conf} > /dev/null",
-        shell=True,
-        input=config_content.encode(),
-        check=True,
-    )
+    sudo_write_file(str(proxy_conf), config_content)
 
-    run("sudo systemctl daemon-reload", shell=True, check=True)
+    run_cmd("sudo systemctl daemon-reload")
 
 
 def configure_kubelet_proxy(debug=False):
@@ -79,7 +75,7 @@ def configure_kubelet_proxy(debug=False):
     proxy_dir = Path("/etc/systemd/system/kubelet.service.d")
     proxy_conf = proxy_dir / "proxy.conf"
 
-    run(f"sudo mkdir -p {proxy_dir}", shell=True, check=True)
+    sudo_makedirs(str(proxy_dir))
 
     config_content = """[Service]
 Environment="HTTP_PROXY={HTTP_PROXY}"
@@ -89,14 +85,9 @@ Environment="NO_PROXY={NO_PROXY}"
         **proxy_settings
     )
 
-    run(
-        f"sudo tee {proxy_conf} > /dev/null",
-        shell=True,
-        input=config_content.encode(),
-        check=True,
-    )
+    sudo_write_file(str(proxy_conf), config_content)
 
-    run("sudo systemctl daemon-reload", shell=True, check=True)
+    run_cmd("sudo systemctl daemon-reload")
 
 
 def configure_docker_proxy(debug=False):
@@ -114,7 +105,7 @@ def configure_docker_proxy(debug=False):
     proxy_dir = Path("/etc/systemd/system/docker.service.d")
     proxy_conf = proxy_dir / "proxy.conf"
 
-    run(f"sudo mkdir -p {proxy_dir}", shell=True, check=True)
+    sudo_makedirs(str(proxy_dir))
 
     systemd_content = """[Service]
 Environment="HTTP_PROXY={HTTP_PROXY}"
@@ -124,12 +115,7 @@ Environment="NO_PROXY={NO_PROXY}"
         **proxy_settings
     )
 
-    run(
-        f"sudo tee {proxy_conf} > /dev/null",
-        shell=True,
-        input=systemd_content.encode(),
-        check=True,
-    )
+    sudo_write_file(str(proxy_conf), systemd_content)
 
     # 2. Configure docker daemon.json (preserving existing settings)
     daemon_json_path = Path("/etc/docker/daemon.json")
@@ -161,13 +147,8 @@ Environment="NO_PROXY={NO_PROXY}"
             k: proxy_settings[v] for k, v in daemon_proxy_map.items()
         }
 
-    run(f"sudo mkdir -p {daemon_json_path.parent}", shell=True, check=True)
-    run(
-        f"sudo tee {daemon_json_path} > /dev/null",
-        shell=True,
-        input=json.dumps(daemon_config, indent=2).encode(),
-        check=True,
-    )
+    sudo_makedirs(str(daemon_json_path.parent))
+    sudo_write_file(str(daemon_json_path), json.dumps(daemon_config, indent=2))
 
     # 3. Configure user docker config.json - preserve existing settings
     user_config_dir = Path(os.path.expanduser("~/.docker"))
@@ -204,13 +185,11 @@ Environment="NO_PROXY={NO_PROXY}"
             k: proxy_settings[v] for k, v in user_proxy_map.items()
         }
 
-    run(f"mkdir -p {user_config_dir}", shell=True, check=True)
-    run(
+    run_cmd(f"mkdir -p {user_config_dir}")
+    run_cmd(
         f"tee {user_config_path} > /dev/null",
-        shell=True,
-        input=json.dumps(user_config, indent=2).encode(),
-        check=True,
+        stdin=json.dumps(user_config, indent=2),
     )
 
-    run("sudo systemctl daemon-reload", shell=True, check=True)
-    run("sudo systemctl restart docker", shell=True, check=True)
+    run_cmd("sudo systemctl daemon-reload")
+    run_cmd("sudo systemctl restart docker")
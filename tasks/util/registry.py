@@ -1,6 +1,6 @@
 from os import makedirs
 from os.path import exists, join
-from subprocess import CalledProcessError, run
+from tasks.util.cmd import run_cmd
 from tasks.util.containerd import wait_for_containerd_socket
 from tasks.util.docker import is_ctr_running
 from tasks.util.env import (
@@ -11,8 +11,16 @@ from tasks.util.env import (
     LOCAL_REGISTRY_URL,
     get_node_url,
     print_dotted_line,
+    print_success,
 )
+from tasks.util.host import exists as host_exists
 from tasks.util.kubeadm import run_kubectl_command
+from tasks.util.sudo import (
+    sudo_copy_file,
+    sudo_makedirs,
+    sudo_read_file,
+    sudo_write_file,
+)
 from tasks.util.toml import update_toml
 from tasks.util.versions import REGISTRY_VERSION
 
@@ -46,12 +54,7 @@ def start(debug=False, clean=False):
         if debug:
             print(f"WARNING: stopping registry container: {REGISTRY_CTR_NAME}")
 
-        result = run(
-            f"docker rm -f {REGISTRY_CTR_NAME}", shell=True, capture_output=True
-        )
-        assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-        if debug:
-            print(result.stdout.decode("utf-8").strip())
+        run_cmd(f"docker rm -f {REGISTRY_CTR_NAME}", debug=debug)
 
     # Create certificates for registry
     if not exists(HOST_CERT_DIR):
@@ -69,11 +72,8 @@ def start(debug=False, clean=False):
         "> /dev/null 2>&1",
     ]
     openssl_cmd = " ".join(openssl_cmd)
-    if not exists(HOST_CERT_PATH):
-        result = run(openssl_cmd, shell=True, capture_output=True)
-        assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-        if debug:
-            print(result.stdout.decode("utf-8").strip())
+    if not host_exists(HOST_CERT_PATH):
+        run_cmd(openssl_cmd, debug=debug)
 
     # Start self-hosted local registry with HTTPS
     docker_cmd = [
@@ -91,12 +91,9 @@ def start(debug=False, clean=False):
     ]
     docker_cmd = " ".join(docker_cmd)
     if not is_ctr_running(REGISTRY_CTR_NAME):
-        out = run(docker_cmd, shell=True, capture_output=True)
-        assert out.returncode == 0, "Failed starting docker container: {}".format(
-            out.stderr
-        )
-        if debug:
-            print(out.stdout.decode("utf-8").strip())
+        # Remove the container if it exists but is not running
+        run_cmd(f"docker rm -f {REGISTRY_CTR_NAME}", check=False)
+        run_cmd(docker_cmd, debug=debug, error_msg="Failed starting docker container!")
     else:
         if debug:
             print("WARNING: skipping starting container as it is already running...")
@@ -107,12 +104,7 @@ def start(debug=False, clean=False):
 
     # Add DNS entry (careful to be able to sudo-edit the file)
     dns_file = "/etc/hosts"
-    dns_contents = (
-        run("sudo cat {}".format(dns_file), shell=True, capture_output=True)
-        .stdout.decode("utf-8")
-        .strip()
-        .split("\n")
-    )
+    dns_contents = sudo_read_file(dns_file).decode("utf-8").strip().split("\n")
 
     # Only write the DNS entry if it is not there yet
     dns_line = "{} {}".format(this_ip, LOCAL_REGISTRY_URL)
@@ -120,24 +112,15 @@ def start(debug=False, clean=False):
 
     if must_write:
         actual_dns_line = "\n# SC2: DNS entry for local registry\n{}".format(dns_line)
-        write_cmd = "sudo sh -c \"echo '{}' >> {}\"".format(actual_dns_line, dns_file)
-        run(write_cmd, shell=True, check=True)
+        sudo_write_file(dns_file, actual_dns_line + "\n", append=True)
 
         # If creating a new registry, also update the local SSL certificates
         system_cert_path = "/usr/share/ca-certificates/sc2_registry.crt"
-        run(
-            "sudo cp {} {}".format(HOST_CERT_PATH, system_cert_path),
-            shell=True,
-            check=True,
-        )
-        result = run(
+        sudo_copy_file(HOST_CERT_PATH, system_cert_path)
+        run_cmd(
             "sudo DEBIAN_FRONTEND=noninteractive dpkg-reconfigure ca-certificates",
-            shell=True,
-            capture_output=True,
+            debug=debug,
         )
-        assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-        if debug:
-            print(result.stdout.decode("utf-8").strip())
 
     # ----------
     # dockerd config
@@ -145,14 +128,11 @@ def start(debug=False, clean=False):
 
     # Configure docker to be able to push to this registry
     docker_certs_dir = join("/etc/docker/certs.d", LOCAL_REGISTRY_URL)
-    run("sudo mkdir -p {}".format(docker_certs_dir), shell=True, check=True)
-
-    docker_ca_cert_file = join(docker_certs_dir, "ca.crt")
-    cp_cmd = "sudo cp {} {}".format(HOST_CERT_PATH, docker_ca_cert_file)
-    run(cp_cmd, shell=True, check=True)
+    sudo_makedirs(docker_certs_dir)
+    sudo_copy_file(HOST_CERT_PATH, join(docker_certs_dir, "ca.crt"))
 
     # Re-start docker to pick up the new certificates
-    run("sudo service docker restart", shell=True, check=True)
+    run_cmd("sudo service docker restart", debug=debug)
 
     # ----------
     # containerd config
@@ -169,7 +149,7 @@ def start(debug=False, clean=False):
 
     # Add the correspnding configuration to containerd
     containerd_certs_dir = join(containerd_base_certs_dir, LOCAL_REGISTRY_URL)
-    run(f"sudo mkdir -p {containerd_certs_dir}", shell=True, check=True)
+    sudo_makedirs(containerd_certs_dir)
 
     containerd_cert_path = join(containerd_certs_dir, "sc2_registry.crt")
     containerd_certs_file = """
@@ -181,19 +161,12 @@ ca = "{containerd_cert_path}"
 """.format(
         registry_url=LOCAL_REGISTRY_URL, containerd_cert_path=containerd_cert_path
     )
-
-    cmd = """
-sudo sh -c 'cat <<EOF > {destination_file}
-{file_contents}
-EOF'
-""".format(
-        destination_file=join(containerd_certs_dir, "hosts.toml"),
-        file_contents=containerd_certs_file.strip(),
+    sudo_write_file(
+        join(containerd_certs_dir, "hosts.toml"), containerd_certs_file.strip() + "\n"
     )
-    run(cmd, shell=True, check=True)
 
     # Copy the certificate to the corresponding containerd directory
-    run(f"sudo cp {HOST_CERT_PATH} {containerd_cert_path}", shell=True, check=True)
+    sudo_copy_file(HOST_CERT_PATH, containerd_cert_path)
 
     # ----------
     # Kata config
@@ -218,7 +191,7 @@ EOF'
     # the configuration of Knative to the Knative install script.
     # ----------
 
-    print("Success!")
+    print_success()
 
 
 def stop(debug=False):
@@ -227,13 +200,10 @@ def stop(debug=False):
     kube_cmd = "-n knative-serving delete secret {}".format(K8S_SECRET_NAME)
     try:
         run_kubectl_command(kube_cmd, capture_output=not debug)
-    except CalledProcessError:
+    except RuntimeError:
         print("WARNING: deleting knative-serving secret failed")
 
     # For Kata and containerd, all configuration is reversible, so we only
     # need to sop the container image
     docker_cmd = "docker rm -f {}".format(REGISTRY_CTR_NAME)
-    result = run(docker_cmd, shell=True, capture_output=True)
-    assert result.returncode == 0, print(result.stderr.decode("utf-8").strip())
-    if debug:
-        print(result.stdout.decode("utf-8").strip())
+    run_cmd(docker_cmd, debug=debug)
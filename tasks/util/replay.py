@@ -0,0 +1,371 @@
+from asyncio import sleep as async_sleep
+from atexit import register as atexit_register
+from functools import wraps
+from json import dump as json_dump, dumps as json_dumps, load as json_load
+from os import environ
+from os.path import dirname, expanduser, realpath
+from re import compile as regex_compile, escape as regex_escape
+from tasks.util import sudo
+from threading import Lock
+from time import sleep, time
+import subprocess
+
+# Set one of these environment variables to a file path to record all the
+# external commands (and privileged file operations) that a run of `inv`
+# executes, as well as the facts about the host that tasks read directly (see
+# tasks/util/host.py), or to replay them from a previous recording. In replay
+# mode we do not run anything, we return the recorded output after sleeping for
+# the recorded wall time, multiplied by SC2_REPLAY_TIME_SCALE (0 means no sleep).
+# This allows profiling the orchestration logic in tasks without SNP/TDX
+# hardware, or even docker and k8s
+RECORD_FILE_ENV_VAR = "SC2_RECORD_FILE"
+REPLAY_FILE_ENV_VAR = "SC2_REPLAY_FILE"
+REPLAY_TIME_SCALE_ENV_VAR = "SC2_REPLAY_TIME_SCALE"
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# Commands may include random bits (e.g. container names with a UUID, or the
+# paths of temporary directories) that change between runs, so we mask them
+# when matching a command against the recording
+_VOLATILE_PATTERNS = [
+    (regex_compile(r"/tmp/tmp[a-z0-9_]+"), "<tmp>"),
+    (regex_compile(r"[0-9a-f]{8,}"), "<hex>"),
+]
+
+# Commands also include paths that depend on the host (i.e. where we have
+# checked out this repo, and the user's home directory), so we mask them too,
+# to be able to replay a recording on a different host. We mask the repo's
+# root first, as it is often inside the home directory
+#
+# NOTE: this is the same as PROJ_ROOT in tasks/util/env.py, but we can not
+# import it from there, as tasks/util/env.py (indirectly) uses this module
+_PROJ_ROOT = dirname(dirname(dirname(realpath(__file__))))
+_HOST_PATTERNS = [
+    (regex_compile(r"(?<![\w/.-]){}(?![\w.-])".format(regex_escape(path))), mask)
+    for path, mask in [(_PROJ_ROOT, "<proj>"), (expanduser("~"), "<home>")]
+    if path != "/"
+]
+
+_STATE = {"mode": None, "file": None, "time_scale": 1.0}
+_ENTRIES = []
+_REPLAY_ENTRIES = {}
+_ENTRIES_LOCK = Lock()
+_ORIGINAL_RUN = subprocess.run
+_ORIGINAL_SEND_REQUEST = sudo._send_request
+
+
+def get_replay_mode():
+    """
+    Return MODE_RECORD or MODE_REPLAY if we are recording or replaying
+    commands, and None otherwise
+    """
+    return _STATE["mode"]
+
+
+def _get_key(kind, cmd):
+    if not isinstance(cmd, str):
+        cmd = " ".join([str(c) for c in cmd])
+
+    for pattern, replacement in _HOST_PATTERNS + _VOLATILE_PATTERNS:
+        cmd = pattern.sub(replacement, cmd)
+
+    return f"{kind}:{cmd.strip()}"
+
+
+def _record(entry):
+    with _ENTRIES_LOCK:
+        _ENTRIES.append(entry)
+
+
+def _replay(key):
+    """
+    Pop the next recorded entry for a key. If we have replayed all of them,
+    we keep returning the last one (e.g. if we poll for a condition more
+    times than in the recording)
+    """
+    with _ENTRIES_LOCK:
+        entries = _REPLAY_ENTRIES.get(key)
+        if entries is None:
+            print(f"ERROR: no recording for: {key}")
+            print(f"ERROR: recording file: {_STATE['file']}")
+            raise RuntimeError("Command not found in recording!")
+
+        entry = entries[0]
+        if len(entries) > 1:
+            entries.pop(0)
+
+    return entry
+
+
+def _get_replay_delay(entry):
+    return entry["duration"] * _STATE["time_scale"]
+
+
+def _decode(output):
+    if isinstance(output, bytes):
+        # Use surrogateescape so that we can recover the original bytes
+        return output.decode("utf-8", errors="surrogateescape")
+
+    return output
+
+
+def _encode(output):
+    return output.encode("utf-8", errors="surrogateescape")
+
+
+def _replay_cmd_result(entry, cmd, timeout, debug):
+    if entry.get("timed_out"):
+        raise subprocess.TimeoutExpired(cmd, timeout)
+
+    if debug:
+        print(entry["stdout"], end="", flush=True)
+        print(entry["stderr"], end="", flush=True)
+
+    return entry["returncode"], entry["stdout"], entry["stderr"]
+
+
+def replay_cmd(run_once):
+    """
+    Decorator for the function that runs a command in `tasks.util.cmd` to
+    record or replay its results. The decorated function must take the
+    arguments (cmd, cwd, env, stdin, timeout, debug), and return a tuple
+    (returncode, stdout, stderr)
+    """
+
+    @wraps(run_once)
+    def wrapper(cmd, cwd, env, stdin, timeout, debug):
+        if _STATE["mode"] is None:
+            return run_once(cmd, cwd, env, stdin, timeout, debug)
+
+        key = _get_key("cmd", cmd)
+        if _STATE["mode"] == MODE_REPLAY:
+            entry = _replay(key)
+            sleep(_get_replay_delay(entry))
+            return _replay_cmd_result(entry, cmd, timeout, debug)
+
+        entry = {"key": key, "cmd": cmd}
+        start_ts = time()
+        try:
+            returncode, stdout, stderr = run_once(cmd, cwd, env, stdin, timeout, debug)
+        except subprocess.TimeoutExpired:
+            _record({**entry, "timed_out": True, "duration": time() - start_ts})
+            raise
+
+        entry.update(returncode=returncode, stdout=stdout, stderr=stderr)
+        _record({**entry, "duration": time() - start_ts})
+        return returncode, stdout, stderr
+
+    return wrapper
+
+
+def replay_cmd_async(run_once):
+    """
+    Same as `replay_cmd`, for the async function that runs a command in
+    `tasks.util.aio`
+    """
+
+    @wraps(run_once)
+    async def wrapper(cmd, cwd, env, stdin, timeout, debug):
+        if _STATE["mode"] is None:
+            return await run_once(cmd, cwd, env, stdin, timeout, debug)
+
+        key = _get_key("cmd", cmd)
+        if _STATE["mode"] == MODE_REPLAY:
+            entry = _replay(key)
+            await async_sleep(_get_replay_delay(entry))
+            return _replay_cmd_result(entry, cmd, timeout, debug)
+
+        entry = {"key": key, "cmd": cmd}
+        start_ts = time()
+        try:
+            returncode, stdout, stderr = await run_once(
+                cmd, cwd, env, stdin, timeout, debug
+            )
+        except subprocess.TimeoutExpired:
+            _record({**entry, "timed_out": True, "duration": time() - start_ts})
+            raise
+
+        entry.update(returncode=returncode, stdout=stdout, stderr=stderr)
+        _record({**entry, "duration": time() - start_ts})
+        return returncode, stdout, stderr
+
+    return wrapper
+
+
+def replay_host_fact(func):
+    """
+    Decorator for a function that reads a fact about the host without running
+    a command (e.g. the kernel version, or whether a file exists), to record
+    or replay its (JSON-serialisable) result, or the OSError that it raises.
+    We match calls by function name and arguments
+    """
+
+    @wraps(func)
+    def wrapper(*args):
+        if _STATE["mode"] is None:
+            return func(*args)
+
+        key = _get_key("host", f"{func.__name__} {json_dumps(args)}")
+        if _STATE["mode"] == MODE_REPLAY:
+            entry = _replay(key)
+            sleep(_get_replay_delay(entry))
+            if "errno" in entry:
+                raise OSError(entry["errno"], entry["error"], entry["filename"])
+
+            return entry["result"]
+
+        start_ts = time()
+        try:
+            result = func(*args)
+        except OSError as e:
+            _record(
+                {
+                    "key": key,
+                    "errno": e.errno,
+                    "error": e.strerror or str(e),
+                    "filename": e.filename,
+                    "duration": time() - start_ts,
+                }
+            )
+            raise
+
+        _record({"key": key, "result": result, "duration": time() - start_ts})
+        return result
+
+    return wrapper
+
+
+def replay_run(*args, **kwargs):
+    """
+    Drop-in replacement for `subprocess.run` that records or replays commands.
+    We can only record the output of commands that capture it
+    """
+    cmd = args[0] if len(args) > 0 else kwargs["args"]
+    key = _get_key("run", cmd)
+    check = kwargs.pop("check", False)
+    capture_stdout = (
+        kwargs.get("capture_output", False) or kwargs.get("stdout") == subprocess.PIPE
+    )
+    capture_stderr = (
+        kwargs.get("capture_output", False) or kwargs.get("stderr") == subprocess.PIPE
+    )
+
+    if _STATE["mode"] == MODE_REPLAY:
+        entry = _replay(key)
+        sleep(_get_replay_delay(entry))
+        if entry.get("timed_out"):
+            raise subprocess.TimeoutExpired(cmd, kwargs.get("timeout"))
+
+        is_text = any(
+            [kwargs.get(k) for k in ["text", "universal_newlines", "encoding"]]
+        )
+        stdout, stderr = entry["stdout"], entry["stderr"]
+        if not is_text:
+            stdout = _encode(stdout) if stdout is not None else None
+            stderr = _encode(stderr) if stderr is not None else None
+        result = subprocess.CompletedProcess(
+            cmd,
+            entry["returncode"],
+            stdout if capture_stdout else None,
+            stderr if capture_stderr else None,
+        )
+    else:
+        start_ts = time()
+        try:
+            result = _ORIGINAL_RUN(*args, **kwargs)
+        except subprocess.TimeoutExpired:
+            _record({"key": key, "timed_out": True, "duration": time() - start_ts})
+            raise
+
+        _record(
+            {
+                "key": key,
+                "cmd": cmd,
+                "returncode": result.returncode,
+                "stdout": _decode(result.stdout) if capture_stdout else None,
+                "stderr": _decode(result.stderr) if capture_stderr else None,
+                "duration": time() - start_ts,
+            }
+        )
+
+    if check:
+        result.check_returncode()
+
+    return result
+
+
+def replay_send_request(request):
+    """
+    Drop-in replacement for `tasks.util.sudo._send_request` that records or
+    replays privileged file operations
+    """
+    # We do not match on the data that we write, as it is often too large,
+    # but we still want to tell appends from overwrites
+    args = {k: v for k, v in request["args"].items() if k != "data"}
+    if "files" in args:
+        args["files"] = sorted(args["files"])
+    key = _get_key("sudo", f"{request['op']} {json_dumps(args, sort_keys=True)}")
+
+    if _STATE["mode"] == MODE_REPLAY:
+        entry = _replay(key)
+        sleep(_get_replay_delay(entry))
+        return entry["response"]
+
+    start_ts = time()
+    response = _ORIGINAL_SEND_REQUEST(request)
+    _record({"key": key, "response": response, "duration": time() - start_ts})
+    return response
+
+
+def _write_recording():
+    with _ENTRIES_LOCK:
+        entries = list(_ENTRIES)
+
+    with open(_STATE["file"], "w") as fh:
+        json_dump({"entries": entries}, fh, indent=2)
+
+    print(f"Recorded {len(entries)} commands to: {_STATE['file']}")
+
+
+def _load_recording(replay_file):
+    with open(replay_file, "r") as fh:
+        entries = json_load(fh)["entries"]
+
+    for entry in entries:
+        _REPLAY_ENTRIES.setdefault(entry["key"], []).append(entry)
+
+
+def enable_replay(mode, replay_file, time_scale=1.0):
+    """
+    Enable recording or replaying commands for the current process
+
+    Like with tracing, we replace `subprocess.run`, so we must call this
+    method before any task module does `from subprocess import run` (i.e. when
+    `tasks` is first imported)
+    """
+    if _STATE["mode"] is not None:
+        return
+
+    if mode not in [MODE_RECORD, MODE_REPLAY]:
+        print(f"ERROR: unrecognised replay mode: {mode}")
+        raise RuntimeError("Unrecognised replay mode!")
+
+    if mode == MODE_REPLAY:
+        _load_recording(replay_file)
+    else:
+        atexit_register(_write_recording)
+
+    _STATE.update(mode=mode, file=replay_file, time_scale=time_scale)
+    subprocess.run = replay_run
+    sudo._send_request = replay_send_request
+
+
+if environ.get(RECORD_FILE_ENV_VAR):
+    enable_replay(MODE_RECORD, environ[RECORD_FILE_ENV_VAR])
+elif environ.get(REPLAY_FILE_ENV_VAR):
+    enable_replay(
+        MODE_REPLAY,
+        environ[REPLAY_FILE_ENV_VAR],
+        float(environ.get(REPLAY_TIME_SCALE_ENV_VAR, 1.0)),
+    )
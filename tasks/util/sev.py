@@ -1,13 +1,31 @@
 from json import loads as json_loads
 from os.path import join
 from re import sub as regex_sub
-from sevsnpmeasure import guest
-from sevsnpmeasure.sev_mode import SevMode
-from sevsnpmeasure.vmm_types import VMMType
-from sevsnpmeasure.vcpu_types import cpu_sig as sev_snp_cpu_sig
-from subprocess import run
+from tasks.util.cmd import run_cmd
 from tasks.util.env import KATA_CONFIG_DIR, KBS_PORT, get_node_url
-from tasks.util.toml import read_value_from_toml
+from tasks.util.probe import cached_probe
+from tasks.util.toml import read_values_from_toml
+
+
+# The CPU signature can not change without a reboot
+@cached_probe(persist=True)
+def get_cpu_signature_fields():
+    """
+    Get the CPU family, model, and stepping, as reported by `lscpu`
+    """
+    cpu_json = json_loads(run_cmd("lscpu --json").stdout.strip())
+    cpu_fields = {"CPU family:": None, "Model:": None, "Stepping:": None}
+    for field in cpu_fields:
+        data = next(
+            filter(
+                lambda _dict: _dict["field"] == field,
+                [entry for entry in cpu_json["lscpu"]],
+            ),
+            None,
+        )["data"]
+        cpu_fields[field] = data
+
+    return cpu_fields
 
 
 def get_kernel_append():
@@ -25,8 +43,9 @@ def get_kernel_append():
     qemu_proc=$(ps aux | grep qemu | grep append)
     """
     toml_path = join(KATA_CONFIG_DIR, "configuration-qemu-sev.toml")
-    agent_log = read_value_from_toml(toml_path, "agent.kata.enable_debug")
-    debug_console = read_value_from_toml(toml_path, "agent.kata.debug_console_enabled")
+    agent_log, debug_console = read_values_from_toml(
+        toml_path, ["agent.kata.enable_debug", "agent.kata.debug_console_enabled"]
+    )
     kernel_append = [
         "tsc=reliable no_timer_check rcupdate.rcu_expedited=1 i8042.direct=1",
         "i8042.dumbkbd=1 i8042.nopnp=1 i8042.noaux=1 noreplace-smp reboot=k",
@@ -51,23 +70,13 @@ def get_launch_digest(mode):
     """
     Calculate the SEV launch digest from configuration files
     """
+    from sevsnpmeasure import guest
+    from sevsnpmeasure.sev_mode import SevMode
+    from sevsnpmeasure.vmm_types import VMMType
+    from sevsnpmeasure.vcpu_types import cpu_sig as sev_snp_cpu_sig
+
     # Get CPU information
-    cpu_json_str = (
-        run("lscpu --json", shell=True, check=True, capture_output=True)
-        .stdout.decode("utf-8")
-        .strip()
-    )
-    cpu_json = json_loads(cpu_json_str)
-    cpu_fields = {"CPU family:": None, "Model:": None, "Stepping:": None}
-    for field in cpu_fields:
-        data = next(
-            filter(
-                lambda _dict: _dict["field"] == field,
-                [entry for entry in cpu_json["lscpu"]],
-            ),
-            None,
-        )["data"]
-        cpu_fields[field] = data
+    cpu_fields = get_cpu_signature_fields()
     cpu_sig = sev_snp_cpu_sig(
         int(cpu_fields["CPU family:"]),
         int(cpu_fields["Model:"]),
@@ -77,14 +86,24 @@ def get_launch_digest(mode):
     # Pick the right configuration file
     toml_path = join(KATA_CONFIG_DIR, "configuration-qemu-{}.toml".format(mode))
 
+    vcpus, ovmf_file, kernel, initrd = read_values_from_toml(
+        toml_path,
+        [
+            "hypervisor.qemu.default_vcpus",
+            "hypervisor.qemu.firmware",
+            "hypervisor.qemu.kernel",
+            "hypervisor.qemu.initrd",
+        ],
+    )
+
     # Finally, calculate the launch digest
     ld = guest.calc_launch_digest(
         mode=SevMode.SEV,
-        vcpus=read_value_from_toml(toml_path, "hypervisor.qemu.default_vcpus"),
+        vcpus=vcpus,
         vcpu_sig=cpu_sig,
-        ovmf_file=read_value_from_toml(toml_path, "hypervisor.qemu.firmware"),
-        kernel=read_value_from_toml(toml_path, "hypervisor.qemu.kernel"),
-        initrd=read_value_from_toml(toml_path, "hypervisor.qemu.initrd"),
+        ovmf_file=ovmf_file,
+        kernel=kernel,
+        initrd=initrd,
         append=get_kernel_append(),
         vmm_type=VMMType.QEMU,
     )
@@ -1,14 +1,14 @@
 from base64 import b64encode
 from json import loads as json_loads
-from os.path import exists, join
-from pymysql.err import IntegrityError
-from subprocess import run
+from os.path import join
+from tasks.util.cmd import run_cmd
 from tasks.util.cosign import sign_container_image
 from tasks.util.env import CONF_FILES_DIR, K8S_CONFIG_DIR
 from tasks.util.guest_components import (
     start_coco_keyprovider,
     stop_coco_keyprovider,
 )
+from tasks.util.host import exists
 from tasks.util.kbs import create_kbs_secret
 from tasks.util.versions import SKOPEO_VERSION
 
@@ -34,21 +34,19 @@ def run_skopeo_cmd(cmd, capture_stdout=False):
     ]
     skopeo_cmd = " ".join(skopeo_cmd)
     if capture_stdout:
-        return (
-            run(skopeo_cmd, shell=True, capture_output=True)
-            .stdout.decode("utf-8")
-            .strip()
-        )
+        return run_cmd(skopeo_cmd, check=False).stdout.strip()
     else:
-        run(skopeo_cmd, shell=True, check=True)
+        run_cmd(skopeo_cmd, debug=True)
 
 
 def create_encryption_key():
     cmd = "head -c32 < /dev/random > {}".format(SKOPEO_ENCRYPTION_KEY)
-    run(cmd, shell=True, check=True)
+    run_cmd(cmd)
 
 
 def encrypt_container_image(image_tag, sign=False):
+    from pymysql.err import IntegrityError
+
     encryption_key_resource_id = "default/image-encryption-key/1"
     if not exists(SKOPEO_ENCRYPTION_KEY):
         create_encryption_key()
@@ -0,0 +1,396 @@
+from atexit import register as atexit_register
+from base64 import b64decode, b64encode
+from json import dumps as json_dumps, loads as json_loads
+from os import (
+    chmod,
+    chown,
+    fsync,
+    getpid,
+    getuid,
+    kill,
+    makedirs,
+    remove,
+    rename,
+    rmdir,
+    stat,
+    symlink,
+    umask,
+)
+from os.path import abspath, dirname, exists, isdir, islink, join
+from shutil import copy, rmtree
+from socket import (
+    AF_UNIX,
+    SO_PEERCRED,
+    SOCK_STREAM,
+    SOL_SOCKET,
+    socket,
+    timeout as SocketTimeout,
+)
+from struct import unpack
+from subprocess import Popen
+from tempfile import mkdtemp
+from threading import Lock
+from time import sleep, time
+import sys
+
+# This module implements a privileged helper: a root process that we start
+# (with `sudo`) once per `inv` invocation, and that performs file operations
+# on root-owned paths on our behalf. We talk to it over a unix socket, with
+# one JSON object per line. This saves us from forking one `sudo` process per
+# file operation.
+#
+# NOTE: this file is also executed as a script (as root) to start the helper,
+# so it must only import modules from the standard library
+
+HELPER_START_TIMEOUT_SECS = 60
+
+_HELPER = {"proc": None, "conn": None, "reader": None}
+_HELPER_LOCK = Lock()
+
+# ----------
+# File operations (run in the helper process)
+# ----------
+
+
+def _do_read_file(path):
+    with open(path, "rb") as fh:
+        return b64encode(fh.read()).decode("utf-8")
+
+
+def _do_write_file(path, data, append):
+    data = b64decode(data)
+    if append:
+        with open(path, "ab") as fh:
+            fh.write(data)
+        return
+
+    # Write to a temporary file in the same directory, and rename it in place,
+    # so that readers never see a half-written file. We keep the ownership and
+    # permissions of the file we replace
+    tmp_path = join(dirname(path), ".{}.sc2-tmp".format(path.split("/")[-1]))
+    with open(tmp_path, "wb") as fh:
+        fh.write(data)
+        fh.flush()
+        fsync(fh.fileno())
+    if exists(path):
+        stat_info = stat(path)
+        chmod(tmp_path, stat_info.st_mode)
+        chown(tmp_path, stat_info.st_uid, stat_info.st_gid)
+    else:
+        chmod(tmp_path, 0o644)
+    rename(tmp_path, path)
+
+
+def _do_read_files(paths):
+    return {path: _do_read_file(path) for path in paths}
+
+
+def _do_write_files(files):
+    for path, data in files.items():
+        _do_write_file(path, data, False)
+
+
+def _do_copy_file(src, dst, uid, gid):
+    copy(src, dst)
+    if uid is not None and gid is not None:
+        chown(dst, uid, gid)
+
+
+def _do_makedirs(path):
+    makedirs(path, exist_ok=True)
+
+
+def _do_remove(path, recursive):
+    if not islink(path) and not exists(path):
+        return
+
+    if recursive and isdir(path) and not islink(path):
+        rmtree(path)
+    else:
+        remove(path)
+
+
+def _do_symlink(src, dst):
+    if islink(dst) or exists(dst):
+        remove(dst)
+    symlink(src, dst)
+
+
+def _do_probe_unix_socket(path, timeout):
+    with socket(AF_UNIX, SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+
+    return True
+
+
+_OPS = {
+    "read_file": _do_read_file,
+    "write_file": _do_write_file,
+    "read_files": _do_read_files,
+    "write_files": _do_write_files,
+    "copy_file": _do_copy_file,
+    "makedirs": _do_makedirs,
+    "remove": _do_remove,
+    "symlink": _do_symlink,
+    "probe_unix_socket": _do_probe_unix_socket,
+}
+
+
+def _handle_request(request):
+    try:
+        result = _OPS[request["op"]](**request["args"])
+        return {"ok": True, "result": result}
+    except OSError as e:
+        return {
+            "ok": False,
+            "errno": e.errno,
+            "error": e.strerror or str(e),
+            "filename": e.filename,
+        }
+    except Exception as e:
+        return {"ok": False, "errno": None, "error": repr(e), "filename": None}
+
+
+def _is_process_alive(pid):
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+
+    return True
+
+
+def _serve(socket_path, client_uid, client_pid):
+    """
+    Serve requests from the client until it asks us to stop, or it dies
+    """
+    server = socket(AF_UNIX, SOCK_STREAM)
+    prev_umask = umask(0o177)
+    server.bind(socket_path)
+    umask(prev_umask)
+    chown(socket_path, client_uid, -1)
+    server.listen(1)
+    server.settimeout(1)
+
+    must_stop = False
+    while not must_stop and _is_process_alive(client_pid):
+        try:
+            conn, _ = server.accept()
+        except SocketTimeout:
+            continue
+
+        # Only serve requests from the user that started us
+        creds = conn.getsockopt(SOL_SOCKET, SO_PEERCRED, 12)
+        _, peer_uid, _ = unpack("3i", creds)
+        if peer_uid not in [0, client_uid]:
+            conn.close()
+            continue
+
+        conn.settimeout(None)
+        with conn, conn.makefile("rb") as reader:
+            for line in reader:
+                request = json_loads(line)
+                if request["op"] == "shutdown":
+                    must_stop = True
+                    conn.sendall(b'{"ok": true, "result": null}\n')
+                    break
+
+                response = _handle_request(request)
+                conn.sendall(json_dumps(response).encode("utf-8") + b"\n")
+
+    server.close()
+    remove(socket_path)
+    rmdir(dirname(socket_path))
+
+
+# ----------
+# Client
+# ----------
+
+
+def _stop_helper():
+    if _HELPER["conn"] is None:
+        return
+
+    try:
+        _HELPER["conn"].sendall(b'{"op": "shutdown", "args": {}}\n')
+        _HELPER["reader"].readline()
+    except OSError:
+        pass
+    _HELPER["reader"].close()
+    _HELPER["conn"].close()
+    _HELPER["proc"].wait()
+    _HELPER["conn"] = None
+
+
+def _start_helper():
+    socket_dir = mkdtemp(prefix="sc2-sudo-")
+    socket_path = join(socket_dir, "helper.sock")
+    proc = Popen(
+        [
+            "sudo",
+            sys.executable,
+            abspath(__file__),
+            socket_path,
+            str(getuid()),
+            str(getpid()),
+        ]
+    )
+
+    start_ts = time()
+    while True:
+        if proc.poll() is not None:
+            rmtree(socket_dir, ignore_errors=True)
+            print(f"ERROR: privileged helper exited with code {proc.returncode}")
+            raise RuntimeError("Error starting privileged helper!")
+
+        if exists(socket_path):
+            conn = socket(AF_UNIX, SOCK_STREAM)
+            try:
+                conn.connect(socket_path)
+                break
+            except (ConnectionRefusedError, FileNotFoundError, PermissionError):
+                conn.close()
+
+        if time() - start_ts > HELPER_START_TIMEOUT_SECS:
+            # The helper runs as root, so we may not be able to kill it. If
+            # so, it will exit on its own once we do
+            try:
+                proc.kill()
+            except PermissionError:
+                pass
+            rmtree(socket_dir, ignore_errors=True)
+            print(
+                "ERROR: timed-out waiting for privileged helper to start "
+                f"(timeout: {HELPER_START_TIMEOUT_SECS}s)"
+            )
+            raise RuntimeError("Timed-out starting privileged helper!")
+
+        sleep(0.05)
+
+    _HELPER["proc"] = proc
+    _HELPER["conn"] = conn
+    _HELPER["reader"] = conn.makefile("rb")
+    atexit_register(_stop_helper)
+
+
+def _send_request(request):
+    """
+    Send a request to the privileged helper (or handle it in-process if we are
+    already root), and return its response
+    """
+    if getuid() == 0:
+        return _handle_request(request)
+
+    with _HELPER_LOCK:
+        if _HELPER["conn"] is None:
+            _start_helper()
+
+        _HELPER["conn"].sendall(json_dumps(request).encode("utf-8") + b"\n")
+        response = _HELPER["reader"].readline()
+        if not response:
+            print("ERROR: lost connection to privileged helper")
+            raise RuntimeError("Privileged helper died!")
+
+        return json_loads(response)
+
+
+def _call(op, **kwargs):
+    """
+    Run a file operation as root. If we are already root we run it in-process,
+    otherwise we send it to the privileged helper (starting it if necessary)
+    """
+    response = _send_request({"op": op, "args": kwargs})
+    if not response["ok"]:
+        if response["errno"] is not None:
+            # OSError picks the right sub-class (e.g. FileNotFoundError) from
+            # the errno value
+            raise OSError(response["errno"], response["error"], response["filename"])
+
+        print(f"ERROR: privileged helper failed running {op}: {response['error']}")
+        raise RuntimeError("Error running privileged file operation!")
+
+    return response["result"]
+
+
+def sudo_read_file(path):
+    """
+    Read the contents (as bytes) of a root-owned file
+    """
+    return b64decode(_call("read_file", path=path))
+
+
+def sudo_write_file(path, data, append=False):
+    """
+    Write (or append) data, as a string or bytes, to a root-owned file
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    _call("write_file", path=path, data=b64encode(data).decode("utf-8"), append=append)
+
+
+def sudo_read_files(paths):
+    """
+    Read the contents (as bytes) of many root-owned files, in one request to
+    the privileged helper. Returns a dictionary of path to contents
+    """
+    contents = _call("read_files", paths=list(paths))
+    return {path: b64decode(data) for path, data in contents.items()}
+
+
+def sudo_write_files(files):
+    """
+    Write many root-owned files (given as a dictionary of path to string or
+    bytes), in one request to the privileged helper. Each file is replaced
+    atomically, but we stop at the first file that we fail to write
+    """
+    encoded_files = {}
+    for path, data in files.items():
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        encoded_files[path] = b64encode(data).decode("utf-8")
+
+    _call("write_files", files=encoded_files)
+
+
+def sudo_copy_file(src, dst, uid=None, gid=None):
+    """
+    Copy a file as root, optionally changing the owner of the copy (e.g. to
+    get a user-owned copy of a root-owned file)
+    """
+    _call("copy_file", src=src, dst=dst, uid=uid, gid=gid)
+
+
+def sudo_makedirs(path):
+    _call("makedirs", path=path)
+
+
+def sudo_remove(path, recursive=False):
+    """
+    Remove a file (or a directory tree if recursive is set). This method
+    returns silently if the path does not exist
+    """
+    _call("remove", path=path, recursive=recursive)
+
+
+def sudo_symlink(src, dst):
+    """
+    Create (or replace) a symbolic link at dst pointing to src
+    """
+    _call("symlink", src=src, dst=dst)
+
+
+def sudo_probe_unix_socket(path, timeout):
+    """
+    Return True if we can connect to a (root-owned) unix socket
+    """
+    return _call("probe_unix_socket", path=path, timeout=timeout)
+
+
+if __name__ == "__main__":
+    _serve(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
@@ -1,13 +1,30 @@
-from re import findall
-from os import getuid, getgid, remove, stat
-from os.path import basename, join
-from subprocess import run
+from contextlib import contextmanager
+from copy import deepcopy
+from json import dumps as json_dumps, loads as json_loads
+from os import getpid, rename, stat
+from re import compile as regex_compile, findall
+from tasks.util.inotify import wait_for_files
+from tasks.util.replay import get_replay_mode
+from tasks.util.sudo import sudo_read_files, sudo_write_files
+from tasks.util.tracing import span
+from threading import Lock
+from time import time
 from toml import (
-    dump as toml_dump,
-    load as toml_load,
+    TomlDecodeError,
+    TomlEncoder,
+    dumps as toml_dump_to_string,
     loads as toml_load_from_string,
 )
 
+# Cache of parsed TOML files, keyed by path. We only re-use a parsed file if
+# its inode, modification time, and size have not changed since we parsed it
+_PARSED_TOML_CACHE = {}
+_PARSED_TOML_CACHE_LOCK = Lock()
+
+_BARE_KEY_RE = regex_compile(r"[A-Za-z0-9_-]+")
+_BASIC_STRING_RE = regex_compile(r'"(?:[^"\\]|\\.)*"')
+_TOML_ENCODER = TomlEncoder()
+
 
 def merge_dicts_recursively(dict_a, dict_b):
     """
@@ -43,45 +60,691 @@ def merge_dicts_recursively(dict_a, dict_b):
             dict_a[k] = dict_b[k]
 
 
+def load_toml(toml_path, requires_root=None):
+    """
+    Parse a TOML file, or return it from the cache if it has not changed
+
+    The returned dictionary is shared with other callers, so it must not be
+    modified. If requires_root is None, we read the file as root if it is
+    root-owned
+    """
+    return _load_toml_and_str(toml_path, requires_root)[1]
+
+
+def _load_toml_and_str(toml_path, requires_root):
+    return _load_tomls_and_strs([toml_path], requires_root)[toml_path]
+
+
+def _load_tomls_and_strs(toml_paths, requires_root):
+    """
+    Load (and parse) many TOML files, returning a dictionary of path to a
+    (string, parsed dict) tuple. We read all the files that are not cached
+    with one request to the privileged helper
+
+    When recording or replaying commands (see tasks/util/replay.py) we do not
+    use the cache, as the files may not exist when replaying, and we read all
+    the files with the privileged helper, so that we record their contents
+    """
+    if get_replay_mode() is not None:
+        toml_strs = {
+            toml_path: data.decode("utf-8")
+            for toml_path, data in sudo_read_files(toml_paths).items()
+        }
+        return {
+            toml_path: (toml_str, toml_load_from_string(toml_str))
+            for toml_path, toml_str in toml_strs.items()
+        }
+
+    loaded = {}
+    cache_keys = {}
+    root_paths = []
+    for toml_path in toml_paths:
+        stat_info = stat(toml_path)
+        cache_keys[toml_path] = (
+            stat_info.st_ino,
+            stat_info.st_mtime_ns,
+            stat_info.st_size,
+        )
+        with _PARSED_TOML_CACHE_LOCK:
+            cached = _PARSED_TOML_CACHE.get(toml_path)
+            if cached is not None and cached["key"] == cache_keys[toml_path]:
+                loaded[toml_path] = (cached["toml_str"], cached["conf"])
+                continue
+
+        if requires_root or (requires_root is None and stat_info.st_uid == 0):
+            root_paths.append(toml_path)
+        else:
+            with open(toml_path, "r") as fh:
+                loaded[toml_path] = (fh.read(), None)
+
+    if len(root_paths) > 0:
+        for toml_path, data in sudo_read_files(root_paths).items():
+            loaded[toml_path] = (data.decode("utf-8"), None)
+
+    for toml_path, (toml_str, conf) in loaded.items():
+        if conf is not None:
+            continue
+
+        conf = toml_load_from_string(toml_str)
+        loaded[toml_path] = (toml_str, conf)
+        with _PARSED_TOML_CACHE_LOCK:
+            _PARSED_TOML_CACHE[toml_path] = {
+                "key": cache_keys[toml_path],
+                "toml_str": toml_str,
+                "conf": conf,
+            }
+
+    return loaded
+
+
+def _write_toml_strs(toml_strs, requires_root):
+    """
+    Atomically replace many TOML files, given as a dictionary of path to
+    their new contents. Root-owned files are written in one privileged batch
+    """
+    if requires_root:
+        sudo_write_files(toml_strs)
+        return
+
+    for toml_path, toml_str in toml_strs.items():
+        tmp_path = f"{toml_path}.{getpid()}.tmp"
+        with open(tmp_path, "w") as fh:
+            fh.write(toml_str)
+        rename(tmp_path, toml_path)
+
+
+# ----------
+# Format-preserving TOML patches
+# ----------
+
+# Instead of re-writing a whole TOML file to change a few keys (which drops
+# comments and re-orders tables) we patch the file in place, line by line,
+# only touching the tables and keys that change. The patcher understands the
+# subset of TOML that we find in containerd and Kata's config files, so we
+# always check that the patched file parses to what we expect, and otherwise
+# fall back to re-writing the file (see TomlTransaction.commit)
+
+
+class TomlPatchError(Exception):
+    """
+    Error raised when a TOML file uses features that we can not patch
+    """
+
+
+def _parse_toml_key(line, pos):
+    """
+    Parse a (possibly dotted, and quoted) key starting at line[pos], and
+    return its parts and the position right after it
+    """
+    parts = []
+    while True:
+        while line[pos : pos + 1] in [" ", "\t"]:
+            pos += 1
+
+        if line.startswith('"', pos):
+            match = _BASIC_STRING_RE.match(line, pos)
+            if match is None:
+                raise TomlPatchError(f"Unterminated key in line: {line}")
+            try:
+                parts.append(json_loads(match.group()))
+            except ValueError:
+                raise TomlPatchError(f"Unsupported key in line: {line}")
+            pos = match.end()
+        elif line.startswith("'", pos):
+            end = line.find("'", pos + 1)
+            if end < 0:
+                raise TomlPatchError(f"Unterminated key in line: {line}")
+            parts.append(line[pos + 1 : end])
+            pos = end + 1
+        else:
+            match = _BARE_KEY_RE.match(line, pos)
+            if match is None:
+                raise TomlPatchError(f"Can not parse key in line: {line}")
+            parts.append(match.group())
+            pos = match.end()
+
+        while line[pos : pos + 1] in [" ", "\t"]:
+            pos += 1
+
+        if not line.startswith(".", pos):
+            return parts, pos
+        pos += 1
+
+
+def _find_value_end(lines, line_idx, pos):
+    """
+    Find the end of a value that starts at lines[line_idx][pos], and return
+    the index of the line where it ends, and the position right after it
+    """
+    line = lines[line_idx]
+    first_char = line[pos : pos + 1]
+    if first_char == "":
+        raise TomlPatchError(f"Missing value in line: {line}")
+
+    # Most values fit in one line, so we fast-path them
+    if not line.startswith(('"""', "'''"), pos) and first_char not in "[{":
+        if first_char == '"':
+            match = _BASIC_STRING_RE.match(line, pos)
+            if match is None:
+                raise TomlPatchError(f"Unterminated string in line: {line}")
+            return line_idx, match.end()
+
+        if first_char == "'":
+            end = line.find("'", pos + 1)
+            if end < 0:
+                raise TomlPatchError(f"Unterminated string in line: {line}")
+            return line_idx, end + 1
+
+        comment_pos = line.find("#", pos)
+        value = line[pos:] if comment_pos < 0 else line[pos:comment_pos]
+        return line_idx, pos + len(value.rstrip())
+
+    # Otherwise, we scan the value character by character, tracking strings
+    # and nested arrays/inline tables, as it may span multiple lines
+    depth = 0
+    string_delim = None
+    while line_idx < len(lines):
+        line = lines[line_idx]
+        while pos < len(line):
+            if string_delim is not None:
+                if string_delim[0] == '"' and line[pos] == "\\":
+                    pos += 2
+                elif line.startswith(string_delim, pos):
+                    pos += len(string_delim)
+                    string_delim = None
+                    if depth == 0:
+                        return line_idx, pos
+                else:
+                    pos += 1
+                continue
+
+            for delim in ['"""', "'''", '"', "'"]:
+                if line.startswith(delim, pos):
+                    string_delim = delim
+                    pos += len(delim)
+                    break
+            else:
+                if line[pos] == "#":
+                    break
+                if line[pos] in "[{":
+                    depth += 1
+                elif line[pos] in "]}":
+                    depth -= 1
+                    if depth == 0:
+                        return line_idx, pos + 1
+                pos += 1
+
+        if string_delim in ['"', "'"]:
+            raise TomlPatchError(f"Unterminated string in line: {line}")
+
+        line_idx += 1
+        pos = 0
+
+    raise TomlPatchError("Unterminated value at the end of the file")
+
+
+def _scan_toml_lines(lines):
+    """
+    Scan the lines of a TOML file, and return its table headers and key-value
+    pairs, in order. For each entry we record its full path, and the lines
+    that it spans
+    """
+    entries = []
+    table_path = ()
+    line_idx = 0
+    while line_idx < len(lines):
+        line = lines[line_idx]
+        stripped = line.lstrip()
+        indent = line[: len(line) - len(stripped)]
+        if stripped == "" or stripped.startswith("#"):
+            line_idx += 1
+            continue
+
+        if stripped.startswith("["):
+            # Arrays of tables ([[...]]) repeat the same path, so we record
+            # them to refuse patching anything inside them
+            is_array = stripped.startswith("[[")
+            closing = "]]" if is_array else "]"
+            parts, pos = _parse_toml_key(line, len(indent) + len(closing))
+            if not line.startswith(closing, pos):
+                raise TomlPatchError(f"Can not parse table header: {line}")
+
+            table_path = tuple(parts)
+            entries.append(
+                {
+                    "kind": "array" if is_array else "table",
+                    "path": table_path,
+                    "start": line_idx,
+                    "end": line_idx,
+                    "indent": indent,
+                }
+            )
+            line_idx += 1
+            continue
+
+        parts, pos = _parse_toml_key(line, len(indent))
+        if not line.startswith("=", pos):
+            raise TomlPatchError(f"Can not parse key-value pair: {line}")
+        pos += 1
+        while line[pos : pos + 1] in [" ", "\t"]:
+            pos += 1
+
+        end_idx, end_pos = _find_value_end(lines, line_idx, pos)
+        entries.append(
+            {
+                "kind": "value",
+                "path": table_path + tuple(parts),
+                "start": line_idx,
+                "end": end_idx,
+                "value_start": pos,
+                "value_end": end_pos,
+                "indent": indent,
+            }
+        )
+        line_idx = end_idx + 1
+
+    return entries
+
+
+def _format_toml_key(parts):
+    return ".".join(
+        [part if _BARE_KEY_RE.fullmatch(part) else json_dumps(part) for part in parts]
+    )
+
+
+def _is_prefix(prefix, path):
+    return path[: len(prefix)] == prefix
+
+
+def _get_section_end(lines, entries, entry_idx):
+    """
+    Return the index of the line where the section of a table header ends
+    (i.e. the next header, or the end of the file)
+    """
+    for entry in entries[entry_idx + 1 :]:
+        if entry["kind"] != "value":
+            return entry["start"]
+
+    return len(lines)
+
+
+def _splice_toml_lines(lines, entries, start, end, new_lines, new_entries=None):
+    """
+    Replace lines[start:end] with new_lines, and keep the scanned entries in
+    sync, so that we do not need to re-scan the file after every change. The
+    line indices of new_entries are relative to `start`
+    """
+    delta = len(new_lines) - (end - start)
+    lines[start:end] = new_lines
+
+    entries_before = [entry for entry in entries if entry["end"] < start]
+    entries_after = [entry for entry in entries if entry["start"] >= end]
+    for entry in entries_after:
+        entry["start"] += delta
+        entry["end"] += delta
+    for entry in new_entries or []:
+        entry["start"] += start
+        entry["end"] += start
+
+    entries[:] = entries_before + (new_entries or []) + entries_after
+
+
+def _add_toml_table(lines, entries, table_path):
+    """
+    Add an empty table to a TOML file, right after the last table that shares
+    the longest prefix with it, so that related tables stay together
+    """
+    headers = [
+        (idx, entry) for idx, entry in enumerate(entries) if entry["kind"] == "table"
+    ]
+    anchor_idx = None
+    anchor_prefix_len = 0
+    parent = None
+    for idx, entry in headers:
+        prefix_len = 0
+        for level, other_level in zip(entry["path"], table_path):
+            if level != other_level:
+                break
+            prefix_len += 1
+
+        if prefix_len > 0 and prefix_len >= anchor_prefix_len:
+            anchor_idx = idx
+            anchor_prefix_len = prefix_len
+        if _is_prefix(entry["path"], table_path):
+            parent = entry
+
+    # Match the indentation style of the file (i.e. containerd's config file
+    # indents tables by their nesting level)
+    indent = ""
+    if parent is not None and any([entry["indent"] for _, entry in headers]):
+        indent = parent["indent"] + "  "
+
+    if anchor_idx is None:
+        insert_at = len(lines)
+        if insert_at > 0 and lines[-1] == "":
+            insert_at -= 1
+    else:
+        insert_at = _get_section_end(lines, entries, anchor_idx)
+        while (
+            insert_at > entries[anchor_idx]["start"] + 1
+            and not lines[insert_at - 1].strip()
+        ):
+            insert_at -= 1
+
+    header = {
+        "kind": "table",
+        "path": table_path,
+        "start": 1,
+        "end": 1,
+        "indent": indent,
+    }
+    _splice_toml_lines(
+        lines,
+        entries,
+        insert_at,
+        insert_at,
+        ["", f"{indent}[{_format_toml_key(table_path)}]"],
+        [header],
+    )
+
+
+def _find_toml_entries(entries, path):
+    """
+    Find, in one pass, the value entry for a path, the header of the table
+    that contains it, and whether there are any entries under the path
+    """
+    value_entry = None
+    header_idx = None
+    has_children = False
+    path_len = len(path)
+    for idx, entry in enumerate(entries):
+        entry_path = entry["path"]
+        if entry_path[:path_len] == path:
+            if len(entry_path) == path_len and entry["kind"] == "value":
+                value_entry = entry
+            else:
+                has_children = True
+        elif entry_path == path[: len(entry_path)]:
+            # We can not patch values inside arrays of tables, or inline
+            # tables, or turn a value into a table
+            if entry["kind"] != "table":
+                raise TomlPatchError(f"Can not patch {path} inside {entry_path}")
+
+            if len(entry_path) == path_len - 1:
+                header_idx = idx
+
+    return value_entry, header_idx, has_children
+
+
+def _patch_toml_value(lines, entries, path, value):
+    """
+    Set the value of a key in a TOML file (or make sure that a table exists,
+    if the value is an empty dict)
+    """
+    value_entry, header_idx, has_children = _find_toml_entries(entries, path)
+
+    if isinstance(value, dict):
+        if not has_children:
+            _add_toml_table(lines, entries, path)
+        return
+
+    value_str = str(_TOML_ENCODER.dump_value(value))
+    if value_entry is not None:
+        new_line = (
+            lines[value_entry["start"]][: value_entry["value_start"]]
+            + value_str
+            + lines[value_entry["end"]][value_entry["value_end"] :]
+        )
+        new_entry = dict(
+            value_entry,
+            start=0,
+            end=0,
+            value_end=value_entry["value_start"] + len(value_str),
+        )
+        _splice_toml_lines(
+            lines,
+            entries,
+            value_entry["start"],
+            value_entry["end"] + 1,
+            [new_line],
+            [new_entry],
+        )
+        return
+
+    # The key does not exist, so we add it at the end of its table's section
+    table_path = path[:-1]
+    if len(table_path) > 0 and header_idx is None:
+        _add_toml_table(lines, entries, table_path)
+        _, header_idx, _ = _find_toml_entries(entries, path)
+
+    section = []
+    for entry in entries[header_idx + 1 if header_idx is not None else 0 :]:
+        if entry["kind"] != "value":
+            break
+        section.append(entry)
+
+    new_lines = []
+    if len(section) > 0:
+        insert_at = section[-1]["end"] + 1
+        indent = section[-1]["indent"]
+    elif header_idx is not None:
+        insert_at = entries[header_idx]["start"] + 1
+        header_indent = entries[header_idx]["indent"]
+        indent = header_indent + "  " if header_indent else ""
+    else:
+        # New top-level key in a file without any, add it before the first
+        # table (i.e. after any leading comments)
+        insert_at = len(lines) - 1 if lines[-1] == "" else len(lines)
+        if len(entries) > 0:
+            insert_at = entries[0]["start"]
+            new_lines.append("")
+        indent = ""
+
+    key_str = f"{indent}{_format_toml_key(path[-1:])} = "
+    new_entry = {
+        "kind": "value",
+        "path": path,
+        "start": 0,
+        "end": 0,
+        "value_start": len(key_str),
+        "value_end": len(key_str) + len(value_str),
+        "indent": indent,
+    }
+    _splice_toml_lines(
+        lines,
+        entries,
+        insert_at,
+        insert_at,
+        [key_str + value_str] + new_lines,
+        [new_entry],
+    )
+
+
+def _patch_toml_remove(lines, entries, path):
+    """
+    Remove a key, or a table (and all its sub-tables) from a TOML file
+    """
+    _find_toml_entries(entries, path)
+
+    ranges = []
+    for idx, entry in enumerate(entries):
+        if not _is_prefix(path, entry["path"]):
+            continue
+
+        if entry["kind"] == "value":
+            ranges.append([entry["start"], entry["end"] + 1])
+        else:
+            ranges.append([entry["start"], _get_section_end(lines, entries, idx)])
+
+    # Merge overlapping ranges (e.g. a key inside a table that we remove)
+    merged_ranges = []
+    for line_range in sorted(ranges):
+        if len(merged_ranges) > 0 and line_range[0] <= merged_ranges[-1][1]:
+            merged_ranges[-1][1] = max(merged_ranges[-1][1], line_range[1])
+        else:
+            merged_ranges.append(line_range)
+
+    for start, end in reversed(merged_ranges):
+        _splice_toml_lines(lines, entries, start, end, [])
+
+
+def _iter_toml_leaves(toml_dict, prefix=()):
+    for key, value in toml_dict.items():
+        if isinstance(value, dict) and len(value) > 0:
+            yield from _iter_toml_leaves(value, prefix + (key,))
+        else:
+            yield prefix + (key,), value
+
+
+def patch_toml_str(toml_str, operations):
+    """
+    Patch a TOML string in place, and return the patched string
+
+    Each operation is a tuple, either ("update", updates_dict), to merge a
+    (parsed) TOML dictionary into the string, or ("remove", toml_path), to
+    remove an entry by its "." delimited TOML path. We raise a TomlPatchError
+    if the string uses TOML features that we can not patch
+    """
+    lines = toml_str.split("\n")
+    entries = _scan_toml_lines(lines)
+    for op, arg in operations:
+        if op == "update":
+            for path, value in _iter_toml_leaves(arg):
+                _patch_toml_value(lines, entries, path, value)
+        elif op == "remove":
+            _patch_toml_remove(lines, entries, tuple(split_dot_preserve_quotes(arg)))
+        else:
+            print(f"ERROR: unrecognised TOML patch operation: {op}")
+            raise RuntimeError("Unrecognised TOML patch operation!")
+
+    return "\n".join(lines)
+
+
+class TomlTransaction:
+    """
+    Batch of updates to a TOML file, that we read and parse once, and write
+    once (see `toml_transaction`)
+    """
+
+    def __init__(self, toml_path, requires_root=True):
+        self.toml_path = toml_path
+        self.requires_root = requires_root
+        self.operations = []
+
+        self.toml_str, conf = _load_toml_and_str(toml_path, requires_root)
+        self.conf = deepcopy(conf)
+
+    def update(self, updates_toml):
+        """
+        Merge a TOML string with updates into the file (see `update_toml`)
+        """
+        updates = toml_load_from_string(updates_toml)
+        self.operations.append(("update", deepcopy(updates)))
+        merge_dicts_recursively(self.conf, updates)
+
+    def remove(self, toml_path):
+        """
+        Remove an entry (and all its descendants) from the file (see
+        `remove_entry_from_toml`)
+        """
+        self.operations.append(("remove", toml_path))
+        self.conf = do_remove_entry_from_toml(self.conf, toml_path)
+
+    def get_updated_str(self):
+        """
+        Return the updated file, patching the original one in place if we can,
+        or re-writing it otherwise
+        """
+        try:
+            toml_str = patch_toml_str(self.toml_str, self.operations)
+            if toml_load_from_string(toml_str) == self.conf:
+                return toml_str
+        except (TomlPatchError, TomlDecodeError):
+            pass
+
+        return toml_dump_to_string(self.conf)
+
+    def commit(self):
+        """
+        Atomically replace the file with the updated one
+        """
+        if len(self.operations) == 0:
+            return
+
+        toml_str = self.get_updated_str()
+        _write_toml_strs({self.toml_path: toml_str}, self.requires_root)
+
+        self.toml_str = toml_str
+        self.operations = []
+
+
+@contextmanager
+def toml_transaction(toml_path, requires_root=True):
+    """
+    Context manager to batch many updates to the same TOML file, e.g.:
+
+    with toml_transaction(CONTAINERD_CONFIG_FILE) as conf:
+        for runtime in KATA_RUNTIMES:
+            conf.update(updated_toml_str)
+
+    We only write the file (once) if the block finishes without errors
+    """
+    transaction = TomlTransaction(toml_path, requires_root=requires_root)
+    yield transaction
+    transaction.commit()
+
+
 def update_toml(toml_path, updates_toml, requires_root=True):
     """
     Helper method to update entries in a TOML file
 
     Updating a TOML file is very frequent in the CoCo environment, particularly
     `root` owned TOML files. So this utility method aims to make that easier.
+    To make many updates to the same file, use `toml_transaction` instead.
     Parameters:
     - toml_path: path to the TOML file to modify
     - updates_toml: TOML string with the required updates (simplest way to
                     express arbitrarily complex TOML files)
     - requires_root: whether the TOML file is root-owned (usually the case)
     """
-    if requires_root:
-        new_toml_file_path = join("/tmp", basename(toml_path) + "-read")
-        run(f"sudo cp {toml_path} {new_toml_file_path}", shell=True, check=True)
-        run(
-            "sudo chown {}:{} {}".format(getuid(), getgid(), new_toml_file_path),
-            shell=True,
-            check=True,
-        )
+    with toml_transaction(toml_path, requires_root=requires_root) as transaction:
+        transaction.update(updates_toml)
 
-        conf_file = toml_load(new_toml_file_path)
-        run(f"sudo rm {new_toml_file_path}", shell=True, check=True)
-    else:
-        conf_file = toml_load(toml_path)
 
-    merge_dicts_recursively(conf_file, toml_load_from_string(updates_toml))
+def update_tomls(updates, requires_root=True, debug=False):
+    """
+    Apply updates to many TOML files at once (e.g. the same change to the Kata
+    config file of each runtime class)
 
-    if requires_root:
-        # Dump the TOML contents to a temporary file (can't sudo-write)
-        tmp_conf = "/tmp/{}".format(basename(toml_path))
-        with open(tmp_conf, "w") as fh:
-            toml_dump(conf_file, fh)
+    We read all the files in one privileged batch, patch each of them, and
+    write them back in another one. Returns a dictionary with the time (in
+    seconds) that it took to patch each file
+    Parameters:
+    - updates: dictionary of TOML file path to a TOML string with the updates
+               for that file (see `update_toml`)
+    - requires_root: whether the TOML files are root-owned
+    - debug: whether to print the time it took to patch each file
+    """
+    _load_tomls_and_strs(list(updates), requires_root)
 
-        # sudo-copy the TOML file in place
-        run("sudo mv {} {}".format(tmp_conf, toml_path), shell=True, check=True)
-    else:
-        with open(toml_path, "w") as fh:
-            toml_dump(conf_file, fh)
+    toml_strs = {}
+    timings = {}
+    for toml_path, updates_toml in updates.items():
+        start_ts = time()
+        with span(f"Patching {toml_path}"):
+            # The files are already in the parsed TOML cache
+            transaction = TomlTransaction(toml_path, requires_root=requires_root)
+            transaction.update(updates_toml)
+            toml_strs[toml_path] = transaction.get_updated_str()
+        timings[toml_path] = time() - start_ts
+
+    _write_toml_strs(toml_strs, requires_root)
+
+    if debug:
+        for toml_path, secs in timings.items():
+            print(f"Patched {toml_path} in {secs * 1000:.1f} ms")
+
+    return timings
 
 
 def split_dot_preserve_quotes(input_string):
@@ -110,46 +773,80 @@ def join_dot_preserve_quote(toml_levels):
     return ".".join(toml_path)
 
 
-def read_value_from_toml(toml_file_path, toml_path, tolerate_missing=False):
+def read_values_from_toml(toml_file_path, toml_paths, tolerate_missing=False):
     """
-    Return the value in a TOML specified by a "." delimited TOML path
+    Return the values in a TOML specified by a list of "." delimited TOML
+    paths, parsing the file at most once
     """
-    # Check if the pointed-to file is sudo-owned
     try:
-        stat_info = stat(toml_file_path)
+        toml_file = load_toml(toml_file_path)
     except FileNotFoundError:
         if tolerate_missing:
-            return ""
+            return ["" for _ in toml_paths]
         print(f"ERROR: cannot find TOML at path: {toml_file_path}")
         raise RuntimeError("Error reading value from toml")
 
-    if stat_info.st_uid == 0:
-        new_toml_file_path = join("/tmp", basename(toml_file_path))
-        run(f"sudo cp {toml_file_path} {new_toml_file_path}", shell=True, check=True)
-        run(
-            "sudo chown {}:{} {}".format(getuid(), getgid(), new_toml_file_path),
-            shell=True,
-            check=True,
-        )
+    values = []
+    for toml_path in toml_paths:
+        value = toml_file
+        for toml_level in split_dot_preserve_quotes(toml_path):
+            if not isinstance(value, dict) or toml_level not in value:
+                if tolerate_missing:
+                    value = ""
+                    break
+
+                raise RuntimeError(
+                    f"{toml_level} is not an entry in TOML file {toml_file_path}"
+                )
+            value = value[toml_level]
+
+        if isinstance(value, dict):
+            print("ERROR: error reading from TOML, must provide a full path")
+            raise RuntimeError("Haven't reached TOML leaf!")
 
-        toml_file_path = new_toml_file_path
+        # Copy the value, as callers may modify it (e.g. append to a list)
+        values.append(deepcopy(value))
 
-    toml_file = toml_load(toml_file_path)
-    for toml_level in split_dot_preserve_quotes(toml_path):
-        if toml_level not in toml_file:
-            if tolerate_missing:
-                return ""
+    return values
 
-            raise RuntimeError(
-                f"{toml_level} is not an entry in TOML file {toml_file_path}"
+
+def read_value_from_toml(toml_file_path, toml_path, tolerate_missing=False):
+    """
+    Return the value in a TOML specified by a "." delimited TOML path
+    """
+    return read_values_from_toml(
+        toml_file_path, [toml_path], tolerate_missing=tolerate_missing
+    )[0]
+
+
+def wait_for_toml_values(toml_file_path, expected_values, timeout=None, debug=False):
+    """
+    Block until all the "." delimited TOML paths in `expected_values` (a
+    dictionary of path to value) hold the expected value. We re-read the file
+    only when it changes, and check all the paths at once
+    """
+    toml_paths = list(expected_values)
+
+    def check():
+        try:
+            values = read_values_from_toml(
+                toml_file_path, toml_paths, tolerate_missing=True
             )
-        toml_file = toml_file[toml_level]
+        except TomlDecodeError:
+            # We may read the file half-way through another process writing it
+            return False
 
-    if isinstance(toml_file, dict):
-        print("ERROR: error reading from TOML, must provide a full path")
-        raise RuntimeError("Haven't reached TOML leaf!")
+        pending = [
+            toml_path
+            for toml_path, value in zip(toml_paths, values)
+            if value != expected_values[toml_path]
+        ]
+        if debug and len(pending) > 0:
+            print(f"Waiting for {len(pending)} TOML entries in {toml_file_path}")
 
-    return toml_file
+        return len(pending) == 0
+
+    wait_for_files([toml_file_path], check, timeout=timeout)
 
 
 def do_remove_entry_from_toml(toml_dict, toml_path):
@@ -159,7 +856,7 @@ def do_remove_entry_from_toml(toml_dict, toml_path):
     if dict_key not in toml_dict:
         return toml_dict
 
-    if not isinstance(toml_dict[dict_key], dict):
+    if len(toml_levels) == 1 or not isinstance(toml_dict[dict_key], dict):
         del toml_dict[dict_key]
         return toml_dict
 
@@ -176,14 +873,5 @@ def remove_entry_from_toml(toml_file_path, toml_path):
     Remove an entry (and all its descendants) from a TOML specified by a path.
     This method returns silently if the specified path does not exist.
     """
-    toml_file = toml_load(toml_file_path)
-
-    toml_file = do_remove_entry_from_toml(toml_file, toml_path)
-
-    # Dump to temporary file and sudo-copy
-    tmp_toml_file_path = join("/tmp", basename(toml_file_path))
-    with open(tmp_toml_file_path, "w") as fh:
-        toml_dump(toml_file, fh)
-
-    run(f"sudo cp {tmp_toml_file_path} {toml_file_path}", shell=True, check=True)
-    remove(tmp_toml_file_path)
+    with toml_transaction(toml_file_path) as transaction:
+        transaction.remove(toml_path)
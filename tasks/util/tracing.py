@@ -0,0 +1,318 @@
+from atexit import register as atexit_register
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count
+from json import dump as json_dump
+from os import environ, getpid
+from threading import Lock, current_thread, get_ident, local
+from time import perf_counter, time
+import subprocess
+
+# Set this environment variable to a file path to record a trace of all the
+# invoke tasks, the steps inside them (i.e. each `print_dotted_line`), and the
+# commands that they run. The trace is written in Chrome's trace event format,
+# so it can be opened in chrome://tracing or https://ui.perfetto.dev
+TRACE_FILE_ENV_VAR = "SC2_TRACE_FILE"
+
+# Span categories
+SPAN_TASK = "task"
+SPAN_STEP = "step"
+SPAN_DAG_STEP = "dag-step"
+SPAN_COMMAND = "command"
+
+_EPOCH_US = time() * 1e6
+_START_TS = perf_counter()
+
+_TRACE_FILE = None
+_EVENTS = []
+_THREAD_NAMES = {}
+_EVENTS_LOCK = Lock()
+_THREAD_STATE = local()
+_ASYNC_SPAN_IDS = count()
+_ORIGINAL_RUN = subprocess.run
+
+
+def _now_us():
+    return _EPOCH_US + (perf_counter() - _START_TS) * 1e6
+
+
+def _get_stack():
+    if not hasattr(_THREAD_STATE, "stack"):
+        _THREAD_STATE.stack = []
+
+    return _THREAD_STATE.stack
+
+
+def is_tracing_enabled():
+    return _TRACE_FILE is not None
+
+
+def _open_span(name, cat, args=None):
+    open_span = {
+        "name": name,
+        "cat": cat,
+        "ts": _now_us(),
+        "args": dict(args or {}),
+        "num_cmds": 0,
+        "cmd_time_us": 0,
+    }
+    _get_stack().append(open_span)
+    return open_span
+
+
+def _close_span(open_span):
+    stack = _get_stack()
+    if open_span not in stack:
+        return
+
+    # Close any span left open inside this one (e.g. a step that failed
+    # before printing "Success!")
+    while stack[-1] is not open_span:
+        _close_span(stack[-1])
+    stack.pop()
+
+    dur = _now_us() - open_span["ts"]
+
+    # Attribute the time spent running commands to all the enclosing spans
+    if open_span["cat"] == SPAN_COMMAND:
+        for parent in stack:
+            parent["num_cmds"] += 1
+            parent["cmd_time_us"] += dur
+
+    args = open_span["args"]
+    if open_span["cat"] != SPAN_COMMAND:
+        args["num_cmds"] = open_span["num_cmds"]
+        args["cmd_time_secs"] = round(open_span["cmd_time_us"] / 1e6, 3)
+
+    with _EVENTS_LOCK:
+        _THREAD_NAMES[get_ident()] = current_thread().name
+        _EVENTS.append(
+            {
+                "name": open_span["name"],
+                "cat": open_span["cat"],
+                "ph": "X",
+                "ts": open_span["ts"],
+                "dur": dur,
+                "pid": getpid(),
+                "tid": get_ident(),
+                "args": args,
+            }
+        )
+
+
+@contextmanager
+def span(name, cat=SPAN_STEP, args=None):
+    """
+    Record a span for the code inside the context manager. Spans nest
+    following the call stack of each thread
+    """
+    if not is_tracing_enabled():
+        yield
+        return
+
+    open_span = _open_span(name, cat, args)
+    try:
+        yield
+    except BaseException as e:
+        open_span["args"]["error"] = repr(e)
+        raise
+    finally:
+        _close_span(open_span)
+
+
+@contextmanager
+def async_span(name, cat=SPAN_COMMAND, args=None):
+    """
+    Record a span that may overlap with other spans in the same thread (e.g.
+    commands that we await concurrently from an asyncio event loop). We record
+    it as a pair of Chrome async events, as it need not nest with the rest
+    """
+    if not is_tracing_enabled():
+        yield
+        return
+
+    span_id = next(_ASYNC_SPAN_IDS)
+    start_ts = _now_us()
+    try:
+        yield
+    finally:
+        end_ts = _now_us()
+
+        # Attribute the time spent running commands to the enclosing spans
+        if cat == SPAN_COMMAND:
+            for parent in _get_stack():
+                parent["num_cmds"] += 1
+                parent["cmd_time_us"] += end_ts - start_ts
+
+        event = {
+            "name": name,
+            "cat": cat,
+            "id": span_id,
+            "pid": getpid(),
+            "tid": get_ident(),
+        }
+        with _EVENTS_LOCK:
+            _THREAD_NAMES[get_ident()] = current_thread().name
+            _EVENTS.append({**event, "ph": "b", "ts": start_ts, "args": args or {}})
+            _EVENTS.append({**event, "ph": "e", "ts": end_ts})
+
+
+def start_step(name):
+    """
+    Start a step span that lasts until the next call to `end_step` in the same
+    thread. We use it to trace the `print_dotted_line`/`print_success` pairs
+    """
+    if not is_tracing_enabled():
+        return
+
+    end_step()
+    _THREAD_STATE.step = _open_span(name, SPAN_STEP)
+
+
+def end_step():
+    if not is_tracing_enabled():
+        return
+
+    open_step = getattr(_THREAD_STATE, "step", None)
+    if open_step is not None:
+        _THREAD_STATE.step = None
+        _close_span(open_step)
+
+
+def traced_run(*args, **kwargs):
+    """
+    Drop-in replacement for `subprocess.run` that records a command span
+    """
+    cmd = args[0] if len(args) > 0 else kwargs.get("args", "")
+    if not isinstance(cmd, str):
+        cmd = " ".join([str(c) for c in cmd])
+
+    with span(cmd.strip().split("\n")[0][:80], cat=SPAN_COMMAND, args={"cmd": cmd}):
+        return _ORIGINAL_RUN(*args, **kwargs)
+
+
+def trace_task(task_name, body):
+    """
+    Wrap the body of an invoke task to record a task span
+    """
+
+    @wraps(body)
+    def traced_body(*args, **kwargs):
+        with span(task_name, cat=SPAN_TASK):
+            return body(*args, **kwargs)
+
+    return traced_body
+
+
+def trace_collection(collection):
+    """
+    Wrap all the tasks in an invoke collection, including the ones in its
+    sub-collections, to record task spans
+    """
+    if not is_tracing_enabled():
+        return
+
+    for task_name in collection.task_names:
+        task = collection[task_name]
+        if not getattr(task.body, "__wrapped__", None):
+            task.body = trace_task(task_name, task.body)
+
+
+def print_summary():
+    """
+    Print a per-step summary table with the wall time of each step, and the
+    time spent running commands
+    """
+    with _EVENTS_LOCK:
+        events = sorted(
+            [e for e in _EVENTS if e["ph"] == "X" and e["cat"] != SPAN_COMMAND],
+            key=lambda e: e["ts"],
+        )
+
+    if len(events) == 0:
+        return
+
+    name_len = 60
+    header = "{:<{}} {:>9} {:>9} {:>6} {:>12}".format(
+        "Span", name_len, "Type", "Wall (s)", "Cmds", "Cmd time (s)"
+    )
+    print("\n" + header)
+    print("-" * len(header))
+    for event in events:
+        name = event["name"]
+        if len(name) > name_len:
+            name = name[: name_len - 3] + "..."
+        print(
+            "{:<{}} {:>9} {:>9.2f} {:>6} {:>12.2f}".format(
+                name,
+                name_len,
+                event["cat"],
+                event["dur"] / 1e6,
+                event["args"].get("num_cmds", 0),
+                event["args"].get("cmd_time_secs", 0),
+            )
+        )
+
+
+def write_trace(trace_file):
+    """
+    Write all recorded spans to a file in Chrome's trace event format
+    """
+    with _EVENTS_LOCK:
+        events = list(_EVENTS)
+        thread_names = dict(_THREAD_NAMES)
+
+    metadata = [
+        {
+            "name": "process_name",
+            "ph": "M",
+            "pid": getpid(),
+            "args": {"name": "inv"},
+        }
+    ]
+    for tid, thread_name in thread_names.items():
+        metadata.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": getpid(),
+                "tid": tid,
+                "args": {"name": thread_name},
+            }
+        )
+    with open(trace_file, "w") as fh:
+        json_dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, fh)
+
+
+def _finish_tracing():
+    # Close any span that is still open in this thread
+    end_step()
+    for open_span in reversed(_get_stack()):
+        open_span["args"]["unfinished"] = True
+        _close_span(open_span)
+
+    print_summary()
+    write_trace(_TRACE_FILE)
+    print(f"Wrote trace to: {_TRACE_FILE}")
+
+
+def enable_tracing(trace_file):
+    """
+    Enable tracing for the current process
+
+    To trace the commands, we replace `subprocess.run`. This must happen
+    before any task module does `from subprocess import run`, so we call
+    this method when `tasks` is first imported.
+    """
+    global _TRACE_FILE
+
+    if _TRACE_FILE is not None:
+        return
+
+    _TRACE_FILE = trace_file
+    subprocess.run = traced_run
+    atexit_register(_finish_tracing)
+
+
+if environ.get(TRACE_FILE_ENV_VAR):
+    enable_tracing(environ[TRACE_FILE_ENV_VAR])
@@ -0,0 +1,62 @@
+from socket import AF_UNIX, SOCK_STREAM, socket
+from tasks.util.replay import get_replay_mode
+from tasks.util.sudo import sudo_probe_unix_socket
+from tasks.util.tracing import span
+from time import sleep, time
+
+# Wait for daemons (e.g. containerd, or the nydus-snapshotter) to be ready by
+# probing the unix socket they listen on. We connect to the socket in-process
+# and, only if we do not have permission to (most sockets are root-owned), we
+# ask the privileged helper (see tasks/util/sudo.py) to connect for us. When
+# recording or replaying commands we always go through the helper, so that
+# the probes make it to the recording.
+#
+# Daemons usually start listening within milliseconds of being (re-)started,
+# so we back-off exponentially, starting at SOCKET_PROBE_INITIAL_BACKOFF_SECS
+SOCKET_PROBE_TIMEOUT_SECS = 1
+SOCKET_PROBE_INITIAL_BACKOFF_SECS = 0.005
+SOCKET_PROBE_MAX_BACKOFF_SECS = 0.5
+WAIT_FOR_SOCKET_TIMEOUT_SECS = 10
+
+
+def probe_unix_socket(socket_path):
+    """
+    Return True if a daemon is listening on a unix socket
+    """
+    if get_replay_mode() is None:
+        with socket(AF_UNIX, SOCK_STREAM) as sock:
+            sock.settimeout(SOCKET_PROBE_TIMEOUT_SECS)
+            try:
+                sock.connect(socket_path)
+                return True
+            except PermissionError:
+                pass
+            except OSError:
+                return False
+
+    return sudo_probe_unix_socket(socket_path, SOCKET_PROBE_TIMEOUT_SECS)
+
+
+def wait_for_unix_socket(
+    socket_path, name=None, timeout=WAIT_FOR_SOCKET_TIMEOUT_SECS, debug=False
+):
+    """
+    Wait until a daemon is listening on a unix socket, or raise an error after
+    `timeout` seconds
+    """
+    name = name or socket_path
+    backoff_secs = SOCKET_PROBE_INITIAL_BACKOFF_SECS
+    start_ts = time()
+    with span(f"Wait for socket: {socket_path}"):
+        while not probe_unix_socket(socket_path):
+            if time() - start_ts > timeout:
+                print(
+                    f"ERROR: timed-out waiting for {name} to listen on: "
+                    f"{socket_path} (timeout: {timeout}s)"
+                )
+                raise RuntimeError(f"Error dialing {name} socket!")
+
+            if debug:
+                print(f"Waiting for {name} socket ({socket_path})...")
+            sleep(backoff_secs)
+            backoff_secs = min(backoff_secs * 2, SOCKET_PROBE_MAX_BACKOFF_SECS)
@@ -0,0 +1,93 @@
+from os.path import join
+from tasks.util import config
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from unittest.mock import patch
+
+MANIFESTS = [
+    {"id": "ab01", "created": 1.0},
+    {"id": "ac02", "created": 2.0},
+    {"id": "cd01", "created": 3.0},
+    {"id": "ce02", "created": 4.0},
+]
+SNAPSHOT_NAMES = {"baseline": "cd01", "old": "ab01"}
+
+
+class TestGetConfigSnapshot(TestCase):
+    def setUp(self):
+        for name, value in [
+            ("list_config_snapshots", MANIFESTS),
+            ("get_config_snapshot_names", SNAPSHOT_NAMES),
+        ]:
+            patcher = patch.object(config, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_id(self, snapshot_ref):
+        with patch("builtins.print"):
+            return config.get_config_snapshot(snapshot_ref)["id"]
+
+    def test_id(self):
+        self.assertEqual(self.get_id("ab01"), "ab01")
+
+    def test_name(self):
+        self.assertEqual(self.get_id("baseline"), "cd01")
+        self.assertEqual(self.get_id("old"), "ab01")
+
+    def test_unique_id_prefix(self):
+        self.assertEqual(self.get_id("ac"), "ac02")
+        self.assertEqual(self.get_id("cd"), "cd01")
+
+    def test_ambiguous_id_prefix(self):
+        for snapshot_ref in ["a", "c"]:
+            with self.assertRaises(RuntimeError):
+                self.get_id(snapshot_ref)
+
+    def test_not_found(self):
+        with self.assertRaises(RuntimeError):
+            self.get_id("ef")
+
+
+class TestTakeConfigSnapshot(TestCase):
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.contents = {"/etc/containerd/config.toml": b"version = 2\n"}
+
+        for name, value in [
+            ("CONFIG_OBJECTS_DIR", join(tmp_dir.name, "objects")),
+            ("CONFIG_SNAPSHOTS_DIR", join(tmp_dir.name, "snapshots")),
+            ("CONFIG_SNAPSHOT_NAMES_FILE", join(tmp_dir.name, "names.json")),
+            ("read_config_files", lambda file_paths: dict(self.contents)),
+        ]:
+            patcher = patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def take(self, name=None):
+        return config.take_config_snapshot(list(self.contents), name=name)
+
+    def test_rename_keeps_old_name(self):
+        first = self.take(name="before-experiment")
+        second = self.take(name="baseline")
+        self.assertEqual(first["id"], second["id"])
+        self.assertEqual(first["created"], second["created"])
+        self.assertEqual(second["names"], ["baseline", "before-experiment"])
+        for name in ["before-experiment", "baseline"]:
+            self.assertEqual(config.get_config_snapshot(name)["id"], first["id"])
+
+    def test_name_points_to_last_snapshot(self):
+        first = self.take(name="baseline")
+        self.contents["/etc/containerd/config.toml"] = b"version = 3\n"
+        second = self.take(name="baseline")
+        self.take()
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertEqual(config.get_config_snapshot("baseline")["id"], second["id"])
+        self.assertEqual(
+            [m["id"] for m in config.list_config_snapshots()],
+            [first["id"], second["id"]],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+from tasks.util.dag import run_dag
+from unittest import TestCase, main
+from unittest.mock import patch
+
+
+class TestRunDag(TestCase):
+    def run_steps(self, resumable, completed_hashes=None):
+        calls = []
+        steps = [
+            {"name": "a", "func": lambda: calls.append("a"), "deps": []},
+            {
+                "name": "b",
+                "func": lambda: calls.append("b"),
+                "deps": ["a"],
+                "inputs": lambda: {"version": "2"},
+                "resumable": resumable,
+            },
+        ]
+        started = []
+        done = {}
+        with patch("builtins.print"):
+            run_dag(
+                steps,
+                completed_hashes=completed_hashes,
+                on_step_start=started.append,
+                on_step_done=lambda name, step_hash, _: done.update({name: step_hash}),
+            )
+
+        self.assertEqual(started, ["a", "b"])
+        return calls, done
+
+    def test_skip_unchanged_steps(self):
+        _, done = self.run_steps(resumable=False)
+        calls, _ = self.run_steps(resumable=False, completed_hashes=done)
+        self.assertEqual(calls, [])
+
+    def test_rerun_changed_resumable_step(self):
+        calls, _ = self.run_steps(resumable=True, completed_hashes={"b": "old"})
+        self.assertEqual(calls, ["a", "b"])
+
+    def test_refuse_changed_non_resumable_step(self):
+        with self.assertRaises(RuntimeError):
+            self.run_steps(resumable=False, completed_hashes={"b": "old"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+from random import Random
+from tasks.util.journal import JournalIndex
+from unittest import TestCase, main
+
+SANDBOX_ID = "a1" * 32
+CONTAINER_ID = "b2" * 32
+OTHER_ID = "c3" * 32
+
+MESSAGES = [
+    f'time="..." level=info msg="RunPodSandbox for {SANDBOX_ID} returns"',
+    f"CreateContainer within sandbox {SANDBOX_ID} for container {CONTAINER_ID}",
+    f'msg="StartContainer for \\"{CONTAINER_ID}\\" returns successfully"',
+    # IDs glued to word characters, or to other hex characters
+    f"shim_{SANDBOX_ID}_1 disconnected",
+    f"connecting to shim {OTHER_ID}{SANDBOX_ID}",
+    f"snapshot key k8s.io/42/{CONTAINER_ID}",
+    f"RunPodSandbox for {OTHER_ID} returns",
+    "loading plugin io.containerd.grpc.v1.cri",
+    "CreateContainerWithin: msg= no ID here",
+]
+
+QUERIES = [
+    "RunPodSandbox",
+    "PodSandbox",
+    "msg=",
+    "CreateContainer within sandbox",
+    "StartContainer for",
+    "returns",
+    "shim",
+    "shim_",
+    "io.containerd",
+    '\\"',
+    "ab",
+    "",
+]
+
+EVENT_IDS = [SANDBOX_ID, CONTAINER_ID, OTHER_ID, SANDBOX_ID[:16], "k8s.io"]
+
+
+def brute_force_find(index, event_name, event_id, extra_event_id, since_ts):
+    return [
+        idx
+        for idx, (ts, message, _) in enumerate(index.entries)
+        if (since_ts is None or ts >= since_ts)
+        and event_name in message
+        and event_id in message
+        and (extra_event_id is None or extra_event_id in message)
+    ]
+
+
+class TestJournalIndex(TestCase):
+    def setUp(self):
+        rng = Random(0)
+        self.index = JournalIndex("containerd")
+        for ts in range(500):
+            message = rng.choice(MESSAGES)
+            self.index._add_entry(
+                {"MESSAGE": message, "__REALTIME_TIMESTAMP": str(ts * 1000000)}
+            )
+
+    def test_find_matches_brute_force(self):
+        for event_name in QUERIES:
+            for event_id in EVENT_IDS:
+                for extra_event_id in [None] + EVENT_IDS:
+                    for since_ts in [None, 250]:
+                        args = (event_name, event_id, extra_event_id, since_ts)
+                        self.assertEqual(
+                            self.index.find(*args),
+                            brute_force_find(self.index, *args),
+                            args,
+                        )
+
+    def test_find_glued_ids(self):
+        positions = self.index.find("shim_", SANDBOX_ID)
+        self.assertGreater(len(positions), 0)
+
+        positions = self.index.find("connecting to shim", SANDBOX_ID)
+        self.assertGreater(len(positions), 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from tasks.util import pod_tracker
+from unittest import TestCase, main
+from unittest.mock import patch
+
+
+def make_pod(uid, created_at, ready_at=None):
+    conditions = []
+    if ready_at is not None:
+        conditions.append(
+            {"type": "Ready", "status": "True", "lastTransitionTime": ready_at}
+        )
+
+    return {
+        "metadata": {
+            "uid": uid,
+            "name": uid,
+            "namespace": "sc2-demo",
+            "creationTimestamp": created_at,
+        },
+        "spec": {
+            "runtimeClassName": "kata-qemu-snp-sc2",
+            "containers": [{"name": "c"}],
+        },
+        "status": {"conditions": conditions},
+    }
+
+
+class TestTrackPods(TestCase):
+    def track_pods(self, pod_lists, num_pods):
+        def wait_for_k8s_objects(path, on_objects, params=None, timeout=None):
+            for pods in pod_lists:
+                if on_objects(pods):
+                    return True
+
+            print("ERROR: timed-out waiting for k8s objects")
+            raise RuntimeError("Timed-out waiting for k8s objects!")
+
+        with patch.multiple(
+            pod_tracker,
+            wait_for_k8s_objects=wait_for_k8s_objects,
+            get_runtime_snapshotter=lambda runtime_class: "nydus",
+            get_container_id_from_pod=lambda *args, **kwargs: "",
+        ), patch("builtins.print"):
+            records = pod_tracker.track_pods(num_pods=num_pods)
+
+        return {record["pod"]: record for record in records}
+
+    def test_existing_pod_uses_k8s_clock(self):
+        # The pod's k8s timestamps are far from the local clock, we must not
+        # compare them with the time we see the pod become ready
+        records = self.track_pods(
+            [
+                [make_pod("existing", "2026-01-01T00:00:00Z")],
+                [make_pod("existing", "2026-01-01T00:00:00Z", "2026-01-01T00:00:03Z")],
+            ],
+            num_pods=1,
+        )
+        self.assertEqual(records["existing"]["clock"], "k8s")
+        self.assertEqual(records["existing"]["latencies_ms"]["ready"], 3000.0)
+        self.assertFalse(records["existing"]["timed_out"])
+
+    def test_timeout_returns_partial_records(self):
+        records = self.track_pods(
+            [[], [make_pod("new", "2026-01-01T00:00:00Z")]], num_pods=1
+        )
+        self.assertEqual(records["new"]["clock"], "watch")
+        self.assertEqual(records["new"]["latencies_ms"], {"created": 0.0})
+        self.assertTrue(records["new"]["timed_out"])
+
+
+if __name__ == "__main__":
+    main()
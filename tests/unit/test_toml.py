@@ -0,0 +1,114 @@
+from copy import deepcopy
+from difflib import ndiff
+from os.path import dirname, join
+from tasks.util.toml import (
+    TomlPatchError,
+    do_remove_entry_from_toml,
+    merge_dicts_recursively,
+    patch_toml_str,
+)
+from toml import loads as toml_loads
+from unittest import TestCase, main
+
+# Output of `containerd config default` for CONTAINERD_VERSION. Re-generate it
+# with: inv containerd.dump-default-config
+CONTAINERD_CONFIG_FILE = join(
+    dirname(__file__), "data", "containerd_config_default.toml"
+)
+
+CRI = 'plugins."io.containerd.grpc.v1.cri"'
+
+# Updates that the tasks apply to containerd's config file
+KATA_UPDATE = """
+[{cri}.containerd.runtimes.kata-{runtime}]
+runtime_type = "io.containerd.kata-{runtime}.v2"
+privileged_without_host_devices = true
+pod_annotations = [ "io.katacontainers.*",]
+snapshotter = "nydus"
+
+[{cri}.containerd.runtimes.kata-{runtime}.options]
+ConfigPath = "/opt/kata/share/defaults/kata-containers/configuration-{runtime}.toml"
+"""
+UPDATES = [
+    '[debug]\nlevel = "debug"',
+    f"[{CRI}.containerd.runtimes.runc.options]\nSystemdCgroup = true",
+    f'[{CRI}.registry]\nconfig_path = "/etc/containerd/certs.d"',
+    '[proxy_plugins.nydus]\ntype = "snapshot"\naddress = "/run/nydus.sock"',
+]
+UPDATES += [
+    KATA_UPDATE.format(cri=CRI, runtime=runtime)
+    for runtime in ["qemu-snp", "qemu-snp-sc2", "qemu-tdx", "qemu-tdx-sc2"]
+]
+
+# Lines of the original file that the updates above change
+CHANGED_LINES = [
+    '  level = ""',
+    "            SystemdCgroup = false",
+    '      config_path = ""',
+]
+
+
+class TestPatchTomlStr(TestCase):
+    def setUp(self):
+        with open(CONTAINERD_CONFIG_FILE, "r") as fh:
+            self.toml_str = fh.read()
+        self.updates = [toml_loads(update) for update in UPDATES]
+
+    def patch(self, operations):
+        return patch_toml_str(self.toml_str, deepcopy(operations))
+
+    def merge(self, conf, updates):
+        conf = deepcopy(conf)
+        for update in updates:
+            merge_dicts_recursively(conf, deepcopy(update))
+        return conf
+
+    def test_update_matches_merge(self):
+        patched = self.patch([("update", update) for update in self.updates])
+        self.assertEqual(
+            toml_loads(patched), self.merge(toml_loads(self.toml_str), self.updates)
+        )
+
+    def test_update_keeps_untouched_lines(self):
+        patched = self.patch([("update", update) for update in self.updates])
+        diff = list(ndiff(self.toml_str.split("\n"), patched.split("\n")))
+
+        # We only remove the lines that we change, and keep all the others, in
+        # the same order
+        removed = [line[2:] for line in diff if line.startswith("- ")]
+        self.assertEqual(removed, CHANGED_LINES)
+
+    def test_update_keeps_comments(self):
+        self.toml_str = self.toml_str.replace(
+            '  level = ""',
+            '  # Set by inv containerd.set-log-level\n  level = ""  # info',
+        )
+        patched = self.patch([("update", self.updates[0])])
+        self.assertIn("  # Set by inv containerd.set-log-level\n", patched)
+        self.assertIn('  level = "debug"  # info\n', patched)
+
+    def test_update_is_idempotent(self):
+        operations = [("update", update) for update in self.updates]
+        patched = self.patch(operations)
+        self.toml_str = patched
+        self.assertEqual(self.patch(operations), patched)
+
+    def test_remove_matches_dict(self):
+        toml_path = f"{CRI}.containerd.runtimes.runc"
+        patched = self.patch([("remove", toml_path)])
+        self.assertEqual(
+            toml_loads(patched),
+            do_remove_entry_from_toml(toml_loads(self.toml_str), toml_path),
+        )
+
+    def test_refuse_array_of_tables(self):
+        update = toml_loads(
+            '[plugins."io.containerd.transfer.v1.local".unpack_config]\n'
+            'snapshotter = "nydus"'
+        )
+        with self.assertRaises(TomlPatchError):
+            self.patch([("update", update)])
+
+
+if __name__ == "__main__":
+    main()